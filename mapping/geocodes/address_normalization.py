@@ -0,0 +1,120 @@
+import re
+from typing import Optional
+import pandas as pd
+
+ADDRESS_SUFFIX: str = "South Carolina, USA"  # The end of every address, see canonical_address()
+
+# USPS street suffix abbreviations (USPS Publication 28, Appendix C1) for the suffixes common in the data
+SUFFIXES: dict[str, str] = {
+    'ALLEY': 'ALY', 'AVENUE': 'AVE', 'AV': 'AVE', 'BOULEVARD': 'BLVD', 'BRIDGE': 'BRG', 'BYPASS': 'BYP',
+    'CIRCLE': 'CIR', 'CONNECTOR': 'CONN', 'COURT': 'CT', 'COVE': 'CV', 'CROSSING': 'XING', 'DRIVE': 'DR',
+    'EXPRESSWAY': 'EXPY', 'EXTENSION': 'EXT', 'FREEWAY': 'FWY', 'HIGHWAY': 'HWY', 'LANE': 'LN',
+    'PARKWAY': 'PKWY', 'PLACE': 'PL', 'PLAZA': 'PLZ', 'POINT': 'PT', 'ROAD': 'RD', 'ROUTE': 'RTE', 'SQUARE': 'SQ',
+    'STREET': 'ST', 'STR': 'ST', 'TERRACE': 'TER', 'TRAIL': 'TRL', 'TURNPIKE': 'TPKE',
+}
+
+# USPS directional abbreviations
+DIRECTIONALS: dict[str, str] = {
+    'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+    'NORTHEAST': 'NE', 'NORTHWEST': 'NW', 'SOUTHEAST': 'SE', 'SOUTHWEST': 'SW',
+}
+
+# Route designators, rewritten as 'I 26', 'US 1' and 'SC 277'.
+# A bare 'HWY 17' is left alone since it may be a US or a state highway.
+ROUTES: list[tuple[re.Pattern, str]] = [
+    (re.compile(r"^(?:INTERSTATE|INTERSTATE HWY|IH|I)\s*-?\s*(\d+)\b"), 'I'),
+    (re.compile(r"^(?:US|U S)\s*(?:HWY|HIGHWAY|ROUTE|RTE)?\s*-?\s*(\d+)\b"), 'US'),
+    (re.compile(r"^(?:SC|S C|STATE)\s*(?:HWY|HIGHWAY|ROUTE|RTE|RD)?\s*-?\s*(\d+)\b"), 'SC'),
+]
+
+
+def normalize_street(name) -> str:
+    """
+    Normalize a street name: uppercase, without punctuation or repeated whitespace, with USPS suffix and directional
+    abbreviations and canonical route designators ('I 26', 'US 1', 'SC 277').
+    For example, "Main Street" becomes "MAIN ST" and "S.C. Hwy-277" becomes "SC 277".
+    :param name: The street name. May be missing.
+    :return: The normalized street name, or an empty string if the name is missing.
+    """
+    if name is None or pd.isnull(name):
+        return ""
+
+    name = str(name).upper().replace('.', '')
+    name = ' '.join(re.sub(r"[^\w\s-]", ' ', name).split())
+
+    for pattern, designator in ROUTES:
+        match = pattern.match(name)
+        if match:
+            name = f"{designator} {int(match.group(1))}{name[match.end():]}"
+            break
+
+    tokens = name.split()
+    if not tokens:
+        return ""
+
+    # Directionals come first or last, e.g. "N MAIN ST" or "MAIN ST N"
+    tokens[0] = DIRECTIONALS.get(tokens[0], tokens[0]) if len(tokens) > 1 else tokens[0]
+    tokens[-1] = DIRECTIONALS.get(tokens[-1], tokens[-1]) if len(tokens) > 1 else tokens[-1]
+
+    # The suffix is the last token, or the one before a trailing directional or extension, e.g. "MAIN ST EXT"
+    suffix = len(tokens) - 2 if len(tokens) > 2 and tokens[-1] in {*DIRECTIONALS.values(), 'EXT'} else len(tokens) - 1
+    if suffix > 0:
+        tokens[suffix] = SUFFIXES.get(tokens[suffix], tokens[suffix])
+
+    return ' '.join(tokens)
+
+
+def canonical_address(als=None, alsb=None) -> str:
+    """
+    Get the canonical address of one or two streets, used both as the cache key and as the geocoding query.
+    Street names are normalized and intersections are ordered alphabetically, so that "Main Street & I-26" and
+    "I 26 & MAIN ST" share the key "I 26, MAIN ST, South Carolina, USA".
+    :param als: The first street name. May be missing.
+    :param alsb: The second street name. May be missing.
+    :return: The canonical address, or an empty string if both street names are missing.
+    """
+    names = sorted({name for name in (normalize_street(als), normalize_street(alsb)) if name})
+    return ", ".join(names + [ADDRESS_SUFFIX]) if names else ""
+
+
+def canonical_addresses(als: pd.Series, alsb: Optional[pd.Series] = None) -> pd.Series:
+    """
+    Vectorized equivalent of canonical_address(). Each distinct street name is normalized only once.
+    :param als: The first street names.
+    :param alsb: The second street names, indexed like `als`. If None, only the first street names are used.
+    :return: The canonical addresses, indexed like `als`.
+    """
+    streets = pd.concat([als, alsb]) if alsb is not None else als
+    normalized = {name: normalize_street(name) for name in streets.dropna().unique()}
+
+    first = als.map(normalized).fillna('')
+    second = alsb.map(normalized).fillna('') if alsb is not None else pd.Series('', index=als.index)
+
+    # Order the two streets alphabetically, and drop the second one if it is the same street
+    swap = (second != '') & ((first == '') | (second < first))
+    first, second = first.where(~swap, second), second.where(~swap, first)
+    second = second.where(second != first, '')
+
+    addresses = first + ', ' + (second + ', ').where(second != '', '') + ADDRESS_SUFFIX
+    return addresses.where(first != '', '')
+
+
+def split_address(address: str) -> list[str]:
+    """
+    Split an address back into its street names.
+    :param address: The address as a string.
+    :return: The street names of the address (one or two).
+    """
+    streets = address[:-len(ADDRESS_SUFFIX)] if address.endswith(ADDRESS_SUFFIX) else address
+    return [street.strip() for street in streets.split(', ') if street.strip()]
+
+
+def rekey(address: Optional[str]) -> str:
+    """
+    Get the canonical address of an address built before normalization (see canonical_address()).
+    :param address: The address as a string. May be missing.
+    :return: The canonical address, or an empty string if the address is missing.
+    """
+    if address is None or pd.isnull(address):
+        return ""
+    return canonical_address(*split_address(address)[:2])
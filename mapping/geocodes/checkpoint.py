@@ -0,0 +1,107 @@
+import csv
+import json
+import os
+from pathlib import Path
+from time import time
+from typing import Optional
+import pandas as pd
+
+CHECKPOINT_INTERVAL: float = 60.0  # Minimum number of seconds between two progress saves
+
+
+class Checkpoint:
+    """
+    The partial output and progress of a geocoding job, saved to disk as results come in so that an interrupted
+    job (e.g. a preempted SLURM job) can be resumed where it stopped.
+    The directory contains `results.csv`, the geocoded unique addresses, appended to and flushed as they come in,
+    and `progress.json`, the job parameters and progress counters, saved every `interval` seconds.
+    """
+
+    def __init__(self, directory: str, params: dict, resume: bool = False, interval: float = CHECKPOINT_INTERVAL):
+        """
+        :param directory: The checkpoint directory.
+        :param params: The job parameters, saved with the progress. Resuming with other parameters prints a warning.
+        :param resume: If True, continue from the existing checkpoint, otherwise start over.
+        :param interval: The minimum number of seconds between two progress saves.
+        """
+        self.directory: Path = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.results_path: Path = self.directory / 'results.csv'
+        self.progress_path: Path = self.directory / 'progress.json'
+
+        self.params: dict = params
+        self.interval: float = interval
+        self.total: int = 0
+        self.done: int = 0
+        self.last_save: float = time()
+
+        if resume and self.progress_path.exists():
+            with open(self.progress_path, 'r') as f:
+                progress = json.load(f)
+            if progress['params'] != params:
+                print(f"Warning: resuming '{self.directory}' with other parameters than {progress['params']}")
+            print(f"Resuming from '{self.directory}' ({progress['done']:,} of {progress['total']:,} addresses done)")
+        else:
+            with open(self.results_path, 'w', newline='') as f:
+                csv.writer(f).writerow(['address', 'latitude', 'longitude'])
+
+        self.file = open(self.results_path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+
+    def completed(self) -> pd.DataFrame:
+        """
+        Get the results already saved, including those of the runs being resumed.
+        :return: A dataframe indexed by address with the columns 'latitude' and 'longitude'.
+        """
+        self.file.flush()
+
+        # Rows cut off by a crash while being written are skipped
+        results = pd.read_csv(self.results_path, index_col='address', on_bad_lines='skip',
+                              dtype={'latitude': float, 'longitude': float})
+        return results[~results.index.duplicated(keep='last')]
+
+    def start(self, total: int, done: int) -> None:
+        """
+        Set the progress counters at the start of a run.
+        :param total: The number of addresses of the job.
+        :param done: The number of addresses already done.
+        """
+        self.total, self.done = total, done
+        self.save()
+
+    def add(self, results: list[tuple[str, Optional[float], Optional[float]]]) -> None:
+        """
+        Save results as they come in, and the progress if the last save is older than the interval.
+        :param results: A list of tuples containing the address, latitude, and longitude.
+        """
+        self.writer.writerows(results)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+        self.done += len(results)
+        if time() - self.last_save >= self.interval:
+            self.save()
+
+    def save(self, finished: bool = False) -> None:
+        """
+        Save the progress. The file is replaced atomically, so that a crash never leaves it half-written.
+        :param finished: Whether the job is finished.
+        """
+        progress = {'params': self.params, 'total': self.total, 'done': self.done, 'finished': finished,
+                    'updated': time()}
+
+        tmp_path = self.progress_path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f, indent=2)
+        os.replace(tmp_path, self.progress_path)
+
+        self.last_save = time()
+        print(f"Checkpoint: {self.done:,} of {self.total:,} addresses done")
+
+    def close(self, finished: bool = False) -> None:
+        """
+        Save the progress and close the results file.
+        :param finished: Whether the job is finished.
+        """
+        self.save(finished)
+        self.file.close()
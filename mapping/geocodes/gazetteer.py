@@ -0,0 +1,253 @@
+import argparse
+import sqlite3
+from typing import Optional
+import pandas as pd
+from address_normalization import normalize_street, split_address
+from geocoding_funcs import DB_PATH, SC_BOUNDS, open_cache
+
+GAZETTEER_PATH: str = 'gazetteer.db'  # The offline street and intersection index
+
+
+def in_sc(df: pd.DataFrame) -> pd.Series:
+    """
+    Check which points are inside the bounding box of South Carolina.
+    :param df: A dataframe with the columns 'latitude' and 'longitude'.
+    :return: A boolean series.
+    """
+    min_lon, min_lat, max_lon, max_lat = SC_BOUNDS
+    return df['latitude'].between(min_lat, max_lat) & df['longitude'].between(min_lon, max_lon)
+
+
+def from_cache(cache_path: str = DB_PATH) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extract the streets and intersections already resolved in the geocode cache.
+    :param cache_path: The path to the cache database.
+    :return: A tuple containing the streets (columns 'name', 'latitude', 'longitude') and the intersections
+             (columns 'street_a', 'street_b', 'latitude', 'longitude').
+    """
+    conn = open_cache(cache_path)
+    try:
+        cache = pd.read_sql_query("SELECT address, latitude, longitude, resolved_by FROM cache "
+                                  "WHERE outcome = 'found' AND address IS NOT NULL", conn)
+    finally:
+        conn.close()
+
+    cache = cache[in_sc(cache)]
+    names = cache['address'].map(split_address)
+
+    streets = cache[names.str.len() == 1].assign(name=names.str[0])
+
+    # Only keep the intersections that were resolved as such, not through the `als` fallback
+    as_intersection = cache['resolved_by'].isna() | (cache['resolved_by'] == cache['address'])
+    is_intersection = (names.str.len() == 2) & as_intersection
+    intersections = cache[is_intersection].assign(street_a=names.str[0], street_b=names.str[1])
+
+    return (streets[['name', 'latitude', 'longitude']],
+            intersections[['street_a', 'street_b', 'latitude', 'longitude']])
+
+
+def from_roads(roads_path: str, name_column: str = 'name') -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extract the streets and intersections of a road network, e.g. a TIGER/Line roads shapefile (`FULLNAME` column)
+    or an OSM extract converted to GeoJSON or GeoPackage (`name` column).
+    Intersections are the vertices shared by differently named roads.
+    :param roads_path: The path to the road network, in any format readable by geopandas.
+    :param name_column: The column containing the street names.
+    :return: A tuple containing the streets and the intersections, as in from_cache().
+    """
+    import geopandas as gpd  # Only needed to build from a road network
+
+    roads = gpd.read_file(roads_path, columns=[name_column])
+    roads = roads[roads[name_column].notna() & roads.geometry.notna()].to_crs(epsg=4326)
+
+    # One row per vertex of every road
+    vertices = roads.geometry.get_coordinates()
+    vertices = vertices.join(roads[name_column].rename('name')).rename(columns={'x': 'longitude', 'y': 'latitude'})
+    vertices = vertices[in_sc(vertices)].reset_index(drop=True)
+
+    # Locate each street at its vertex closest to the mean of its vertices, so that the point is on the street
+    grouped = vertices.groupby('name')
+    distance = ((vertices['latitude'] - grouped['latitude'].transform('mean')) ** 2 +
+                (vertices['longitude'] - grouped['longitude'].transform('mean')) ** 2)
+    streets = vertices.loc[distance.groupby(vertices['name']).idxmin(), ['name', 'latitude', 'longitude']]
+
+    # Find the vertices shared by at least two street names
+    vertices[['latitude', 'longitude']] = vertices[['latitude', 'longitude']].round(6)
+    vertices = vertices.drop_duplicates()
+    shared = vertices[vertices.duplicated(['latitude', 'longitude'], keep=False)]
+
+    # Pair the street names at each shared vertex, and average the vertices of each pair
+    pairs = shared.merge(shared, on=['latitude', 'longitude'], suffixes=('_a', '_b'))
+    pairs = pairs[pairs['name_a'] < pairs['name_b']].rename(columns={'name_a': 'street_a', 'name_b': 'street_b'})
+    intersections = pairs.groupby(['street_a', 'street_b'], as_index=False)[['latitude', 'longitude']].mean()
+
+    return streets, intersections
+
+
+def build(out_path: str = GAZETTEER_PATH, cache_path: Optional[str] = None, roads_path: Optional[str] = None,
+          name_column: str = 'name') -> None:
+    """
+    Build the gazetteer from a road network and/or the geocode cache. Road network entries take precedence.
+    :param out_path: The path to the gazetteer database. It is overwritten.
+    :param cache_path: The path to the cache database, if it should be used.
+    :param roads_path: The path to the road network, if it should be used.
+    :param name_column: The column of the road network containing the street names.
+    """
+    sources = []
+    if roads_path is not None:
+        print(f"Reading the road network '{roads_path}'...")
+        sources.append(from_roads(roads_path, name_column))
+    if cache_path is not None:
+        print(f"Reading the geocode cache '{cache_path}'...")
+        sources.append(from_cache(cache_path))
+
+    streets = pd.concat([source[0] for source in sources], ignore_index=True)
+    intersections = pd.concat([source[1] for source in sources], ignore_index=True)
+
+    # Key the entries by normalized name, intersections in an order-independent way
+    streets['key'] = streets['name'].map(normalize_street)
+    key_a, key_b = intersections['street_a'].map(normalize_street), intersections['street_b'].map(normalize_street)
+    intersections['key_a'] = key_a.where(key_a <= key_b, key_b)
+    intersections['key_b'] = key_b.where(key_a <= key_b, key_a)
+
+    streets = streets.drop_duplicates('name')
+    intersections = intersections.drop_duplicates(['street_a', 'street_b'])
+
+    conn = sqlite3.connect(out_path)
+    try:
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS streets")
+            conn.execute("DROP TABLE IF EXISTS intersections")
+            streets[['name', 'key', 'latitude', 'longitude']].to_sql('streets', conn, index=False)
+            intersections[['street_a', 'street_b', 'key_a', 'key_b', 'latitude', 'longitude']].to_sql(
+                'intersections', conn, index=False)
+        conn.execute("VACUUM")  # Keep the file compact
+    finally:
+        conn.close()
+
+    print(f"Gazetteer saved as '{out_path}' with {streets.shape[0]:,} streets "
+          f"and {intersections.shape[0]:,} intersections")
+
+
+class Gazetteer:
+    """
+    An offline geocoder for street names and intersections, loaded from a gazetteer built with build().
+    Names are first looked up exactly, then by normalized name. Keeps track of its hit rate, and separately of the
+    intersections only located by their first street (see resolve_streets()).
+    """
+
+    def __init__(self, path: str = GAZETTEER_PATH):
+        """
+        :param path: The path to the gazetteer database.
+        """
+        conn = sqlite3.connect(path)
+        try:
+            streets = pd.read_sql_query("SELECT * FROM streets", conn)
+            intersections = pd.read_sql_query("SELECT * FROM intersections", conn)
+        finally:
+            conn.close()
+
+        def to_dict(df: pd.DataFrame, columns: list[str]) -> dict:
+            keys = df[columns[0]] if len(columns) == 1 else zip(*(df[column] for column in columns))
+            return dict(zip(keys, zip(df['latitude'], df['longitude'])))
+
+        # Exact names, then normalized names. Later entries do not override earlier ones
+        self.streets: list[dict] = [to_dict(streets[::-1], ['name']), to_dict(streets[::-1], ['key'])]
+        self.intersections: list[dict] = [to_dict(intersections[::-1], ['street_a', 'street_b']),
+                                          to_dict(intersections[::-1], ['key_a', 'key_b'])]
+        self.lookups: int = 0
+        self.hits: int = 0
+        self.street_hits: int = 0
+
+    def lookup_street(self, name: str) -> Optional[tuple[float, float]]:
+        """
+        Look up a street.
+        :param name: The street name.
+        :return: A tuple containing the latitude and longitude, or None if the street is unknown.
+        """
+        return self.streets[0].get(name) or self.streets[1].get(normalize_street(name))
+
+    def lookup_intersection(self, street_a: str, street_b: str) -> Optional[tuple[float, float]]:
+        """
+        Look up the intersection of two streets, in any order.
+        :param street_a: The first street name.
+        :param street_b: The second street name.
+        :return: A tuple containing the latitude and longitude, or None if the intersection is unknown.
+        """
+        exact = self.intersections[0].get((street_a, street_b)) or self.intersections[0].get((street_b, street_a))
+        if exact:
+            return exact
+        return self.intersections[1].get(tuple(sorted((normalize_street(street_a), normalize_street(street_b)))))
+
+    def lookup(self, address: str) -> Optional[tuple[float, float]]:
+        """
+        Geocode an address built by get_address(), a street or an intersection. An unknown intersection is not
+        located by one of its streets, as the network may still geocode it exactly (see resolve_streets()).
+        :param address: The address as a string.
+        :return: A tuple containing the latitude and longitude, or None if the address is unknown.
+        """
+        names = split_address(address)
+        coords = None
+        if len(names) == 2:
+            coords = self.lookup_intersection(*names)
+        elif len(names) == 1:
+            coords = self.lookup_street(names[0])
+
+        self.lookups += 1
+        self.hits += coords is not None
+        return coords
+
+    def resolve(self, addresses: pd.Series) -> pd.DataFrame:
+        """
+        Geocode the addresses found in the gazetteer.
+        :param addresses: A series indexed by unique address (see geocoding_funcs.unique_addresses()).
+        :return: A dataframe indexed by address with the columns 'latitude' and 'longitude', for the addresses found.
+        """
+        coords = {address: self.lookup(address) for address in addresses.index}
+        return pd.DataFrame.from_dict({address: c for address, c in coords.items() if c is not None},
+                                      orient='index', columns=['latitude', 'longitude'])
+
+    def resolve_streets(self, addresses: pd.Series) -> pd.DataFrame:
+        """
+        Geocode addresses by their `als` street only, like the fallback of geocode_address(). Meant for the
+        addresses that the network could not geocode either, as the street is located at one of its points. These
+        matches are counted in `street_hits`, not in the hit rate.
+        :param addresses: A series indexed by address, containing the trimmed address of each (see
+                          geocoding_funcs.unique_addresses()).
+        :return: A dataframe indexed by address with the columns 'latitude' and 'longitude', for the addresses found.
+        """
+        coords = {}
+        for address, trimmed in addresses.items():
+            names = split_address(trimmed) if trimmed else []
+            street = self.lookup_street(names[0]) if names else None
+            if street is not None:
+                coords[address] = street
+
+        self.street_hits += len(coords)
+        return pd.DataFrame.from_dict(coords, orient='index', columns=['latitude', 'longitude'])
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        The fraction of the lookups found exactly in the gazetteer.
+        """
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline street and intersection gazetteer")
+    parser.add_argument("--out", type=str, default=GAZETTEER_PATH,
+                        help=f"The path to the gazetteer database. Default is {GAZETTEER_PATH}.")
+    parser.add_argument("--cache", type=str, default=None,
+                        help=f"The geocode cache to import, e.g. {DB_PATH}.")
+    parser.add_argument("--roads", type=str, default=None,
+                        help="The road network to import, e.g. a TIGER/Line roads shapefile or an OSM extract.")
+    parser.add_argument("--name_column", type=str, default='name',
+                        help="The column of the road network containing the street names, e.g. FULLNAME for "
+                             "TIGER/Line. Default is name.")
+    args = parser.parse_args()
+
+    if args.cache is None and args.roads is None:
+        parser.error("At least one of --cache and --roads is required.")
+
+    build(args.out, args.cache, args.roads, args.name_column)
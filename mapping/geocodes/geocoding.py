@@ -1,43 +1,149 @@
+import argparse
+import asyncio
 import pandas as pd
 import geopandas as gpd
 import folium
-from collections import defaultdict
 import multiprocessing as mp
-from numpy import array_split
+from typing import Optional
 from geocoding_funcs import *
+from geocoding_async import GeocodingBackend, MockBackend, NominatimBackend, geocode_addresses_async
+from gazetteer import Gazetteer
+from checkpoint import Checkpoint
 
 
-def geocode() -> pd.DataFrame:
+def concat_coords(*frames: pd.DataFrame) -> pd.DataFrame:
     """
-    Geocode the street locations using multiprocessing.
-    :return: A dataframe containing the street locations with latitude and longitude.
+    Concatenate coordinates, leaving out the empty frames, whose concatenation is deprecated by pandas.
+    :param frames: The coordinates, indexed by address.
+    :return: The concatenated coordinates.
     """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=['latitude', 'longitude'], dtype=float)
 
-    # Load the data
-    df = pd.read_csv('../sc_data/sc_loc2018.csv').sample(frac=0.1)
-    print(f"Number of rows: {df.shape[0]:,}")
+    return pd.concat(frames)
 
-    # Split the dataframe into chunks
-    num_processes = mp.cpu_count() - 8
-    print(f"Number of processes: {num_processes}")
 
-    print(f"Splitting Array...")
-    chunks = array_split(df, num_processes)
-
-    # Use multiprocessing to geocode in parallel
-    print(f"Use multiprocessing...")
-    with mp.Pool(num_processes) as pool:
-        all_results = pool.map(process_chunk, chunks)
+def geocode(csv_file: str = '../sc_data/sc_loc2018.csv', frac: float = 0.1, mode: str = 'pool',
+            backend: Optional[GeocodingBackend] = None, rate: float = 1.0, concurrency: int = 8,
+            timeout: float = 10.0, negative_ttl: float = NEGATIVE_TTL, gazetteer: Optional[str] = None,
+            checkpoint_dir: Optional[str] = None, resume: bool = False, chunk_size: int = 100) -> pd.DataFrame:
+    """
+    Geocode the street locations, either using multiprocessing or the async engine.
+    If a gazetteer is given, addresses are resolved offline first and only its misses reach the network.
+    Results are streamed back as they come in and, if a checkpoint directory is given, saved there so that an
+    interrupted job can be resumed.
+    :param csv_file: The path to the csv file.
+    :param frac: The fraction of the rows to geocode (a reproducible sample). 1 geocodes the full year.
+    :param mode: 'pool' to geocode with a multiprocessing pool, 'async' to use the async engine.
+    :param backend: The backend of the async engine. Defaults to Nominatim. Ignored in 'pool' mode.
+    :param rate: The maximum number of requests per second of the async engine. Ignored in 'pool' mode.
+    :param concurrency: The maximum number of requests in flight of the async engine. Ignored in 'pool' mode.
+    :param timeout: The timeout of a single request of the async engine, in seconds. Ignored in 'pool' mode.
+    :param negative_ttl: How long addresses without results are skipped before being retried, in seconds.
+    :param gazetteer: The path to an offline gazetteer built with gazetteer.py, if it should be used.
+    :param checkpoint_dir: The directory to checkpoint the job to, if it should be checkpointed.
+    :param resume: If True, resume the job from its checkpoint instead of starting over.
+    :param chunk_size: The number of addresses sent to a worker at once in 'pool' mode.
+    :return: A dataframe containing the street locations with latitude and longitude.
+    """
 
-    # Flatten results and update dataframe
-    print(f"Flattening Results...")
-    results_dict = defaultdict(lambda: [None, None])
-    for chunk_result in all_results:
-        for idx, lat, lon in chunk_result:
-            results_dict[idx] = [lat, lon]
+    # Load the data
+    df = pd.read_csv(csv_file, low_memory=False)
+    if frac < 1:
+        df = df.sample(frac=frac, random_state=0)  # Fixed seed, so that a resumed job samples the same rows
+    print(f"Number of rows: {df.shape[0]:,}")
 
-    df['latitude'] = df.index.map(lambda idx: results_dict[idx][0])
-    df['longitude'] = df.index.map(lambda idx: results_dict[idx][1])
+    # Geocode each unique address only once
+    addresses = unique_addresses(df)
+    print(f"Number of unique addresses: {addresses.shape[0]:,}")
+
+    # Skip the addresses already done by the job being resumed
+    checkpoint = None
+    coords = pd.DataFrame(columns=['latitude', 'longitude'], dtype=float)
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, {'csv_file': csv_file, 'frac': frac}, resume=resume)
+        coords = checkpoint.completed()
+        print(f"Number of addresses done by previous runs: {coords.shape[0]:,}")
+
+    # Resolve the cached addresses in bulk, so that only the unresolved addresses reach the workers
+    # Known-bad addresses are cached too, and skipped until their TTL expires
+    print(f"Resolving cached addresses...")
+    unresolved = addresses[~addresses.index.isin(coords.index)]
+    cached = lookup_cached(unresolved.index, negative_ttl=negative_ttl)
+    coords = concat_coords(coords, cached[['latitude', 'longitude']])
+    unresolved = unresolved[~unresolved.index.isin(cached.index)]
+    print(f"Number of cached addresses: {(cached['outcome'] == 'found').sum():,}")
+    print(f"Number of known-bad addresses skipped: {(cached['outcome'] != 'found').sum():,}")
+
+    # Resolve the remaining addresses offline, if possible
+    local = Gazetteer(gazetteer) if gazetteer is not None else None
+    if local is not None and not unresolved.empty:
+        print(f"Resolving addresses with the gazetteer...")
+        local_coords = local.resolve(unresolved)
+        coords = concat_coords(coords, local_coords)
+        unresolved = unresolved[~unresolved.index.isin(local_coords.index)]
+        print(f"Gazetteer hit rate: {local.hit_rate:.2%} ({local.hits:,} of {local.lookups:,} addresses)")
+
+    print(f"Number of addresses left to geocode: {unresolved.shape[0]:,}")
+
+    # Collect the results as they come in
+    geocoded: list[tuple[str, Optional[float], Optional[float]]] = []
+
+    def collect(results: list[tuple[str, Optional[float], Optional[float]]]) -> None:
+        geocoded.extend(results)
+        if checkpoint is not None:
+            checkpoint.add(results)
+
+    if checkpoint is not None:
+        checkpoint.start(total=addresses.shape[0], done=addresses.shape[0] - unresolved.shape[0])
+
+    try:
+        if not unresolved.empty and mode == 'async':
+            print(f"Use the async engine...")
+            asyncio.run(geocode_addresses_async(unresolved, backend or NominatimBackend(), rate=rate,
+                                                concurrency=concurrency, timeout=timeout,
+                                                negative_ttl=negative_ttl, on_result=lambda r: collect([r])))
+
+        elif not unresolved.empty:
+            num_processes = max(1, min(mp.cpu_count() - 8, unresolved.shape[0]))
+            print(f"Number of processes: {num_processes}")
+
+            # Split the unresolved addresses into small chunks, so that results stream back steadily
+            print(f"Splitting Array...")
+            chunks = [unresolved.iloc[i:i + chunk_size] for i in range(0, unresolved.shape[0], chunk_size)]
+
+            # Use multiprocessing to geocode in parallel
+            # Each worker opens the cache and the geocoder once, in `init_worker`
+            print(f"Use multiprocessing...")
+            with mp.Pool(num_processes, initializer=init_worker, initargs=(DB_PATH, negative_ttl)) as pool:
+                for chunk_result in pool.imap_unordered(process_chunk, chunks):
+                    collect(chunk_result)
+
+                # Let the workers exit normally so that their geocoding contexts are closed
+                pool.close()
+                pool.join()
+
+    finally:  # Record the progress even if the job is interrupted
+        if checkpoint is not None:
+            checkpoint.close(finished=len(geocoded) == unresolved.shape[0])
+
+    if geocoded:
+        geocoded = pd.DataFrame(geocoded, columns=['address', 'latitude', 'longitude']).set_index('address')
+        coords = concat_coords(coords, geocoded.astype(float))
+
+    # Locate the addresses that the network could not geocode either by their `als` street, if the gazetteer knows it
+    if local is not None:
+        failed = addresses[~addresses.index.isin(coords.dropna().index)]
+        street_coords = local.resolve_streets(failed)
+        coords = concat_coords(coords[~coords.index.isin(street_coords.index)], street_coords)
+        print(f"Addresses located by their first street only: {local.street_hits:,} of {failed.shape[0]:,}")
+
+    # Broadcast the coordinates of each unique address back to its rows
+    print(f"Broadcasting Results...")
+    row_addresses = get_addresses(df)
+    df['latitude'] = row_addresses.map(coords['latitude'])
+    df['longitude'] = row_addresses.map(coords['longitude'])
 
     # Remove rows with failed geocoding
     df = df.dropna(subset=['latitude', 'longitude'])
@@ -73,5 +179,47 @@ def create_map(df: pd.DataFrame) -> None:
 
 
 if __name__ == "__main__":
-    df = geocode()
+    parser = argparse.ArgumentParser(description="Geocode the street locations and map them")
+    parser.add_argument("--csv_file", type=str, default='../sc_data/sc_loc2018.csv',
+                        help="The path to the csv file. Default is ../sc_data/sc_loc2018.csv.")
+    parser.add_argument("--frac", type=float, default=0.1,
+                        help="The fraction of the rows to geocode. Use 1 for the full year. Default is 0.1.")
+    parser.add_argument("--mode", choices=['pool', 'async'], default='pool',
+                        help="Geocode with a multiprocessing pool or with the async engine. Default is pool.")
+    parser.add_argument("--backend", choices=['nominatim', 'mock'], default='nominatim',
+                        help="The backend of the async engine. Default is nominatim.")
+    parser.add_argument("--domain", type=str, default='nominatim.openstreetmap.org',
+                        help="The domain of the Nominatim server, e.g. a local instance. "
+                             "Default is nominatim.openstreetmap.org.")
+    parser.add_argument("--scheme", choices=['http', 'https'], default='https',
+                        help="The scheme of the Nominatim server. Default is https.")
+    parser.add_argument("--rate", type=float, default=1.0,
+                        help="The maximum number of requests per second of the async engine. Default is 1.")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="The maximum number of requests in flight of the async engine. Default is 8.")
+    parser.add_argument("--timeout", type=float, default=10.0,
+                        help="The timeout of a single request of the async engine, in seconds. Default is 10.")
+    parser.add_argument("--negative_ttl", type=float, default=NEGATIVE_TTL / (24 * 60 * 60),
+                        help="How long addresses without results are skipped before being retried, in days. "
+                             "Default is 30.")
+    parser.add_argument("--gazetteer", type=str, default=None,
+                        help="The offline gazetteer built with gazetteer.py. If given, the network is only used "
+                             "for the addresses it misses.")
+    parser.add_argument("--checkpoint_dir", type=str, default=None,
+                        help="The directory to checkpoint the job to, so that it can be resumed with --resume.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume the job from its checkpoint (--checkpoint_dir) instead of starting over.")
+    parser.add_argument("--chunk_size", type=int, default=100,
+                        help="The number of addresses sent to a worker at once in pool mode. Default is 100.")
+    args = parser.parse_args()
+
+    if args.resume and args.checkpoint_dir is None:
+        parser.error("--resume requires --checkpoint_dir.")
+
+    backend = None
+    if args.mode == 'async':
+        backend = MockBackend() if args.backend == 'mock' else NominatimBackend(args.domain, args.scheme)
+
+    df = geocode(args.csv_file, args.frac, args.mode, backend, args.rate, args.concurrency, args.timeout,
+                 args.negative_ttl * 24 * 60 * 60, args.gazetteer, args.checkpoint_dir, args.resume, args.chunk_size)
     create_map(df)
@@ -15,8 +15,9 @@ source activate /home/niting/miniconda3/envs/alive-25
 echo $CONDA_DEFAULT_ENV
 
 #Run script
+#Checkpointed so that a preempted or requeued job resumes where it stopped
 hostname
-python3 geocoding.py
+python3 geocoding.py --checkpoint_dir checkpoints/sc_loc2018 --resume
 
 #Exit the conda system
 conda deactivate
\ No newline at end of file
@@ -0,0 +1,265 @@
+import asyncio
+import argparse
+from abc import ABC, abstractmethod
+import hashlib
+import os
+import tempfile
+from time import perf_counter
+from typing import Callable, Optional
+from random import randint
+import pandas as pd
+from geopy.geocoders import Nominatim
+from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+from geocoding_funcs import DB_PATH, ERROR_TTL, NEGATIVE_TTL, SC_BOUNDS, GeocodingContext
+
+
+class TokenBucket:
+    """
+    A token-bucket rate limiter shared by all the requests of the engine.
+    Tokens are refilled at `rate` per second, up to `capacity`; each request takes one token.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        """
+        :param rate: The number of requests allowed per second.
+        :param capacity: The maximum number of requests that can be sent in a burst.
+        """
+        self.rate: float = rate
+        self.capacity: int = capacity
+        self.tokens: float = capacity
+        self.last: Optional[float] = None
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Wait until a token is available and take it.
+        """
+        async with self.lock:  # Waiting requests are served in order
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self.last is not None:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GeocodingBackend(ABC):
+    """
+    The interface of the backends of the async engine.
+    A backend resolves a single address; rate limiting, timeouts, retries and caching are left to the engine.
+    """
+
+    async def __aenter__(self) -> 'GeocodingBackend':
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    @abstractmethod
+    async def geocode(self, address: str) -> Optional[tuple[float, float]]:
+        """
+        Geocode the address.
+        :param address: The address as a string.
+        :return: A tuple containing the latitude and longitude, or None if the address was not found.
+        """
+
+    async def close(self) -> None:
+        """
+        Release the resources of the backend.
+        """
+
+
+class NominatimBackend(GeocodingBackend):
+    """
+    A Nominatim server, queried through geopy's aiohttp adapter (requires `aiohttp`).
+    Point `domain` and `scheme` to a local Nominatim instance to geocode offline.
+    """
+
+    def __init__(self, domain: str = 'nominatim.openstreetmap.org', scheme: str = 'https'):
+        """
+        :param domain: The domain of the Nominatim server.
+        :param scheme: The scheme of the Nominatim server ('http' or 'https').
+        """
+        from geopy.adapters import AioHTTPAdapter  # Only needed for this backend
+
+        self.geolocator = Nominatim(user_agent=f"my_app_{randint(0, 10000)}", domain=domain, scheme=scheme,
+                                    adapter_factory=AioHTTPAdapter)
+
+    async def __aenter__(self) -> 'NominatimBackend':
+        await self.geolocator.__aenter__()
+        return self
+
+    async def geocode(self, address: str) -> Optional[tuple[float, float]]:
+        location = await self.geolocator.geocode(address, timeout=None)  # Timeouts are handled by the engine
+        return (location.latitude, location.longitude) if location else None
+
+    async def close(self) -> None:
+        await self.geolocator.__aexit__(None, None, None)
+
+
+class MockBackend(GeocodingBackend):
+    """
+    A local stand-in for a geocoding service, for testing and throughput benchmarking without the network.
+    Addresses are resolved from `known` if given; otherwise each address gets a deterministic point inside
+    South Carolina, and a deterministic fraction of the addresses are not found.
+    """
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.1,
+                 known: Optional[dict[str, tuple[float, float]]] = None):
+        """
+        :param latency: The simulated response time of a request, in seconds.
+        :param failure_rate: The fraction of the addresses that are not found. Ignored if `known` is given.
+        :param known: A mapping from address to (latitude, longitude).
+        """
+        self.latency: float = latency
+        self.failure_rate: float = failure_rate
+        self.known: Optional[dict[str, tuple[float, float]]] = known
+
+    async def geocode(self, address: str) -> Optional[tuple[float, float]]:
+        await asyncio.sleep(self.latency)
+        if self.known is not None:
+            return self.known.get(address)
+
+        # Derive three uniform numbers in [0, 1) from the hash of the address
+        digest = hashlib.sha1(address.encode()).digest()
+        u_fail, u_lat, u_lon = (int.from_bytes(digest[i:i + 4], 'big') / 2 ** 32 for i in (0, 4, 8))
+        if u_fail < self.failure_rate:
+            return None
+
+        min_lon, min_lat, max_lon, max_lat = SC_BOUNDS
+        return min_lat + u_lat * (max_lat - min_lat), min_lon + u_lon * (max_lon - min_lon)
+
+
+async def resolve(backend: GeocodingBackend, limiter: TokenBucket, address: str, timeout: float,
+                  max_retries: int) -> tuple[Optional[tuple[float, float]], int, str]:
+    """
+    Geocode an address through the shared rate limiter, retrying on timeouts and service errors.
+    :param backend: The geocoding backend.
+    :param limiter: The rate limiter shared by all requests.
+    :param address: The address as a string.
+    :param timeout: The timeout of a single request, in seconds.
+    :param max_retries: The maximum number of attempts.
+    :return: A tuple containing the coordinates (None if the address could not be geocoded), the number of attempts,
+             and the outcome ('found', 'not_found' or 'error').
+    """
+    for attempt in range(max_retries):
+        await limiter.acquire()
+        try:
+            coords = await asyncio.wait_for(backend.geocode(address), timeout)
+            return coords, attempt + 1, 'found' if coords is not None else 'not_found'
+
+        except (asyncio.TimeoutError, GeocoderTimedOut, GeocoderServiceError) as e:  # Retry on timeout
+            if attempt < max_retries - 1:
+                sleep_time = 2 ** attempt  # exponential backoff, other requests keep using the limiter meanwhile
+                print(f"Error geocoding {address}: {str(e) or 'timed out'}. Retrying in {sleep_time} seconds...")
+                await asyncio.sleep(sleep_time)
+            else:  # Max retries reached
+                print(f"Max retries reached for address: {address}")
+
+        except Exception as e:
+            print(f"Unexpected error geocoding {address}: {str(e)}")
+            break
+
+    return None, attempt + 1, 'error'
+
+
+async def geocode_addresses_async(addresses: pd.Series, backend: GeocodingBackend, rate: float = 1.0,
+                                  concurrency: int = 8, timeout: float = 10.0, max_retries: int = 5,
+                                  db_path: str = DB_PATH, negative_ttl: float = NEGATIVE_TTL,
+                                  error_ttl: float = ERROR_TTL,
+                                  on_result: Optional[Callable[[tuple], None]] = None
+                                  ) -> list[tuple[str, Optional[float], Optional[float]]]:
+    """
+    Geocode unique addresses concurrently, with a global rate limit shared by all requests.
+    Results, including failures, are looked up in and written to the cache like in geocode_address().
+    :param addresses: A series indexed by unique address, containing the trimmed address of each
+                      (see geocoding_funcs.unique_addresses()).
+    :param backend: The geocoding backend.
+    :param rate: The maximum number of requests per second.
+    :param concurrency: The maximum number of requests in flight.
+    :param timeout: The timeout of a single request, in seconds.
+    :param max_retries: The maximum number of attempts per address.
+    :param db_path: The path to the cache database.
+    :param negative_ttl: How long addresses without results are skipped, in seconds.
+    :param error_ttl: How long addresses that failed with an error are skipped, in seconds.
+    :param on_result: A function called with each result as soon as it is available, e.g. to checkpoint it.
+    :return: A list of tuples containing the address, latitude, and longitude.
+    """
+    limiter = TokenBucket(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    context = GeocodingContext(db_path, geolocator=backend, negative_ttl=negative_ttl, error_ttl=error_ttl)
+
+    async def lookup_or_resolve(address: str, trimmed: str = "") -> tuple[Optional[float], Optional[float]]:
+        cached = context.lookup(address)  # Known-bad addresses are skipped until their TTL expires
+        if cached is not None:
+            return cached
+
+        coords, attempts, outcome = await resolve(backend, limiter, address, timeout, max_retries)
+        resolved_by = None
+
+        # If both `als` and `alsb` were used but failed, retry with only `als` (see get_address())
+        if outcome == 'not_found' and address.count(',') == 3 and trimmed:
+            print(f"No results found for address: {address}. Retrying with only `als`...")
+            lat, _ = coords = await lookup_or_resolve(trimmed)
+            if lat is not None:
+                outcome, resolved_by = 'found', trimmed
+
+        lat, lon = coords if coords is not None else (None, None)
+        context.store(address, lat, lon, attempts=attempts, outcome=outcome, resolved_by=resolved_by)
+        return lat, lon
+
+    async def geocode_one(address: str, trimmed: str) -> tuple[str, Optional[float], Optional[float]]:
+        async with semaphore:
+            result = address, *await lookup_or_resolve(address, trimmed)
+
+        if on_result is not None:
+            on_result(result)
+        return result
+
+    try:
+        async with backend:
+            return await asyncio.gather(*(geocode_one(address, trimmed) for address, trimmed in addresses.items()))
+    finally:
+        context.close()
+
+
+def benchmark(num_addresses: int, concurrency_levels: list[int], latency: float, rate: float) -> None:
+    """
+    Measure the throughput of the engine on synthetic addresses with the mock backend and an empty cache.
+    :param num_addresses: The number of unique addresses to geocode.
+    :param concurrency_levels: The concurrency settings to compare.
+    :param latency: The simulated response time of a request, in seconds.
+    :param rate: The maximum number of requests per second.
+    """
+    addresses = pd.Series("", index=[f"{i} MAIN ST, South Carolina, USA" for i in range(num_addresses)])
+
+    for concurrency in concurrency_levels:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = perf_counter()
+            results = asyncio.run(geocode_addresses_async(addresses, MockBackend(latency=latency), rate=rate,
+                                                          concurrency=concurrency,
+                                                          db_path=os.path.join(tmp_dir, 'cache.db')))
+            elapsed = perf_counter() - start
+
+        found = sum(lat is not None for _, lat, _ in results)
+        print(f"Concurrency {concurrency:>4} : {num_addresses / elapsed:>8,.1f} addresses/s "
+              f"({elapsed:.2f} s, {found:,} found)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the async geocoding engine with the mock backend")
+    parser.add_argument("--num_addresses", type=int, default=1000, help="The number of addresses. Default is 1000.")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 8, 64],
+                        help="The concurrency settings to compare. Default is 1 8 64.")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="The simulated response time in seconds. Default is 0.05.")
+    parser.add_argument("--rate", type=float, default=1000.0,
+                        help="The maximum number of requests per second. Default is 1000.")
+    args = parser.parse_args()
+
+    benchmark(args.num_addresses, args.concurrency, args.latency, args.rate)
@@ -1,67 +1,249 @@
 import sqlite3
-from typing import Optional
+import sys
+from typing import Iterable, Optional
+from multiprocessing.util import Finalize
 from geopy.geocoders import Nominatim, nominatim
 from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 import pandas as pd
-from time import sleep
+from time import sleep, time
 from random import randint
+from address_normalization import canonical_address, canonical_addresses
+sys.path.append('../scripts')  # The shared modules of the scripts
+from schema import SC_BOUNDS  # (min lon, min lat, max lon, max lat)
+
+DB_PATH: str = 'geocode_cache.db'  # The geocode cache database
+CACHE_KEY_VERSION: int = 1  # Version of the cache keys, 1 being the canonical addresses. Stored as the user_version
+WRITE_BATCH_SIZE: int = 50  # Number of cache writes committed together in one transaction
+
+# How long failed geocodes are remembered before they are retried, in seconds.
+# Addresses without results are retried rarely; errors (e.g. timeouts) are usually transient.
+NEGATIVE_TTL: float = 30 * 24 * 60 * 60
+ERROR_TTL: float = 24 * 60 * 60
+
+# Columns added to the cache table to record failures, with their definitions.
+# `outcome` is 'found', 'not_found' or 'error'; `resolved_by` is the address variant that was found.
+CACHE_COLUMNS: dict[str, str] = {
+    'outcome': "TEXT DEFAULT 'found'",
+    'attempts': "INTEGER",
+    'updated': "REAL",
+    'resolved_by': "TEXT",
+}
+
+# The condition of the cache entries that are still valid. Successes never expire, failures expire after their TTL.
+# Takes the oldest valid `updated` of the 'not_found' and of the 'error' entries as parameters (see ttl_cutoffs()).
+VALID_ENTRY: str = ("(outcome = 'found' OR (outcome = 'not_found' AND updated >= ?) "
+                    "OR (outcome = 'error' AND updated >= ?))")
+
+
+def open_cache(db_path: str = DB_PATH) -> sqlite3.Connection:
+    """
+    Open the cache database, creating the cache table if necessary.
+    :param db_path: The path to the cache database.
+    :return: The connection to the cache database.
+    """
+    conn: sqlite3.Connection = sqlite3.connect(db_path)
+    is_new = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cache'").fetchone() is None
+    conn.execute('''CREATE TABLE IF NOT EXISTS cache
+                    (address TEXT PRIMARY KEY, latitude REAL, longitude REAL)''')
+
+    if is_new:
+        conn.execute(f"PRAGMA user_version = {CACHE_KEY_VERSION}")
+    elif conn.execute("PRAGMA user_version").fetchone()[0] < CACHE_KEY_VERSION:
+        print(f"Warning: the keys of '{db_path}' are not canonical addresses. Run `python rekey_cache.py` to migrate.")
+
+    # Add the columns missing from caches created before failures were recorded.
+    # The existing entries are all successes, which is the default outcome.
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(cache)")}
+    for column, definition in CACHE_COLUMNS.items():
+        if column not in existing:
+            conn.execute(f"ALTER TABLE cache ADD COLUMN {column} {definition}")
+    conn.commit()
+
+    return conn
+
+
+def ttl_cutoffs(negative_ttl: float = NEGATIVE_TTL, error_ttl: float = ERROR_TTL) -> tuple[float, float]:
+    """
+    Get the parameters of VALID_ENTRY.
+    :param negative_ttl: How long addresses without results are remembered, in seconds.
+    :param error_ttl: How long addresses that failed with an error are remembered, in seconds.
+    :return: A tuple containing the oldest valid timestamps of the 'not_found' and 'error' entries.
+    """
+    now = time()
+    return now - negative_ttl, now - error_ttl
 
 
 # Initialize the geocoder with a cache
-def init_geocoder() -> tuple[sqlite3.Connection, nominatim.Nominatim]:
+def init_geocoder(db_path: str = DB_PATH) -> tuple[sqlite3.Connection, nominatim.Nominatim]:
     """
     Initialize the geocoder with a cache.
+    :param db_path: The path to the cache database.
     :return: A tuple containing the connection to the cache database and the geocoder.
     """
-    conn: sqlite3.Connection = sqlite3.connect('geocode_cache.db')
-    conn.execute('''CREATE TABLE IF NOT EXISTS cache
-                    (address TEXT PRIMARY KEY, latitude REAL, longitude REAL)''')
+    conn: sqlite3.Connection = open_cache(db_path)
 
     geolocator: nominatim.Nominatim = Nominatim(user_agent=f"my_app_{randint(0, 10000)}")
     return conn, geolocator
 
 
-def geocode_address(row: pd.Series, address: str) -> tuple[Optional[float], Optional[float]]:
+class GeocodingContext:
+    """
+    The geocoding state of a single worker: one cache connection and one geocoder, reused for every address.
+    Cache writes are buffered and committed in batches instead of once per address.
+    Failures are cached too, so that known-bad addresses are skipped until their TTL expires.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, batch_size: int = WRITE_BATCH_SIZE, geolocator=None,
+                 negative_ttl: float = NEGATIVE_TTL, error_ttl: float = ERROR_TTL):
+        """
+        :param db_path: The path to the cache database.
+        :param batch_size: The number of buffered cache writes that triggers a commit.
+        :param geolocator: The geocoder to use. Defaults to a new Nominatim geocoder.
+        :param negative_ttl: How long addresses without results are skipped, in seconds.
+        :param error_ttl: How long addresses that failed with an error are skipped, in seconds.
+        """
+        if geolocator is None:
+            self.conn, self.geolocator = init_geocoder(db_path)
+        else:
+            self.conn, self.geolocator = open_cache(db_path), geolocator
+        self.batch_size: int = batch_size
+        self.negative_ttl: float = negative_ttl
+        self.error_ttl: float = error_ttl
+        self.pending: dict[str, tuple] = {}  # Cache entries not yet committed, by address
+
+    def lookup(self, address: str) -> Optional[tuple[Optional[float], Optional[float]]]:
+        """
+        Look up the address in the cache, including the writes not yet committed.
+        :param address: The address as a string.
+        :return: A tuple containing the latitude and longitude (both None for a known-bad address),
+                 or None if the address is not cached.
+        """
+        if address in self.pending:
+            return self.pending[address][:2]
+
+        result = self.conn.execute(f"SELECT latitude, longitude FROM cache WHERE address = ? AND {VALID_ENTRY}",
+                                   (address, *ttl_cutoffs(self.negative_ttl, self.error_ttl))).fetchone()
+        return (result[0], result[1]) if result else None
+
+    def store(self, address: str, lat: Optional[float], lon: Optional[float], attempts: int = 1,
+              outcome: Optional[str] = None, resolved_by: Optional[str] = None) -> None:
+        """
+        Buffer a cache write. The buffer is committed once it holds `batch_size` writes.
+        :param address: The address as a string.
+        :param lat: The latitude, None if the address was not found.
+        :param lon: The longitude, None if the address was not found.
+        :param attempts: The number of requests made for the address.
+        :param outcome: 'found', 'not_found' or 'error'. Defaults to 'found' or 'not_found' depending on `lat`.
+        :param resolved_by: The address variant that was found. Defaults to the address itself if found.
+        """
+        if outcome is None:
+            outcome = 'found' if lat is not None else 'not_found'
+        if resolved_by is None and outcome == 'found':
+            resolved_by = address
+
+        self.pending[address] = (lat, lon, outcome, attempts, time(), resolved_by)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit all buffered cache writes in a single transaction.
+        """
+        if not self.pending:
+            return
+
+        with self.conn:  # Commits on success, rolls back on error
+            # `OR REPLACE` since expired failures are overwritten by their retry
+            self.conn.executemany("INSERT OR REPLACE INTO cache "
+                                  "(address, latitude, longitude, outcome, attempts, updated, resolved_by) "
+                                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(address, *entry) for address, entry in self.pending.items()])
+        self.pending.clear()
+
+    def close(self) -> None:
+        """
+        Commit the remaining cache writes and close the connection.
+        """
+        if self.conn is None:
+            return
+
+        self.flush()
+        self.conn.close()
+        self.conn = None
+
+
+# The geocoding context of the current process. Set by init_worker().
+_context: Optional[GeocodingContext] = None
+
+
+def init_worker(db_path: str = DB_PATH, negative_ttl: float = NEGATIVE_TTL, error_ttl: float = ERROR_TTL) -> None:
+    """
+    Initialize the geocoding context of the current process.
+    Meant to be used as the `initializer` of a multiprocessing pool, so that each worker opens the cache and
+    the geocoder once. The context is closed (and its pending writes committed) when the worker exits.
+    :param db_path: The path to the cache database.
+    :param negative_ttl: How long addresses without results are skipped, in seconds.
+    :param error_ttl: How long addresses that failed with an error are skipped, in seconds.
+    """
+    global _context
+    _context = GeocodingContext(db_path, negative_ttl=negative_ttl, error_ttl=error_ttl)
+    Finalize(_context, _context.close, exitpriority=10)
+
+
+def get_context() -> GeocodingContext:
+    """
+    Get the geocoding context of the current process, initializing it if necessary.
+    :return: The geocoding context.
+    """
+    if _context is None:
+        init_worker()
+    return _context
+
+
+def geocode_address(address: str, trimmed: str = "",
+                    context: Optional[GeocodingContext] = None) -> tuple[Optional[float], Optional[float]]:
     """
     Geocode the address.
-    :param row: A row of the dataframe. Should contain the columns 'als' and 'alsb'.
     :param address: The address as a string.
-    :return: A tuple containing the latitude and longitude as floats.
+    :param trimmed: The address with only the first street name (see get_address()), tried if the address fails.
+    :param context: The geocoding context to use. Defaults to the context of the current process.
+    :return: A tuple containing the latitude and longitude as floats, both None if the address failed.
     """
     if address == "":
         return None, None
 
     print(f"\nGeocoding address: {address}")
-    conn, geolocator = init_geocoder()
-    cursor = conn.cursor()  # Create a cursor object
+    if context is None:
+        context = get_context()
 
-    # Check cache first
-    cursor.execute("SELECT latitude, longitude FROM cache WHERE address = ?", (address,))
-    result = cursor.fetchone()
+    # Check cache first. Known-bad addresses are skipped until their TTL expires
+    result = context.lookup(address)
     if result:
-        print(f"Cache hit for address: {address}")
-        return result[0], result[1]
+        print(f"Cache hit for address: {address}" if result[0] is not None else
+              f"Skipping known-bad address: {address}")
+        return result
 
-    # If not in cache, geocode and store
+    # If not in cache, geocode and store, whatever the outcome
     max_retries = 5
     for attempt in range(max_retries):
         try:
-            location = geolocator.geocode(address, timeout=10)
+            location = context.geolocator.geocode(address, timeout=10)
             if location:
                 print(f"Location found for address: {address}")
-                cursor.execute("INSERT INTO cache VALUES (?, ?, ?)",
-                               (address, location.latitude, location.longitude))
-                conn.commit()
+                context.store(address, location.latitude, location.longitude, attempts=attempt + 1)
                 return location.latitude, location.longitude
             else:
                 # If address contains three commas then both `als` and `alsb` were used, but failed.
                 # Retry with only `als` to see if that works.
                 # See get_address() for more information.
                 print(f"No results found for address: {address}")
-                if address.count(',') == 3:
+                lat, lon = None, None
+                if address.count(',') == 3 and trimmed:
                     print("Retrying with only `als`...")
-                    return geocode_address(row, get_address(row, trim=True))
-                return None, None
+                    lat, lon = geocode_address(trimmed, context=context)
+
+                context.store(address, lat, lon, attempts=attempt + 1, resolved_by=trimmed if lat is not None else None)
+                return lat, lon
 
         except (GeocoderTimedOut, GeocoderServiceError) as e:  # Retry on timeout
             if attempt < max_retries - 1:
@@ -75,41 +257,79 @@ def geocode_address(row: pd.Series, address: str) -> tuple[Optional[float], Opti
             print(f"Unexpected error geocoding {address}: {str(e)}")
             break
 
+    context.store(address, None, None, attempts=attempt + 1, outcome='error')
     return None, None
 
 
 def get_address(row: pd.Series, trim: bool = False) -> str:
     """
-    Get the address from the row.
+    Get the address from the row. The address is canonical (see canonical_address()): street names are normalized
+    and intersections are ordered alphabetically, so that it can be used as the cache key.
     :param row: A row of the dataframe. Should contain the columns 'als' and 'alsb'.
     :param trim: If True, only the first street name will be included in the address.
-    :return: The address as a string.
+    :return: The address as a string, or an empty string if all street names are missing.
+    """
+    return canonical_address(row['als'], None if trim else row['alsb'])
+
+
+def get_addresses(df: pd.DataFrame, trim: bool = False) -> pd.Series:
+    """
+    Get the addresses of all rows at once. Vectorized equivalent of get_address().
+    :param df: The dataframe. Should contain the columns 'als' and 'alsb'.
+    :param trim: If True, only the first street name will be included in the addresses.
+    :return: The addresses as a series of strings, indexed like the dataframe.
+    """
+    return canonical_addresses(df['als'], None if trim else df['alsb'])
+
+
+def lookup_cached(addresses: Iterable[str], db_path: str = DB_PATH, negative_ttl: float = NEGATIVE_TTL,
+                  error_ttl: float = ERROR_TTL) -> pd.DataFrame:
+    """
+    Resolve the cached addresses with a single join against the cache, instead of one query per address.
+    :param addresses: The addresses to look up. Duplicates and empty addresses are ignored.
+    :param db_path: The path to the cache database.
+    :param negative_ttl: How long addresses without results are remembered, in seconds.
+    :param error_ttl: How long addresses that failed with an error are remembered, in seconds.
+    :return: A dataframe indexed by address with the columns 'latitude', 'longitude' and 'outcome', for the cached
+             addresses. Known-bad addresses are included, with missing coordinates.
     """
-    # Get the street names. If the street name is missing, replace it with an empty string
-    als = '' if pd.isnull(row['als']) else f"{row['als']}, "
-    alsb = '' if pd.isnull(row['alsb']) else f"{row['alsb']}, "
+    conn = open_cache(db_path)
+    try:
+        conn.execute("CREATE TEMP TABLE lookup (address TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO lookup VALUES (?)",
+                         ((address,) for address in addresses if address))
 
-    # If all street names are missing, return an empty string
-    # Otherwise, return the address
-    if als == '' and alsb == '':
-        return ""
-    if trim:  # Trim the address to only include the first street name
-        return f"{als}South Carolina, USA"
-    else:
-        return f"{als}{alsb}South Carolina, USA"
+        return pd.read_sql_query(f"SELECT cache.address, cache.latitude, cache.longitude, cache.outcome "
+                                 f"FROM lookup JOIN cache ON cache.address = lookup.address WHERE {VALID_ENTRY}",
+                                 conn, index_col='address', params=ttl_cutoffs(negative_ttl, error_ttl))
+    finally:
+        conn.close()
 
 
-def process_chunk(chunk) -> list[tuple[int, Optional[float], Optional[float]]]:
+def unique_addresses(df: pd.DataFrame) -> pd.Series:
     """
-    Process a chunk of the dataframe.
-    :param chunk: A chunk of the dataframe.
-    :return: A list of tuples containing the latitude, and longitude.
+    Get the unique non-empty addresses of the dataframe.
+    :param df: The dataframe. Should contain the columns 'als' and 'alsb'.
+    :return: A series indexed by unique address, containing the trimmed address (see get_address()) of each.
+    """
+    addresses = pd.DataFrame({'address': get_addresses(df), 'trimmed': get_addresses(df, trim=True)})
+    addresses = addresses[addresses['address'] != ''].drop_duplicates('address')
+    return addresses.set_index('address')['trimmed']
+
+
+def process_chunk(chunk: pd.Series) -> list[tuple[str, Optional[float], Optional[float]]]:
+    """
+    Process a chunk of unique addresses.
+    :param chunk: A chunk of the series returned by unique_addresses().
+    :return: A list of tuples containing the address, latitude, and longitude.
     """
     print("Processing chunk...")
+    context = get_context()
 
     results = []
-    for _, row in chunk.iterrows():
-        address = get_address(row)
-        lat, lon = geocode_address(row, address)
-        results.append((row.name, lat, lon))
+    for address, trimmed in chunk.items():
+        lat, lon = geocode_address(address, trimmed, context)
+        results.append((address, lat, lon))
+
+    context.flush()  # Commit the chunk's remaining cache writes
     return results
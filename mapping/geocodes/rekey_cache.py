@@ -0,0 +1,47 @@
+import argparse
+import pandas as pd
+from address_normalization import rekey
+from geocoding_funcs import CACHE_KEY_VERSION, DB_PATH, open_cache
+
+
+def rekey_cache(db_path: str = DB_PATH) -> None:
+    """
+    Migrate the keys of the cache to canonical addresses (see address_normalization.canonical_address()).
+    When several entries share a canonical address, successes are kept over failures, then the most recent entry.
+    Entries without an address are removed since they can never be looked up.
+    :param db_path: The path to the cache database.
+    """
+    conn = open_cache(db_path)
+    try:
+        cache = pd.read_sql_query("SELECT * FROM cache", conn)
+        len_0 = cache.shape[0]
+
+        cache['address'] = cache['address'].map(rekey)
+        cache['resolved_by'] = cache['resolved_by'].map(rekey).where(cache['resolved_by'].notna())
+        cache = cache[cache['address'] != '']
+
+        cache = (cache.assign(failed=cache['outcome'] != 'found')
+                 .sort_values(['failed', 'updated'], ascending=[True, False], na_position='last')
+                 .drop_duplicates('address')
+                 .drop(columns='failed'))
+
+        with conn:  # Replace all entries in a single transaction
+            conn.execute("DELETE FROM cache")
+            conn.executemany(f"INSERT INTO cache ({', '.join(cache.columns)}) "
+                             f"VALUES ({', '.join('?' * cache.shape[1])})",
+                             cache.astype(object).where(cache.notna(), None).itertuples(index=False))
+            conn.execute(f"PRAGMA user_version = {CACHE_KEY_VERSION}")
+        conn.execute("VACUUM")
+
+    finally:
+        conn.close()
+
+    print(f"Rekeyed '{db_path}': {len_0:,} entries before, {cache.shape[0]:,} after")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate the geocode cache keys to canonical addresses")
+    parser.add_argument("--db_path", type=str, default=DB_PATH, help=f"The cache database. Default is {DB_PATH}.")
+    args = parser.parse_args()
+
+    rekey_cache(args.db_path)
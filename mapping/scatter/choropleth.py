@@ -1,50 +1,27 @@
-import pandas as pd
-import geopandas as gpd
 import plotly.express as px
-from scatter import check_cols
+import sys
+sys.path.append('../scripts')  # The shared modules of the scripts
+from cube import Cube
+from geometry import OUTPUT_LEVELS, share_geometry, simplified
 from dotenv import load_dotenv
 from os import getenv
 
 load_dotenv()
 
-# Read data files
-df = []
-for year in range(2017, 2022):
-    data = pd.read_csv(f'../../usc_data/sc_loc{year}.csv', low_memory=False)
-    data['year'] = year
+# The data files of each year
+files = {year: f'../../usc_data/sc_loc{year}.csv' for year in range(2017, 2022)}
 
-    # Check if the columns are consistent
-    _, data = check_cols('lat', 'lon', data, "")
+# Count accidents by county and year from the aggregation cube, adding the years that are not in it yet
+cube = Cube('../../usc_data/.cache/cube.parquet')  # Kept with the data, one cube per dataset
+cube.update(files)
+accidents_by_county_year = cube.counts(['cty', 'year'], names=True, year=list(files)).reset_index(name='accidents')
+print(f"Length of the dataset: {accidents_by_county_year['accidents'].sum():,}")
 
-    df.append(data)
+# The county boundaries, simplified once and cached
+counties_gdf = simplified('South Carolina County Boundaries.geojson', OUTPUT_LEVELS['choropleth'])
 
-# Combine the dataframes
-df = pd.concat(df, ignore_index=True)
-print(f"Length of the dataset: {len(df):,}")
-
-# Group by county and year, count accidents
-accidents_by_county_year = df.groupby(['cty', 'year']).size().reset_index(name='accidents')
-
-county_dict = {
-    1: 'Abbeville', 2: 'Aiken', 3: 'Allendale', 4: 'Anderson', 5: 'Bamberg',
-    6: 'Barnwell', 7: 'Beaufort', 8: 'Berkeley', 9: 'Calhoun', 10: 'Charleston',
-    11: 'Cherokee', 12: 'Chester', 13: 'Chesterfield', 14: 'Clarendon', 15: 'Colleton',
-    16: 'Darlington', 17: 'Dillon', 18: 'Dorchester', 19: 'Edgefield', 20: 'Fairfield',
-    21: 'Florence', 22: 'Georgetown', 23: 'Greenville', 24: 'Greenwood', 25: 'Hampton',
-    26: 'Horry', 27: 'Jasper', 28: 'Kershaw', 29: 'Lancaster', 30: 'Laurens',
-    31: 'Lee', 32: 'Lexington', 33: 'McCormick', 34: 'Marion', 35: 'Marlboro',
-    36: 'Newberry', 37: 'Oconee', 38: 'Orangeburg', 39: 'Pickens', 40: 'Richland',
-    41: 'Saluda', 42: 'Spartanburg', 43: 'Sumter', 44: 'Union', 45: 'Williamsburg',
-    46: 'York'
-}
-
-# Replace the numerical representation with county names
-accidents_by_county_year['cty'] = accidents_by_county_year['cty'].replace(county_dict)
-
-counties_gdf = gpd.read_file('South Carolina County Boundaries.geojson')
-
-# Merge accident data with geospatial data
-merged_data = counties_gdf.merge(accidents_by_county_year, left_on='name', right_on='cty')
+# Match the accident data with the counties by name, without copying their geometry for every row
+merged_data = accidents_by_county_year.merge(counties_gdf[['name']], left_on='cty', right_on='name')
 
 # Calculate the center of South Carolina
 center_lat, center_lon = 33.8361, -81.1637
@@ -52,8 +29,8 @@ center_lat, center_lon = 33.8361, -81.1637
 # Create the Mapbox choropleth map
 fig = px.choropleth_mapbox(
     merged_data,
-    geojson=merged_data.geometry,
-    locations=merged_data.index,
+    geojson=counties_gdf.set_index('name').geometry,  # One feature per county, with the name as its id
+    locations='name',
     color='accidents',
     animation_frame='year',
     color_continuous_scale="Viridis",
@@ -68,6 +45,9 @@ fig = px.choropleth_mapbox(
     title='Traffic Accidents in South Carolina Counties Over Time'
 )
 
+# The frames only change the colors, so the geometry is only kept in the figure once
+share_geometry(fig)
+
 # Update the map layout
 # Possible mapbox styles:
 #   From various public tile servers: "carto-positron", "carto-darkmatter", "open-street-map"
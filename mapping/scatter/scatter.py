@@ -5,8 +5,14 @@ import folium as fm
 from folium.plugins import MarkerCluster
 from random import sample
 import json
-from shapely.geometry import Point, Polygon
+from shapely.geometry import Polygon
 import os.path
+import sys
+sys.path.append('../scripts')  # The shared modules of the scripts
+from pipeline import stage_function
+
+# The vectorized point-in-polygon test of scripts/scatter.py, which this scatter.py shadows on the path
+in_polygon = stage_function('scatter.in_polygon')
 
 
 def object_to_int(df: pd.DataFrame, col_name: str, print_string: str) -> pd.DataFrame:
@@ -89,7 +95,7 @@ def filter_points(df: pd.DataFrame, len_0: int, print_string: str) -> tuple[str,
     # Filter points and calculate exclusion percentage
     len_1 = df.shape[0]  # New length
 
-    df['in_sc'] = df.apply(lambda row: sc_polygon.contains(Point(row['lon'], row['lat'])), axis=1)
+    df['in_sc'] = in_polygon(sc_polygon, df['lon'], df['lat'])
     df = df[df['in_sc']]  # Keep only points within South Carolina
 
     print_string += f"\n\nPoints after pre-processing : {len_1:,}"
@@ -0,0 +1,170 @@
+import argparse
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from scipy import stats
+from ingest import read_data, year_files
+
+# The sufficient statistics of each column, by year. `size` is the number of rows, `count` the number of non-null
+# values, and `var` the sample variance of the values.
+STATS: list[str] = ['size', 'count', 'mean', 'var']
+
+
+def numeric_columns(df: pd.DataFrame, by: Optional[str] = None) -> list[str]:
+    """
+    Get the numeric columns of a DataFrame.
+    @param df: The DataFrame
+    @param by: The column the rows are grouped by, which is left out
+    @return: The names of the numeric columns
+    """
+    return [col for col in df.select_dtypes(include=[np.number]).columns if col != by]
+
+
+def moments(df: pd.DataFrame, by: str = 'year', columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """
+    Compute the sufficient statistics of the columns for each year, with a single grouped aggregation.
+    @param df: The DataFrame of several years
+    @param by: The column of the years
+    @param columns: The columns. Default is all the numeric columns.
+    @return: The statistics, with a (statistic, column) column index (see STATS) and one row per year, so that e.g.
+             `moments(df)['mean']` is the mean of each column by year
+    """
+    columns = columns or numeric_columns(df, by)
+
+    result = df.groupby(by)[columns].agg(STATS)
+    return result.swaplevel(axis=1)[STATS]
+
+
+def year_moments(df: pd.DataFrame, year: int, columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """
+    Compute the sufficient statistics of the columns of a single year, without grouping its rows.
+    @param df: The DataFrame of the year
+    @param year: The year
+    @param columns: The columns. Default is all the numeric columns.
+    @return: The statistics, as in moments(), with a single row
+    """
+    columns = columns or numeric_columns(df, 'year')
+
+    result = df[columns].agg(STATS)  # One row per statistic, in the order of STATS
+    return pd.DataFrame([result.to_numpy().ravel()], index=pd.Index([year], name='year'),
+                        columns=pd.MultiIndex.from_product([STATS, columns]))
+
+
+def combine_moments(parts: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine the sufficient statistics of parts of the data, e.g. of several files or chunks. The statistics of a
+    year found in several parts are merged with the pairwise formula of Chan et al., which is exact.
+    A column missing from a part is counted as null in the rows of that part.
+    @param parts: The statistics of each part, as in moments()
+    @return: The statistics, by year
+    """
+    df = pd.concat(parts)
+    rows = np.broadcast_to(df['size'].max(axis=1).to_numpy()[:, None], df['size'].shape)  # The size of each part
+    size = df['size'].mask(df['size'].isna(), rows)
+    count = df['count'].fillna(0)
+
+    years = df.index
+    total = count.groupby(years).sum()
+    mean = (count * df['mean']).fillna(0).groupby(years).sum() / total
+
+    # The sum of squared deviations from the mean of the year, within and between the parts
+    m2 = ((count - 1).clip(lower=0) * df['var'].fillna(0)
+          + count * (df['mean'] - mean.reindex(years).to_numpy()) ** 2).fillna(0).groupby(years).sum()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var = (m2 / (total - 1)).where(total > 1)
+
+    result = pd.concat({'size': size.groupby(years).sum(), 'count': total, 'mean': mean, 'var': var}, axis=1)
+    result.index.name = 'year'
+    return result
+
+
+def stream_moments(file_paths: dict[int, str], columns: Optional[list[str]] = None,
+                   use_hash: bool = False) -> pd.DataFrame:
+    """
+    Compute the sufficient statistics of several years, reading one yearly file at a time through the columnar cache,
+    so the years are never combined into a single DataFrame.
+    @param file_paths: The paths to the csv files, by year
+    @param columns: The columns. Default is all the numeric columns of each file.
+    @param use_hash: If True, key the caches by the content of the files instead of their size and modification time
+    @return: The statistics, by year
+    """
+    parts = []
+    for year, file_path in sorted(file_paths.items()):
+        df = read_data(file_path, columns, use_hash)
+        parts.append(year_moments(df, year, columns))
+        del df  # Only one year in memory at a time
+
+    return combine_moments(parts)
+
+
+def removed(yearly: pd.DataFrame) -> pd.DataFrame:
+    """
+    @param yearly: The statistics, by year
+    @return: The number of null values of each column, by year
+    """
+    return (yearly['size'] - yearly['count']).astype(int)
+
+
+def anova(yearly: pd.DataFrame) -> pd.DataFrame:
+    """
+    One-way ANOVA of each column across the years, computed from the sufficient statistics of the years for all the
+    columns at once. The result is the same as that of `scipy.stats.f_oneway` on the values of each year, but the
+    values are never split into arrays. Years without values are left out.
+    @param yearly: The statistics, by year
+    @return: The number of years (`groups`), the F statistic, the p-value and the error, if any, of each column
+    """
+    count, mean = yearly['count'].fillna(0), yearly['mean']
+    var = yearly['var'].fillna(0)  # Undefined for a single value, which adds nothing within its year
+
+    groups = (count > 0).sum()
+    total = count.sum()
+    grand_mean = (count * mean).fillna(0).sum() / total
+
+    between = (count * (mean - grand_mean) ** 2).fillna(0).sum()
+    within = ((count - 1).clip(lower=0) * var).sum()
+    df_between, df_within = groups - 1, total - groups
+
+    # As with f_oneway, F is infinite if the values are constant within each year, and undefined if all are equal
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_statistic = (between / df_between) / (within / df_within)
+        p_value = pd.Series(stats.f.sf(f_statistic, df_between, df_within), index=f_statistic.index)
+
+    error = pd.Series(np.where(groups < 2, 'Insufficient data for ANOVA',
+                               np.where(df_within < 1, 'Each year has a single value', None)), index=groups.index)
+
+    return pd.DataFrame({
+        'groups': groups,
+        'f_statistic': f_statistic.where(error.isna()),
+        'p_value': p_value.where(error.isna()),
+        'error': error,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test the differences between the years of each numeric column")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files, one per year. The year is derived from each filename.")
+    parser.add_argument("--columns", type=str, nargs='+', default=None,
+                        help="The columns to test. Default is all the numeric columns.")
+    args = parser.parse_args()
+
+    files = year_files(args.csv_files)
+    yearly = stream_moments(files, args.columns)
+    results = anova(yearly)
+
+    Path("./output").mkdir(parents=True, exist_ok=True)
+    yearly.to_csv("./output/yearly_moments.csv")
+    results.to_csv("./output/anova.csv")
+
+    print(f"| {'Column':<12} | {'F statistic':>12} | {'p-value':>10} | Error")
+    print(f"|{'-' * 14}|{'-' * 14}|{'-' * 12}|{'-' * 7}")
+    for col, result in results.iterrows():
+        print(f"| {col:<12} | {result['f_statistic']:>12.4f} | {result['p_value']:>10.4f} | {result['error'] or ''}")
+
+    print("\nMeans and statistics saved to './output/yearly_moments.csv' and './output/anova.csv'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import glob
+import os.path
+from typing import Optional
+from ingest import year_files
+from pipeline import Pipeline, add_choropleth, add_scatter
+from quality import write_statistics
+from scatter import COUNTIES_FILE, STATE_FILE
+
+CSV_TEMPLATE: str = "../../sc_data/sc_loc{year}.csv"
+MAPS: list[str] = ['scatter', 'choropleth']
+
+
+def find_files(pattern: Optional[str] = None, years: Optional[tuple[int, int]] = None,
+               template: str = CSV_TEMPLATE) -> dict[str, str]:
+    """
+    Find the csv files of each year, either with a glob pattern or with a year range.
+    With a glob pattern, the year is derived from the filename, and a final file replaces a preliminary one.
+    @param pattern: The glob pattern of the csv files
+    @param years: The first and last years, used with the template
+    @param template: The path to the csv file of a year, with a {year} placeholder
+    @return: The paths to the csv files, by year, in year order
+    """
+    files: dict[str, str] = {}
+
+    if pattern is not None:
+        files.update({str(year): file_path for year, file_path in year_files(glob.glob(pattern)).items()})
+
+    if years is not None:
+        for year in range(years[0], years[1] + 1):
+            file_path = template.format(year=year)
+            if os.path.exists(file_path):
+                files[str(year)] = file_path
+            else:
+                print(f"The '{file_path}' file was not found. Skipping {year}...")
+
+    return dict(sorted(files.items()))
+
+
+def batch(files: dict[str, str], maps: list[str], print_stats: bool, processes: Optional[int] = None,
+          fast: bool = False, use_hash: bool = False) -> None:
+    """
+    Create the maps of several years through the pipeline (see `pipeline.py`). The stages of the years run in
+    parallel, and only the stages of the new or changed years run again. The GeoJSON files are loaded once, by
+    stages shared by all the years.
+    @param files: The paths to the csv files, by year
+    @param maps: The maps to create, 'scatter' and/or 'choropleth'
+    @param print_stats: Whether to print the combined statistics file or not
+    @param processes: The number of processes. Default is the number of CPUs.
+    @param fast: Whether to create the scatter markers in the browser, for faster and smaller maps
+    @param use_hash: If True, key the csv files by their content instead of their size and modification time
+    """
+    for file_name in [STATE_FILE, COUNTIES_FILE]:
+        if not os.path.exists(file_name):
+            print(f"The '{file_name}' file was not found. Exiting...")
+            exit()
+
+    # The scatter and choropleth maps of each year
+    pipeline = Pipeline(use_hash=use_hash, processes=processes)
+    targets: dict[str, str] = {}
+    for year, file_path in files.items():
+        if 'scatter' in maps:
+            name = add_scatter(pipeline, int(year), file_path, STATE_FILE, COUNTIES_FILE, fast)
+            targets[name] = f"./output/sc_incidents_{year}.html"
+        if 'choropleth' in maps:
+            name = add_choropleth(pipeline, {int(year): file_path}, COUNTIES_FILE)
+            targets[name] = f"./output/choropleth_{year}.html"
+
+    print(f"Processing {len(files)} years...")
+    pipeline.run(list(targets))
+    for name, file_name in targets.items():
+        pipeline.export(name, 'map', file_name)
+        print(f"Map has been saved as '{file_name}'")
+
+    # Save the data statistics of all years to a single file, in year order
+    if print_stats and 'scatter' in maps:
+        file_name: str = "./output/data_statistics.md"
+        print(f"Saving data statistics to '{file_name}' and its .json file")
+        write_statistics([pipeline.load(f"points/{year}", 'statistics') for year in files], file_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the maps of several years in parallel, through the pipeline")
+    parser.add_argument("--glob", type=str, default=None,
+                        help="The glob pattern of the csv files, e.g. '../../sc_data/*sc_loc*.csv'.")
+    parser.add_argument("--years", type=int, nargs=2, default=None, metavar=('FIRST', 'LAST'),
+                        help="The first and last years, used with --csv_template.")
+    parser.add_argument("--csv_template", type=str, default=CSV_TEMPLATE,
+                        help=f"The path to the csv file of a year, with a {{year}} placeholder. "
+                             f"Default is {CSV_TEMPLATE}.")
+    parser.add_argument("--maps", type=str, nargs='+', choices=MAPS, default=MAPS,
+                        help=f"The maps to create. Default is {' '.join(MAPS)}.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="The number of processes. Default is the number of CPUs.")
+    parser.add_argument("--print_stats", action="store_true",
+                        help="Print the combined statistics file. Default is False. To print, use this flag.")
+    parser.add_argument("--fast", action="store_true",
+                        help="Create the scatter markers in the browser (see scatter.py). Default is False.")
+    parser.add_argument("--hash", action="store_true",
+                        help="Key the csv files by their content instead of their size and modification time, so "
+                             "that touching a file does not create its maps again. Default is False.")
+    args = parser.parse_args()
+
+    if args.glob is None and args.years is None:
+        parser.error("Either --glob or --years is required.")
+
+    files = find_files(args.glob, tuple(args.years) if args.years else None, args.csv_template)
+    if not files:
+        print("No csv files were found. Exiting...")
+        exit()
+
+    batch(files, args.maps, args.print_stats, args.processes, args.fast, args.hash)
+
+
+if __name__ == "__main__":
+    main()
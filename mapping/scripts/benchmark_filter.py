@@ -0,0 +1,72 @@
+import argparse
+import json
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point, Polygon
+from ingest import coerce_coordinates, file_year
+from scatter import in_polygon
+
+
+def load_points(file_path: str) -> pd.DataFrame:
+    """
+    Load and pre-process the points of a year the same way as scatter.clean_points(), up to the state filtering.
+    @param file_path: The path to the csv file
+    @return: The DataFrame with the lat and lon columns in decimal degrees
+    """
+    df = pd.read_csv(file_path, usecols=['lat', 'lon'], low_memory=False)
+    df = coerce_coordinates(df)
+
+    # Remove rows with lat = 0 or lon = 0, and convert lat and lon to correct decimal degrees
+    df = df[(df['lat'] != 0) & (df['lon'] != 0)].copy()
+    df['lat'] = df['lat'] / 1_000_000
+    df['lon'] = - (df['lon'] / 1000000)
+
+    return df
+
+
+def benchmark(csv_files: list[str], geojson: str) -> None:
+    """
+    Time the row-wise and the vectorized point-in-state filtering on each year file, and check that both give the
+    same row mask.
+    @param csv_files: The paths to the csv files
+    @param geojson: The path to the GeoJSON file of the state
+    """
+    with open(geojson, 'r') as f:
+        sc_polygon = Polygon(json.load(f)['geometry']['coordinates'][0])
+
+    print(f"| {'Year':<6} | {'Points':>10} | {'Within SC':>10} | {'Row-wise (s)':>12} | {'Vectorized (s)':>14} "
+          f"| {'Speedup':>8} |")
+    print(f"|{'-' * 8}|{'-' * 12}|{'-' * 12}|{'-' * 14}|{'-' * 16}|{'-' * 10}|")
+
+    for file_path in csv_files:
+        year: str = str(file_year(file_path))
+        df = load_points(file_path)
+
+        start = perf_counter()
+        row_wise = df.apply(lambda row: sc_polygon.contains(Point(row['lon'], row['lat'])), axis=1).to_numpy(bool)
+        row_wise_time = perf_counter() - start
+
+        start = perf_counter()
+        vectorized = in_polygon(sc_polygon, df['lon'], df['lat'])
+        vectorized_time = perf_counter() - start
+
+        if not np.array_equal(row_wise, vectorized):
+            print(f"Warning: the masks of {year} differ in {(row_wise != vectorized).sum():,} rows")
+
+        print(f"| {year:<6} | {df.shape[0]:>10,} | {vectorized.sum():>10,} | {row_wise_time:>12.3f} "
+              f"| {vectorized_time:>14.4f} | {row_wise_time / max(vectorized_time, 1e-9):>7.0f}x |")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the point-in-state filtering of scatter.py")
+    parser.add_argument("csv_files", type=str, nargs='+', help="The paths to the csv files, one per year")
+    parser.add_argument("--geojson", type=str, default="data/south carolina.geojson",
+                        help="The GeoJSON file of the state. Default is data/south carolina.geojson.")
+    args = parser.parse_args()
+
+    benchmark(args.csv_files, args.geojson)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,114 +1,30 @@
 import argparse
+import json
 import os
-import fiona.errors
-import pandas as pd
+from typing import Optional
 import geopandas as gpd
+import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
+from cube import Cube
+from geometry import share_geometry
+from ingest import file_year
+from pipeline import Pipeline, add_choropleth
 
+COUNTIES_FILE: str = "data/South Carolina County Boundaries.geojson"
 
-def object_to_int(df: pd.DataFrame, col_name: str, print_string: str) -> pd.DataFrame:
-    """
-    Convert an object column to int64
-    @param df: The DataFrame
-    @param col_name: The column name
-    @param print_string: The string that will contain the data statistics
-    @return: The DataFrame with the column converted to int64
-    """
-    # Since the lat column is of type object, we need to check if it contains any non-numeric values
-    print_string += (f"\n\nNumber of rows with non-numeric lat : "
-                     f"{pd.to_numeric(df[col_name], errors='coerce').isnull().sum():,}")
-
-    # Get the rows with non-numeric lat
-    print_string += (f"\nRows with non-numeric lat : "
-                     f"{df[pd.to_numeric(df[col_name], errors='coerce').isnull()][col_name].to_dict()}")
-
-    # Convert the lat column to numeric
-    # Remove hyphens from the column
-    df[col_name] = df[col_name].str.replace('-', '')
 
-    # Step 3: Convert the column to integer type
-    df[col_name] = df[col_name].astype(int)
-
-    return df
-
-
-def check_cols(col1: str, col2: str, df: pd.DataFrame, print_string: str) -> tuple[str, pd.DataFrame]:
+def choropleth_figure(accidents_by_county_year: pd.DataFrame, counties_gdf: gpd.GeoDataFrame,
+                      highlight: Optional[list[str]] = None) -> go.Figure:
     """
-    Check the columns and convert them to int64 if necessary.
-    @param col1: The first column
-    @param col2: The second column
-    @param df: The DataFrame
-    @param print_string: The string that will contain the data statistics
-    @return: The print string and the DataFrame
+    Create the animated choropleth map of the number of accidents per county and year.
+    @param accidents_by_county_year: The number of accidents (`accidents`), by county name (`cty`) and year
+    @param counties_gdf: The (simplified) county boundaries
+    @param highlight: The names of the counties to outline in red, if any
+    @return: The figure
     """
-
-    # Perform checks for both columns
-    if df[col1].dtype == 'int64' and df[col2].dtype == 'int64':
-        print_string += f"\n\n<br>Both {col1} and {col2} columns are of type int64."
-
-    elif df[col1].dtype == 'object':
-        print_string += f"\n\n<br>The {col1} column is of type object. Converting it to int64."
-        df = object_to_int(df, col1, print_string)  # Convert the `col1` column to int64
-
-    elif df[col2].dtype == 'object':
-        print_string += f"\n\n<br>The {col2} column is of type object. Converting it to int64."
-        df = object_to_int(df, col2, print_string)  # Convert the `col2` column to int64
-
-    elif df[col1].dtype == 'object' and df[col2].dtype == 'object':
-        print_string += f"\n\n<br>Both {col1} and {col2} columns are of type object. Converting them to int64."
-        df = object_to_int(object_to_int(df, col1, print_string), col2, print_string)
-
-    else:
-        print_string += f"\n\n<br>The {col1} and {col2} columns are of type object"
-        print_string += f"\n<br>Type of {col1} column : {df[col1].dtype}"
-        print_string += f"\n<brType of {col2} column : {df[col2].dtype}"
-
-    return print_string, df
-
-
-def main():
-    # Initialize command line arguments
-    parser = argparse.ArgumentParser(description="Create scatter maps for South Carolina")
-    parser.add_argument("csv_file", type=str, help="The path to the csv file")
-    args = parser.parse_args()
-
-    year: str = os.path.basename(args.csv_file).split('.')[-2][-4:]
-
-    df = pd.read_csv(args.csv_file, low_memory=False)
-    df['year'] = year
-
-    # Check if the columns are consistent
-    _, data = check_cols('lat', 'lon', df, "")
-
-    # Group by county and year, count accidents
-    accidents_by_county_year = df.groupby(['cty', 'year']).size().reset_index(name='accidents')
-
-    county_dict = {
-        1: 'Abbeville', 2: 'Aiken', 3: 'Allendale', 4: 'Anderson', 5: 'Bamberg',
-        6: 'Barnwell', 7: 'Beaufort', 8: 'Berkeley', 9: 'Calhoun', 10: 'Charleston',
-        11: 'Cherokee', 12: 'Chester', 13: 'Chesterfield', 14: 'Clarendon', 15: 'Colleton',
-        16: 'Darlington', 17: 'Dillon', 18: 'Dorchester', 19: 'Edgefield', 20: 'Fairfield',
-        21: 'Florence', 22: 'Georgetown', 23: 'Greenville', 24: 'Greenwood', 25: 'Hampton',
-        26: 'Horry', 27: 'Jasper', 28: 'Kershaw', 29: 'Lancaster', 30: 'Laurens',
-        31: 'Lee', 32: 'Lexington', 33: 'McCormick', 34: 'Marion', 35: 'Marlboro',
-        36: 'Newberry', 37: 'Oconee', 38: 'Orangeburg', 39: 'Pickens', 40: 'Richland',
-        41: 'Saluda', 42: 'Spartanburg', 43: 'Sumter', 44: 'Union', 45: 'Williamsburg',
-        46: 'York'
-    }
-
-    # Replace the numerical representation with county names
-    accidents_by_county_year['cty'] = accidents_by_county_year['cty'].replace(county_dict)
-
-    # Try adding the county boundaries from the GeoJSON file
-    file_name: str = "data/South Carolina County Boundaries.geojson"
-    try:
-        counties_gdf = gpd.read_file(file_name)
-    except (fiona.errors.DriverError, FileNotFoundError):
-        print(f"The '{file_name}' file was not found. Exiting...")
-        exit()
-
-    # Merge accident data with geospatial data
-    merged_data = counties_gdf.merge(accidents_by_county_year, left_on='name', right_on='cty')
+    # Match the accident data with the counties by name, without copying their geometry for every row
+    merged_data = accidents_by_county_year.merge(counties_gdf[['name']], left_on='cty', right_on='name')
 
     # Calculate the center of South Carolina
     center_lat, center_lon = 33.8361, -81.1637
@@ -116,8 +32,8 @@ def main():
     # Create the Mapbox choropleth map
     fig = px.choropleth_mapbox(
         merged_data,
-        geojson=merged_data.geometry,
-        locations=merged_data.index,
+        geojson=counties_gdf.set_index('name').geometry,  # One feature per county, with the name as its id
+        locations='name',
         color='accidents',
         animation_frame='year',
         color_continuous_scale="Viridis",
@@ -132,9 +48,62 @@ def main():
         title='Traffic Accidents in South Carolina Counties Over Time'
     )
 
-    # Show the figure
+    # The frames only change the colors, so the geometry is only kept in the figure once
+    share_geometry(fig)
+
+    # Create a new layer for highlighted counties
+    for county in highlight or []:
+        county_data = counties_gdf[counties_gdf['name'] == county]
+        if not county_data.empty:
+            fig.add_trace(go.Choroplethmapbox(
+                geojson=county_data.geometry.__geo_interface__,
+                locations=county_data.index,
+                z=[1] * len(county_data),  # Dummy z values
+                colorscale=[[0, 'rgba(0,0,0,0)'], [1, 'rgba(0,0,0,0)']],  # Transparent fill
+                showscale=False,
+                marker_line_color='red',
+                marker_line_width=2,
+                hoverinfo='none'
+            ))
+
+    return fig
+
+
+def choropleth_html(counts: list[pd.DataFrame], borders: str, highlight: Optional[list[str]] = None) -> str:
+    """
+    Create the choropleth map of several years, as a stage of the pipeline (see `pipeline.py`).
+    @param counts: The rows of the cube of each year (see `cube.year_counts()`)
+    @param borders: The simplified county boundaries, as GeoJSON (see `geometry.simplified_geojson()`)
+    @param highlight: The names of the counties to outline in red, if any
+    @return: The HTML of the map
+    """
+    cube = Cube(None)
+    cube.data = pd.concat(counts, ignore_index=True)
+    accidents_by_county_year = cube.counts(['cty', 'year'], names=True).reset_index(name='accidents')
+
+    counties_gdf = gpd.GeoDataFrame.from_features(json.loads(borders), crs='EPSG:4326')
+    return choropleth_figure(accidents_by_county_year, counties_gdf, highlight).to_html()
+
+
+def main():
+    # Initialize command line arguments
+    parser = argparse.ArgumentParser(description="Create scatter maps for South Carolina")
+    parser.add_argument("csv_file", type=str, help="The path to the csv file")
+    args = parser.parse_args()
+
+    year: str = str(file_year(args.csv_file))
+    for file_name in [COUNTIES_FILE, args.csv_file]:
+        if not os.path.exists(file_name):
+            print(f"The '{file_name}' file was not found. Exiting...")
+            exit()
+
+    # Only the stages whose file or inputs changed run again (see pipeline.py)
+    pipeline = Pipeline()
+    name = add_choropleth(pipeline, {int(year): args.csv_file}, COUNTIES_FILE)
+    pipeline.run([name])
+
     save_file: str = f"./output/choropleth_{year}.html"
-    fig.write_html(save_file)
+    pipeline.export(name, 'map', save_file)
     print(f"The choropleth map has been saved to '{save_file}'.")
 
 
@@ -0,0 +1,107 @@
+import argparse
+import json
+from pathlib import Path
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import shape
+from schema import COUNTY_NAMES
+
+COUNTIES_FILE: str = "data/South Carolina County Boundaries.geojson"
+NO_COUNTY: int = 0  # The county code of the points outside every county
+
+
+class CountyIndex:
+    """
+    A spatial index of the county boundaries, to find the county containing each point.
+    The county polygons are stored in an STRtree, so each point is only tested against the few counties whose
+    bounding box contains it.
+    """
+
+    def __init__(self, file_name: str = COUNTIES_FILE):
+        """
+        @param file_name: The path to the county boundaries GeoJSON file
+        """
+        with open(file_name, 'r') as f:
+            features = json.load(f)['features']
+
+        codes = {name: code for code, name in COUNTY_NAMES.items()}
+        self.geometries: np.ndarray = np.array([shape(feature['geometry']) for feature in features])
+        self.codes: np.ndarray = np.array([codes[feature['properties']['name']] for feature in features], dtype='int8')
+        self.tree: shapely.STRtree = shapely.STRtree(self.geometries)
+
+    def assign(self, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
+        """
+        Find the county containing each point, for all points at once.
+        Points on the border of two counties are assigned to one of them.
+        @param lon: The longitudes of the points, in decimal degrees
+        @param lat: The latitudes of the points, in decimal degrees
+        @return: The county codes (see COUNTY_NAMES), NO_COUNTY for the points outside every county
+        """
+        points = shapely.points(np.asarray(lon, dtype=float), np.asarray(lat, dtype=float))
+        point_index, county_index = self.tree.query(points, predicate='intersects')
+
+        codes = np.full(len(points), NO_COUNTY, dtype='int8')
+        codes[point_index] = self.codes[county_index]
+        return codes
+
+
+def discrepancy_matrix(cty: pd.Series, cty_geo: pd.Series) -> pd.DataFrame:
+    """
+    Count the points by their county code and the county containing them.
+    @param cty: The county codes of the points
+    @param cty_geo: The codes of the counties containing the points (see CountyIndex.assign())
+    @return: The counts, with the county codes as rows and the containing counties as columns, by name
+    """
+    names = {**COUNTY_NAMES, NO_COUNTY: 'None'}
+    return pd.crosstab(cty.map(names).fillna('Unknown'), cty_geo.map(names), rownames=['cty'], colnames=['cty_geo'])
+
+
+def discrepancy_summary(matrix: pd.DataFrame) -> pd.DataFrame:
+    """
+    Compare the number of points of each county by county code and by location.
+    @param matrix: The discrepancy matrix (see discrepancy_matrix())
+    @return: The counts by county code and by location, and the percentage of the points with a county code that
+    are located in that county
+    """
+    summary = pd.DataFrame({'cty': matrix.sum(axis=1), 'cty_geo': matrix.sum(axis=0)}).fillna(0).astype(int)
+    matching = pd.Series({county: matrix.loc[county, county] for county in matrix.index if county in matrix.columns})
+    summary['agreement'] = (matching / summary['cty']).reindex(summary.index).fillna(0)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign the points to counties and compare them to their county code")
+    parser.add_argument("files", type=str, nargs='+',
+                        help="The pre-processed Parquet files written by preprocess.py (with lat, lon and cty)")
+    parser.add_argument("--counties_file", type=str, default=COUNTIES_FILE,
+                        help=f"The county boundaries GeoJSON file. Default is {COUNTIES_FILE}.")
+    args = parser.parse_args()
+
+    df = pd.concat([pd.read_parquet(file, columns=['lat', 'lon', 'cty']) for file in args.files], ignore_index=True)
+    print(f"Number of points: {df.shape[0]:,}")
+
+    start = perf_counter()
+    index = CountyIndex(args.counties_file)
+    df['cty_geo'] = index.assign(df['lon'], df['lat'])
+    print(f"Assigned the points to counties in {perf_counter() - start:.2f}s")
+
+    matrix = discrepancy_matrix(df['cty'], df['cty_geo'])
+    summary = discrepancy_summary(matrix)
+    print(f"Points located in the county of their county code: {(df['cty'] == df['cty_geo']).mean():.2%}")
+
+    Path("./output").mkdir(parents=True, exist_ok=True)
+    matrix.to_csv("./output/county_discrepancy_matrix.csv")
+    with open("./output/county_discrepancy.md", 'w') as f:
+        f.write("# County Discrepancy\n\n")
+        f.write(f"| {'County':<14} | {'By code':>9} | {'By location':>11} | {'Agreement':>9} |")
+        f.write(f"\n|{'-' * 16}|{'-' * 11}|{'-' * 13}|{'-' * 11}|")
+        for county, cty, cty_geo, agreement in summary.itertuples():
+            f.write(f"\n| {county:<14} | {cty:>9,} | {cty_geo:>11,} | {agreement:>9.2%} |")
+        f.write("\n")
+    print("Discrepancy matrix and summary saved under './output'")
+
+
+if __name__ == "__main__":
+    main()
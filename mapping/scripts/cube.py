@@ -0,0 +1,183 @@
+import argparse
+import os.path
+from pathlib import Path
+from typing import Optional
+import numpy as np
+import pandas as pd
+from ingest import read_data, year_files
+from manifest import Manifest
+from schema import COUNTY_NAMES, DAY_NAMES, TWAY_NAMES
+
+CUBE_PATH: str = "./output/cube.parquet"
+
+# The dimensions of the cube, besides the year. Missing columns are counted under 0 (unknown).
+DIMENSIONS: list[str] = ['cty', 'month', 'day', 'tway']
+
+# The names of the coded values of each dimension
+CODE_NAMES: dict[str, dict[int, str]] = {'cty': COUNTY_NAMES, 'day': DAY_NAMES, 'tway': TWAY_NAMES}
+
+
+class Cube:
+    """
+    The number of accidents by year, county, month, day of the week and trafficway, saved to a Parquet file.
+    The maps query the cube instead of grouping the rows of every year, so creating them does not depend on the size
+    of the data. Years are added to the cube one at a time, and adding a year again replaces it.
+    The source file of each year is tracked in a manifest next to the cube, so that only new or changed years are
+    counted again.
+    """
+
+    def __init__(self, path: Optional[str] = CUBE_PATH):
+        """
+        @param path: The path to the Parquet file of the cube. It is created if it does not exist.
+                     If None, the cube is only kept in memory.
+        """
+        self.path: Optional[str] = path
+        self.manifest: Manifest = Manifest(str(Path(path).with_suffix('.json')) if path is not None else None)
+        if path is not None and os.path.exists(path):
+            self.data: pd.DataFrame = pd.read_parquet(path)
+        else:
+            self.data = pd.DataFrame({col: pd.Series(dtype='int16' if col == 'year' else 'int8')
+                                      for col in ['year', *DIMENSIONS]}).assign(accidents=pd.Series(dtype='int64'))
+
+    @property
+    def years(self) -> list[int]:
+        """
+        @return: The years in the cube
+        """
+        return sorted(self.data['year'].unique().tolist())
+
+    def add_year(self, year: int, df: pd.DataFrame) -> None:
+        """
+        Count the accidents of a year and add them to the cube, replacing the year if it is already in it.
+        @param year: The year
+        @param df: The rows of the year
+        """
+        keys = pd.DataFrame({col: df[col] if col in df.columns else 0 for col in DIMENSIONS}, index=df.index)
+        keys = keys.fillna(0).astype('int8')
+        counts = keys.groupby(DIMENSIONS).size().reset_index(name='accidents')
+        counts.insert(0, 'year', np.int16(year))
+
+        self.data = pd.concat([self.data[self.data['year'] != year], counts], ignore_index=True)
+
+    def merge(self, other: 'Cube') -> None:
+        """
+        Add the years of another cube, replacing them if they are already in this cube.
+        @param other: The other cube
+        """
+        self.data = pd.concat([self.data[~self.data['year'].isin(other.years)], other.data], ignore_index=True)
+        self.manifest.update(other.manifest)
+
+    def update(self, file_paths: dict[int, str]) -> None:
+        """
+        Add the years that are not in the cube yet or whose file changed, and save the cube.
+        @param file_paths: The paths to the csv files, by year
+        """
+        changed = {year: file_path for year, file_path in file_paths.items()
+                   if year not in self.years or self.manifest.changed(year, file_path)}
+        for year, file_path in changed.items():
+            print(f"Adding the year {year} to the cube...")
+            self.add_year(year, read_data(file_path))
+            self.manifest.record(year, file_path)
+
+        if changed:
+            self.save()
+
+    def save(self) -> None:
+        """
+        Save the cube to its Parquet file, if it has one.
+        """
+        if self.path is None:
+            return
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self.data.sort_values(['year', *DIMENSIONS]).to_parquet(self.path, index=False)
+        self.manifest.save()
+
+    def counts(self, by: list[str], names: bool = False, **filters) -> pd.Series:
+        """
+        Count the accidents by some dimensions, e.g. `cube.counts(['cty', 'year'], tway=[1, 2])`.
+        @param by: The dimensions to group by
+        @param names: If True, use the names of the coded values (see CODE_NAMES) instead of the codes
+        @param filters: The values to keep for some dimensions, a single value or a list of values
+        @return: The number of accidents, indexed by the dimensions
+        """
+        data = self.data
+        for col, values in filters.items():
+            data = data[data[col].isin(values if isinstance(values, (list, tuple, set)) else [values])]
+
+        counts = data.groupby(by)['accidents'].sum()
+        if names:
+            for col in by:
+                if col in CODE_NAMES:
+                    counts = counts.rename(index=CODE_NAMES[col], level=col if len(by) > 1 else None)
+
+        return counts
+
+    def table(self, index: str = 'cty', names: bool = False, **filters) -> pd.DataFrame:
+        """
+        Count the accidents by a dimension and by year.
+        @param index: The dimension
+        @param names: If True, use the names of the coded values (see CODE_NAMES) instead of the codes
+        @param filters: The values to keep for some dimensions (see counts())
+        @return: The number of accidents, with the dimension as rows and the years as columns
+        """
+        return self.counts([index, 'year'], names, **filters).unstack(fill_value=0)
+
+    def yoy(self, index: str = 'cty', names: bool = False, **filters) -> pd.DataFrame:
+        """
+        Get the year-over-year change of the number of accidents. The first year has no change (NaN).
+        @param index: The dimension
+        @param names: If True, use the names of the coded values (see CODE_NAMES) instead of the codes
+        @param filters: The values to keep for some dimensions (see counts())
+        @return: The change, with the dimension as rows and the years as columns
+        """
+        return self.table(index, names, **filters).diff(axis=1)
+
+    def cumulative_score(self, index: str = 'cty', names: bool = False, **filters) -> pd.DataFrame:
+        """
+        Get the cumulative trend score: +1 for every year with more accidents than the year before, -1 for every
+        year with less.
+        @param index: The dimension
+        @param names: If True, use the names of the coded values (see CODE_NAMES) instead of the codes
+        @param filters: The values to keep for some dimensions (see counts())
+        @return: The score, with the dimension as rows and the years as columns. The last column is the final score.
+        """
+        return np.sign(self.yoy(index, names, **filters)).fillna(0).astype(int).cumsum(axis=1)
+
+
+def year_counts(file_path: str, year: int) -> pd.DataFrame:
+    """
+    Count the accidents of a year, as a stage of the pipeline (see `pipeline.py`).
+    @param file_path: The path to the csv file
+    @param year: The year
+    @return: The rows of the year in a cube
+    """
+    cube = Cube(None)
+    cube.add_year(int(year), read_data(file_path))
+    return cube.data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add years to the aggregation cube and print its counts")
+    parser.add_argument("csv_files", type=str, nargs='*', help="The paths to the csv files to add")
+    parser.add_argument("--cube_path", type=str, default=CUBE_PATH, help=f"The cube file. Default is {CUBE_PATH}.")
+    parser.add_argument("--by", type=str, nargs='+', default=['year'],
+                        help="The dimensions to count the accidents by. Default is year.")
+    args = parser.parse_args()
+
+    cube = Cube(args.cube_path)
+
+    # Adding a file replaces its year, even if it is already in the cube. A final file replaces a preliminary one
+    for year, file_path in year_files(args.csv_files).items():
+        print(f"Adding the year {year} to the cube...")
+        cube.add_year(year, read_data(file_path))
+        cube.manifest.record(year, file_path)
+    if args.csv_files:
+        cube.save()
+
+    print(f"Years in the cube: {cube.years}")
+    print(cube.counts(args.by, names=True).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import base64
+import hashlib
+import multiprocessing as mp
+import os
+from pathlib import Path
+from typing import Callable, Optional
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+from anova import anova, stream_moments
+from ingest import CACHE_DIR_NAME, year_files
+
+try:
+    from pypdf import PdfWriter  # Merges the cached pages of the PDF files
+    HAS_PYPDF: bool = True
+except ImportError:
+    HAS_PYPDF: bool = False
+
+FIGURES_DIR: str = f"./output/{CACHE_DIR_NAME}/figures"  # The cache of the rendered charts
+
+CHARTS_VERSION: int = 1  # Increase when the charts are drawn differently, so that the cached charts are rendered again
+
+
+def trend_chart(fig: Figure, data: pd.Series, annotation: str = '') -> None:
+    """
+    Draw the trend of the mean of a column over the years, as in `analysis/exploration.ipynb`.
+    @param fig: The figure
+    @param data: The mean of the column, by year. Its name is the name of the column.
+    @param annotation: The text written in the top left corner, e.g. the result of the ANOVA
+    """
+    ax = fig.subplots()
+    data.set_axis(data.index.astype(str)).plot(ax=ax, marker='o')  # One tick per year, whatever the type of the years
+    ax.set_title(f'Trend of {data.name} over years')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Mean value')
+    ax.annotate(annotation, xy=(0.05, 0.95), xycoords='axes fraction', va='top')
+
+
+def county_chart(fig: Figure, data: pd.Series, county: str = '') -> None:
+    """
+    Draw the number of accidents of a county over the years, as in the popups of the trends maps.
+    @param fig: The figure
+    @param data: The number of accidents, by year
+    @param county: The name of the county
+    """
+    ax = fig.subplots()
+    ax.plot(data.index, data.to_numpy(), marker='o')
+    ax.set_title(f"{county} Accidents Over Time")
+    ax.set_xlabel("Year")
+    ax.set_ylabel("Number of Accidents")
+
+    # Use the integer years as the x-axis ticks
+    ax.set_xticks(data.index.unique())
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, p: f"{int(x)}"))
+    fig.tight_layout()
+
+
+# The drawing function and size (inches) of each kind of chart
+CHARTS: dict[str, tuple[Callable[..., None], tuple[float, float]]] = {
+    'trend': (trend_chart, (10, 6)),
+    'county': (county_chart, (6, 4)),
+}
+
+
+def chart_key(kind: str, data: pd.Series, options: dict) -> str:
+    """
+    Get the cache key of a chart, the hash of its kind, of its input series and of its options.
+    @param kind: The kind of chart (see CHARTS)
+    @param data: The input series
+    @param options: The options of the drawing function
+    @return: The key
+    """
+    digest = hashlib.sha256(f"{CHARTS_VERSION}|{kind}|{data.name}|{sorted(options.items())}".encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def draw_chart(kind: str, data: pd.Series, options: dict) -> Figure:
+    """
+    Draw a chart on a figure of the Agg backend. The figure is created without pyplot, so the backend of the calling
+    process (e.g. of a notebook) is left alone, and no figure is left open.
+    @param kind: The kind of chart (see CHARTS)
+    @param data: The input series
+    @param options: The options of the drawing function
+    @return: The figure
+    """
+    draw, size = CHARTS[kind]
+
+    fig = Figure(figsize=size)
+    FigureCanvasAgg(fig)
+    draw(fig, data, **options)
+
+    return fig
+
+
+def render_chart(task: tuple[str, pd.Series, dict, Path]) -> Path:
+    """
+    Render a chart to a file, in the format of its extension.
+    @param task: The kind of chart, the input series, the options of the drawing function and the path of the file
+    @return: The path of the file
+    """
+    kind, data, options, path = task
+    fig = draw_chart(kind, data, options)
+
+    # Write to a temporary file first, so that an interrupted rendering never leaves a corrupted chart in the cache
+    tmp_path = path.with_suffix('.tmp')
+    fig.savefig(tmp_path, format=path.suffix[1:])
+    os.replace(tmp_path, path)
+
+    return path
+
+
+def render_charts(charts: dict[str, tuple[str, pd.Series, dict]], cache_dir: str = FIGURES_DIR, fmt: str = 'png',
+                  processes: Optional[int] = None) -> dict[str, Path]:
+    """
+    Render charts in parallel, one chart per task. Each chart is cached under the hash of its input series and
+    options, so the charts whose data did not change are not rendered again.
+    @param charts: The kind of chart (see CHARTS), the input series and the options of the drawing function, by name
+    @param cache_dir: The cache directory
+    @param fmt: The format of the files, 'png' or 'pdf'
+    @param processes: The number of processes. Default is the number of CPUs.
+    @return: The paths of the files, by name, in the order of the charts
+    """
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    paths = {name: Path(cache_dir) / f"{kind}.{chart_key(kind, data, options)}.{fmt}"
+             for name, (kind, data, options) in charts.items()}
+
+    tasks = [(*charts[name], path) for name, path in paths.items() if not path.exists()]
+    print(f"Rendering {len(tasks):,} of {len(charts):,} charts, the others are cached...")
+    if tasks:
+        with mp.Pool(min(processes or mp.cpu_count(), len(tasks))) as pool:
+            for _ in pool.imap_unordered(render_chart, tasks):
+                pass
+
+    return paths
+
+
+def write_pdf(charts: dict[str, tuple[str, pd.Series, dict]], file_name: str, cache_dir: str = FIGURES_DIR,
+              processes: Optional[int] = None) -> None:
+    """
+    Write charts to a PDF file, one chart per page. The pages are rendered in parallel and cached (see
+    render_charts()), and then merged. Without pypdf, the pages are drawn one after the other, without the cache.
+    @param charts: The kind of chart (see CHARTS), the input series and the options of the drawing function, by name
+    @param file_name: The path to the PDF file
+    @param cache_dir: The cache directory
+    @param processes: The number of processes. Default is the number of CPUs.
+    """
+    if not HAS_PYPDF:
+        print("pypdf is not installed, drawing the pages without the cache.")
+        with PdfPages(file_name) as pdf:
+            for kind, data, options in charts.values():
+                pdf.savefig(draw_chart(kind, data, options))
+        return
+
+    writer = PdfWriter()
+    for path in render_charts(charts, cache_dir, 'pdf', processes).values():
+        writer.append(str(path))
+    writer.compress_identical_objects()  # The pages share most of their fonts
+    with open(file_name, 'wb') as f:
+        writer.write(f)
+
+
+def base64_charts(paths: dict[str, Path]) -> dict[str, str]:
+    """
+    Read rendered charts as base64 strings, e.g. for the popups of a map.
+    @param paths: The paths of the PNG files, by name
+    @return: The base64 encoded PNG files, by name
+    """
+    return {name: base64.b64encode(path.read_bytes()).decode() for name, path in paths.items()}
+
+
+def trend_charts(yearly: pd.DataFrame, results: dict[str, dict]) -> dict[str, tuple[str, pd.Series, dict]]:
+    """
+    Get the trend chart of each column, annotated with its ANOVA.
+    @param yearly: The statistics of the columns, by year (see `anova.py`)
+    @param results: The ANOVA of each column, as `anova(yearly).to_dict('index')`
+    @return: The charts, by column
+    """
+    charts = {}
+    for col, result in results.items():
+        if result['error'] is None:
+            annotation = f"f-statistic: {result['f_statistic']:.4f}\np-value: {result['p_value']:.4f}"
+        else:
+            annotation = f"Error: {result['error']}"
+        charts[col] = ('trend', yearly['mean'][col], {'annotation': annotation})
+
+    return charts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the trend of each numeric column over the years to a PDF")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files, one per year. The year is derived from each filename.")
+    parser.add_argument("--out_file", type=str, default="./output/stats_results.pdf",
+                        help="The path to the PDF file. Default is ./output/stats_results.pdf.")
+    parser.add_argument("--cache_dir", type=str, default=FIGURES_DIR,
+                        help=f"The cache directory of the charts. Default is {FIGURES_DIR}.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="The number of processes. Default is the number of CPUs.")
+    args = parser.parse_args()
+
+    files = year_files(args.csv_files)
+    yearly = stream_moments(files)
+
+    Path(args.out_file).parent.mkdir(parents=True, exist_ok=True)
+    write_pdf(trend_charts(yearly, anova(yearly).to_dict('index')), args.out_file, args.cache_dir, args.processes)
+    print(f"All plots are saved to '{args.out_file}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+import os
+from pathlib import Path
+import geopandas as gpd
+import plotly.graph_objects as go
+import shapely
+from ingest import CACHE_DIR_NAME, source_key
+
+# The simplification levels of the boundaries, as the tolerance of the simplification, in degrees
+# A degree of latitude is about 111 km, so the borders move by at most about 11 m (fine), 110 m (medium) and 550 m
+# (coarse)
+LEVELS: dict[str, float] = {'full': 0, 'fine': 0.0001, 'medium': 0.001, 'coarse': 0.005}
+
+# The deepest zoom level of each level, where the borders move by less than a pixel
+# In South Carolina, a pixel of the web map tiles is about 1 km at zoom 7, 130 m at zoom 10 and 16 m at zoom 13
+ZOOMS: dict[str, int] = {'coarse': 7, 'medium': 10, 'fine': 13}
+
+# The level used by each type of output
+# The scatter maps are zoomed in to the streets, past every simplified level, while the heat and choropleth maps are
+# seen at the scale of the state and its counties
+OUTPUT_LEVELS: dict[str, str] = {'scatter': 'full', 'heat': 'medium', 'choropleth': 'medium'}
+
+PRECISION: float = 0.00001  # The coordinates of the simplified boundaries are rounded to about 1 m
+
+
+def level_for_zoom(zoom: float) -> str:
+    """
+    Get the coarsest level whose simplification cannot be seen at a zoom level (see ZOOMS).
+    @param zoom: The deepest zoom level of the map
+    @return: The level
+    """
+    for level, max_zoom in ZOOMS.items():
+        if zoom <= max_zoom:
+            return level
+    return 'full'
+
+
+def simplify(gdf: gpd.GeoDataFrame, tolerance: float) -> gpd.GeoDataFrame:
+    """
+    Simplify boundaries while preserving their topology: the borders shared by two counties are simplified the same
+    way on both sides, so that no gaps or overlaps appear between them.
+    @param gdf: The boundaries
+    @param tolerance: The tolerance, in degrees
+    @return: The simplified boundaries
+    """
+    if tolerance == 0:
+        return gdf
+
+    geometry = gdf.geometry.values
+    if hasattr(shapely, 'coverage_simplify'):  # Shapely 2.1 or later
+        geometry = shapely.coverage_simplify(geometry, tolerance)
+    else:
+        geometry = shapely.simplify(geometry, tolerance, preserve_topology=True)
+    geometry = shapely.set_precision(geometry, PRECISION)
+
+    return gdf.set_geometry(gpd.GeoSeries(geometry, index=gdf.index, crs=gdf.crs))
+
+
+def simplified_path(file_name: str, level: str) -> Path:
+    """
+    Get the path of the cached simplified boundaries of a GeoJSON file.
+    @param file_name: The path to the GeoJSON file
+    @param level: The simplification level (see LEVELS)
+    @return: The path of the cached GeoJSON file, under a `.cache` directory next to the file
+    """
+    source = Path(file_name)
+    return source.parent / CACHE_DIR_NAME / f"{source.stem}.{source_key(file_name)}.{level}.geojson"
+
+
+def simplified(file_name: str, level: str = 'medium') -> gpd.GeoDataFrame:
+    """
+    Read the simplified boundaries of a GeoJSON file. They are simplified once and cached, until the file changes.
+    @param file_name: The path to the GeoJSON file
+    @param level: The simplification level (see LEVELS)
+    @return: The simplified boundaries
+    """
+    return gpd.read_file(simplified_geojson_path(file_name, level))
+
+
+def simplified_geojson(file_name: str, level: str = 'medium') -> str:
+    """
+    Read the simplified boundaries of a GeoJSON file as text, e.g. for folium.GeoJson.
+    @param file_name: The path to the GeoJSON file
+    @param level: The simplification level (see LEVELS)
+    @return: The content of the simplified GeoJSON file
+    """
+    with open(simplified_geojson_path(file_name, level), 'r') as f:
+        return f.read()
+
+
+def simplified_geojson_path(file_name: str, level: str) -> Path:
+    """
+    Get the path of the simplified boundaries of a GeoJSON file, simplifying them first if they are not cached yet.
+    @param file_name: The path to the GeoJSON file
+    @param level: The simplification level (see LEVELS)
+    @return: The path of the cached GeoJSON file, or of the file itself for the 'full' level
+    """
+    if level == 'full':
+        return Path(file_name)
+
+    path = simplified_path(file_name, level)
+    if not path.exists():
+        gdf = simplify(gpd.read_file(file_name), LEVELS[level])
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        for stale in path.parent.glob(f"{Path(file_name).stem}.*.{level}.geojson"):
+            stale.unlink()
+
+        # Write to a temporary file first, so that an interrupted simplification never leaves a corrupted cache
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(gdf.to_json(drop_id=True, default=str))  # Dates are written as text
+        os.replace(tmp_path, path)
+
+    return path
+
+
+def share_geometry(fig: go.Figure) -> go.Figure:
+    """
+    Keep the GeoJSON of an animated choropleth map in its first trace only. Plotly Express repeats it in every frame,
+    while the frames only have to change the colors: the traces keep the GeoJSON they were created with.
+    @param fig: The figure
+    @return: The figure
+    """
+    for frame in fig.frames:
+        for trace in frame.data:
+            trace.geojson = None
+
+    return fig
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simplify and cache boundary GeoJSON files at every level")
+    parser.add_argument("files", type=str, nargs='+', help="The paths to the GeoJSON files")
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        print(f"Simplifying '{file_name}' ({os.path.getsize(file_name) / 1024:,.0f} KB)...")
+        for level in LEVELS:
+            path = simplified_geojson_path(file_name, level)
+            num_points = shapely.get_num_coordinates(gpd.read_file(path).geometry.values).sum()
+            print(f"  {level:<6} (tolerance {LEVELS[level]}): {num_points:,} points, "
+                  f"{os.path.getsize(path) / 1024:,.0f} KB, '{path}'")
+
+    print("Levels by zoom: " + ", ".join(f"{zoom}: {level_for_zoom(zoom)}" for zoom in range(6, 17, 2)))
+
+
+if __name__ == "__main__":
+    main()
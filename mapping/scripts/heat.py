@@ -0,0 +1,180 @@
+import argparse
+import os.path
+from pathlib import Path
+from typing import Optional
+import folium as fm
+import numpy as np
+import pandas as pd
+from folium.plugins import HeatMapWithTime
+from geometry import OUTPUT_LEVELS, simplified_geojson
+from ingest import read_years, year_files
+from preprocess import load_polygon
+from scatter import in_polygon
+from schema import SC_BOUNDS
+
+GRID_SIZE: float = 0.01  # Degrees, about 1 km
+
+# The time steps of the frames, and the columns they need
+STEPS: dict[str, list[str]] = {'year': ['year'], 'month': ['year', 'month'], 'week': ['date']}
+
+# The weights of the cells are scaled so that this quantile of the non-empty cells, over all the frames, is the
+# hottest color. Scaling by the maximum instead would leave all but the few busiest cells nearly invisible.
+SATURATION: float = 0.99
+
+
+def heat_grid(lat: np.ndarray, lon: np.ndarray, size: float = GRID_SIZE,
+              bounds: tuple[float, float, float, float] = SC_BOUNDS) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Bin points into a grid of fixed size over the bounds, and keep only the non-empty cells.
+    @param lat: The latitudes of the points
+    @param lon: The longitudes of the points
+    @param size: The size of the cells, in degrees
+    @param bounds: The bounds of the grid (min lon, min lat, max lon, max lat). Points outside are left out.
+    @return: The latitudes and longitudes of the centers of the non-empty cells, and their number of points
+    """
+    min_lon, min_lat, max_lon, max_lat = bounds
+    lat_edges = np.arange(min_lat, max_lat + size, size)
+    lon_edges = np.arange(min_lon, max_lon + size, size)
+
+    counts, _, _ = np.histogram2d(lat, lon, bins=[lat_edges, lon_edges])
+    rows, cols = np.nonzero(counts)
+
+    return lat_edges[rows] + size / 2, lon_edges[cols] + size / 2, counts[rows, cols]
+
+
+def time_steps(df: pd.DataFrame, step: str = 'year') -> pd.Series:
+    """
+    Get the time step of each row, as a sortable label.
+    @param df: The DataFrame, with the columns of the step (see STEPS)
+    @param step: The time step, 'year', 'month' or 'week'
+    @return: The labels, e.g. '2017', '2017-08' or '2017-08-07/2017-08-13'
+    """
+    missing = [col for col in STEPS[step] if col not in df.columns]
+    if missing:
+        raise ValueError(f"The '{step}' time step needs the {', '.join(missing)} column(s)")
+
+    if step == 'year':
+        return df['year'].astype(str)
+    elif step == 'month':
+        return df['year'].astype(str) + '-' + df['month'].astype(int).map('{:02d}'.format)
+    else:
+        return pd.to_datetime(df['date']).dt.to_period('W').astype(str)
+
+
+def heat_frames(df: pd.DataFrame, step: str = 'year',
+                size: float = GRID_SIZE) -> tuple[list[str], list[list[list[float]]]]:
+    """
+    Bin the points of each time step into a grid, for HeatMapWithTime. The size of the frames depends on the size of
+    the grid, not on the number of points.
+    @param df: The DataFrame, with `lat` and `lon` columns in decimal degrees and the columns of the step
+    @param step: The time step, 'year', 'month' or 'week'
+    @param size: The size of the cells, in degrees
+    @return: The label of each frame, and the frames, each a list of [lat, lon, weight] for the non-empty cells
+    """
+    groups = df.groupby(time_steps(df, step))  # In the order of the labels
+    labels = [str(label) for label in groups.groups]
+
+    grids = [heat_grid(group['lat'], group['lon'], size) for _, group in groups]
+
+    # Use the same scale for all the frames, so that they can be compared
+    all_counts = np.concatenate([counts for _, _, counts in grids])
+    scale = np.quantile(all_counts, SATURATION) if len(all_counts) else 1
+
+    frames = [np.column_stack([lat.round(4), lon.round(4), np.minimum(counts / scale, 1).round(3)]).tolist()
+              for lat, lon, counts in grids]
+
+    return labels, frames
+
+
+def heat_map(labels: list[str], frames: list[list[list[float]]], borders: Optional[str] = None) -> fm.Map:
+    """
+    Create a heat map with a time component from the frames of heat_frames().
+    @param labels: The label of each frame
+    @param frames: The frames
+    @param borders: The content of the county boundaries GeoJSON file, if the borders are drawn
+    @return: The map
+    """
+    # Create a map centered on South Carolina
+    sc_center_lat, sc_center_lon = 33.8361, -81.1637  # Approximate center of SC
+    m = fm.Map(location=[sc_center_lat, sc_center_lon], zoom_start=7)
+
+    if borders is not None:
+        bordersStyle = {
+            'color': 'green',
+            'weight': 2,
+            'fillColor': 'blue',
+            'fillOpacity': 0.1
+        }
+        fm.GeoJson(data=borders, name="South Carolina", style_function=lambda x: bordersStyle).add_to(m)
+
+    # Add the heatmap with time component
+    HeatMapWithTime(frames,
+                    name="Heatmap with Time",
+                    radius=15,
+                    auto_play=True,
+                    position='bottomright',
+                    max_opacity=0.8,
+                    index=labels
+                    ).add_to(m)
+
+    # Add a layer control
+    fm.LayerControl().add_to(m)
+
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a heat map with a time component from pre-binned grids")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files. The year is derived from each filename.")
+    parser.add_argument("--step", type=str, choices=list(STEPS), default='year',
+                        help="The time step of the frames. 'week' needs a date column. Default is year.")
+    parser.add_argument("--grid_size", type=float, default=GRID_SIZE,
+                        help=f"The size of the grid cells, in degrees. Default is {GRID_SIZE}.")
+    args = parser.parse_args()
+
+    # Load the GeoJSON files in a try-except block
+    file_name: str = "data/south carolina.geojson"
+    try:
+        polygon = load_polygon(file_name)
+        file_name = "data/South Carolina County Boundaries.geojson"
+        borders = simplified_geojson(file_name, OUTPUT_LEVELS['heat'])
+    except FileNotFoundError:
+        print(f"The '{file_name}' was not found. Exiting...")
+        exit()
+
+    files = year_files(args.csv_files)
+    columns = ['lat', 'lon', *[col for col in STEPS[args.step] if col != 'year']]  # The year comes from the filename
+    for file_path in files.values():
+        if not os.path.exists(file_path):
+            print(f"The '{file_path}' file was not found. Exiting...")
+            exit()
+        missing = [col for col in columns if col not in pd.read_csv(file_path, nrows=0).columns]
+        if missing:
+            print(f"The '{file_path}' file has no {', '.join(missing)} column, needed by the '{args.step}' time step. "
+                  f"Exiting...")
+            exit()
+
+    df = read_years(files, columns=columns)
+    print(f"Length of the dataset: {len(df):,}")
+
+    # Remove the rows with lat = 0 or lon = 0, convert lat and lon to decimal degrees, and keep the points within SC
+    df = df[(df['lat'] != 0) & (df['lon'] != 0)]
+    df = df.assign(lat=df['lat'] / 1_000_000, lon=- (df['lon'] / 1000000))  # Note the negative sign for longitude
+    df = df[in_polygon(polygon, df['lon'], df['lat'])]
+    print(f"Points within SC: {len(df):,}")
+    if df.empty:
+        print("No points are within SC. Exiting...")
+        exit()
+
+    labels, frames = heat_frames(df, args.step, args.grid_size)
+    print(f"Binned into {len(frames)} frames of {max((len(frame) for frame in frames), default=0):,} cells at most")
+
+    Path("./output").mkdir(parents=True, exist_ok=True)
+    f_name: str = f"./output/heat_map_{args.step}.html"
+    heat_map(labels, frames, borders).save(f_name)
+    print(f"Map has been saved as '{f_name}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import os
+import os.path
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+from shapely.geometry import Polygon
+from counties import COUNTIES_FILE, CountyIndex
+from cube import Cube
+from ingest import year_files
+from manifest import Manifest
+from preprocess import load_polygon, preprocess
+from quality import Statistics, write_statistics
+
+STORE_DIR: str = "./output/store"
+
+
+def update_store(files: dict[int, str], store_dir: str, polygon: Polygon,
+                 counties: Optional[CountyIndex] = None) -> Manifest:
+    """
+    Bring the store up to date with the csv files: the cleaned points of each year, the aggregation cube, and the
+    statistics of each year. Only the years whose file is new or changed since it was processed (by content hash) are
+    cleaned, filtered and counted again, and the other years are left as they are.
+    @param files: The paths to the csv files, by year. Years that are already in the store do not have to be given.
+    @param store_dir: The store directory
+    @param polygon: The polygon of the state
+    @param counties: The county index. If given, the county containing each point is added as `cty_geo`. The years
+                     processed with the other setting are processed again.
+    @return: The manifest of the store
+    """
+    Path(store_dir).mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(os.path.join(store_dir, "manifest.json"))
+    cube = Cube(os.path.join(store_dir, "cube.parquet"))
+
+    options = {'counties': counties is not None}
+    for year, file_path in files.items():
+        if not manifest.changed(year, file_path, options):
+            print(f"The year {year} is up to date, skipping '{file_path}'")
+            continue
+
+        print(f"Processing the year {year} from '{file_path}'...")
+
+        # Write to a temporary file first, so that the store keeps the previous points if processing fails
+        points_path = os.path.join(store_dir, f"points_{year}.parquet")
+        stats = preprocess([file_path], f"{points_path}.tmp", polygon, counties=counties, name=f"the year {year}")
+        os.replace(f"{points_path}.tmp", points_path)
+
+        cube.update({year: file_path})
+        manifest.record(year, file_path, options, statistics=stats.to_dict())
+        manifest.save()  # After each year, so that an interrupted update keeps the years already done
+
+    return manifest
+
+
+def read_store(store_dir: str = STORE_DIR, years: Optional[list[int]] = None,
+               columns: Optional[list[str]] = None) -> pd.DataFrame:
+    """
+    Read the cleaned points of the store.
+    @param store_dir: The store directory
+    @param years: The years to read. Default is all of them.
+    @param columns: The columns to read. Default is all of them.
+    @return: The cleaned points, with a `year` column
+    """
+    manifest = Manifest(os.path.join(store_dir, "manifest.json"))
+    years = years or sorted(int(year) for year in manifest.entries)
+
+    return pd.concat([pd.read_parquet(os.path.join(store_dir, f"points_{year}.parquet"), columns=columns)
+                      .assign(year=year) for year in years], ignore_index=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Add new or changed years to the store, without processing the "
+                                                 "other years again")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files. The year is derived from each filename, and a final file "
+                             "replaces a preliminary one (e.g. prelim_...).")
+    parser.add_argument("--store_dir", type=str, default=STORE_DIR,
+                        help=f"The store directory. Default is {STORE_DIR}.")
+    parser.add_argument("--counties", action="store_true",
+                        help="Add the county containing each point as cty_geo (see counties.py). Default is False.")
+    parser.add_argument("--print_stats", action="store_true",
+                        help="Print the statistics file of all the years. Default is False. To print, use this flag.")
+    args = parser.parse_args()
+
+    files = year_files(args.csv_files)  # A final file replaces a preliminary one
+
+    # Load the GeoJSON file in a try-except block
+    file_name: str = "data/south carolina.geojson"
+    try:
+        polygon = load_polygon(file_name)
+    except FileNotFoundError:
+        print(f"The '{file_name}' was not found. Exiting...")
+        exit()
+
+    counties = CountyIndex(COUNTIES_FILE) if args.counties else None
+    manifest = update_store(dict(sorted(files.items())), args.store_dir, polygon, counties)
+    print(f"Years in the store: {', '.join(sorted(manifest.entries, key=int))}")
+
+    if args.print_stats:
+        file_name = os.path.join(args.store_dir, "data_statistics.md")
+        print(f"Saving data statistics to '{file_name}' and its .json file")
+        write_statistics([Statistics.from_dict(manifest.entries[year]['statistics'])
+                          for year in sorted(manifest.entries, key=int)], file_name)
+
+
+if __name__ == "__main__":
+    main()
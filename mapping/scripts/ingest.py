@@ -0,0 +1,213 @@
+import argparse
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+import numpy as np
+import pandas as pd
+from quality import COERCION_ATTR, Statistics
+from schema import SCHEMA_VERSION, apply_schema, memory_usage
+
+try:
+    import pyarrow  # noqa: F401, needed by pandas to read and write Parquet
+    HAS_PYARROW: bool = True
+except ImportError:
+    HAS_PYARROW: bool = False
+
+CACHE_DIR_NAME: str = ".cache"  # The cache directory, created next to the csv files
+
+
+def coerce_coordinates(df: pd.DataFrame, stats: Optional[Statistics] = None) -> pd.DataFrame:
+    """
+    Convert the lat and lon columns to int64 if they are of type object (see Statistics.coordinates()).
+    The notes, non-numeric counts and examples of the conversion are kept in `df.attrs`, which are saved with the
+    cache, so that the data statistics of the cached data still report them.
+    @param df: The DataFrame
+    @param stats: The data statistics to count the non-numeric values in. Default is a new one.
+    @return: The DataFrame with integer coordinates
+    """
+    stats = stats if stats is not None else Statistics("")
+    if 'lat' in df.columns and 'lon' in df.columns:
+        df = stats.coordinates(df, 'lat', 'lon')
+    else:
+        for col in ('lat', 'lon'):
+            if col in df.columns and df[col].dtype == 'object':
+                df = stats.to_int(df, col)
+
+    df.attrs[COERCION_ATTR] = stats.coercion()
+    return df
+
+
+def is_preliminary(file_path: str) -> bool:
+    """
+    Check whether a csv file holds preliminary data, e.g. `prelim_sc_loc2022.csv` or `sc_loc2021_prelim.csv`, which
+    the final file of the same year replaces.
+    @param file_path: The path to the csv file
+    @return: True if the file is preliminary
+    """
+    return 'prelim' in os.path.basename(file_path).lower()
+
+
+def file_year(file_path: str) -> int:
+    """
+    Get the year of a csv file, the last four digits of its name, e.g. 2021 for `sc_loc2021_prelim.csv`.
+    @param file_path: The path to the csv file
+    @return: The year
+    """
+    return int(re.findall(r'\d{4}', Path(file_path).stem)[-1])
+
+
+def year_files(file_paths: list[str]) -> dict[int, str]:
+    """
+    Get the csv files by year (see file_year()). A final file replaces a preliminary one of the same year, whatever
+    their order (see is_preliminary()).
+    @param file_paths: The paths to the csv files
+    @return: The paths to the csv files, by year, in year order
+    """
+    files: dict[int, str] = {}
+    for file_path in sorted(file_paths, key=lambda path: not is_preliminary(path)):  # The preliminary files first
+        files[file_year(file_path)] = file_path
+
+    return dict(sorted(files.items()))
+
+
+def source_key(file_path: str, use_hash: bool = False) -> str:
+    """
+    Get the key of a csv file, which changes whenever the file does.
+    @param file_path: The path to the csv file
+    @param use_hash: If True, hash the content of the file instead of using its size and modification time
+    @return: The key of the file
+    """
+    if use_hash:
+        digest = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()[:16]
+
+    stat = os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def cache_path(file_path: str, use_hash: bool = False, cache_dir: Optional[str] = None) -> Path:
+    """
+    Get the path of the columnar cache of a csv file.
+    @param file_path: The path to the csv file
+    @param use_hash: If True, key the cache by the content of the file instead of its size and modification time
+    @param cache_dir: The cache directory. Default is a `.cache` directory next to the csv file.
+    @return: The path of the Parquet file
+    """
+    source = Path(file_path)
+    directory = Path(cache_dir) if cache_dir is not None else source.parent / CACHE_DIR_NAME
+    return directory / f"{source.stem}.{source_key(file_path, use_hash)}.v{SCHEMA_VERSION}.parquet"
+
+
+def convert(file_path: str, path: Path) -> None:
+    """
+    Parse a csv file once and save it as a typed Parquet file.
+    The lat and lon columns are converted to integers (see coerce_coordinates()), and the schema is applied
+    (see schema.py).
+    Caches of previous versions of the csv file are removed.
+    @param file_path: The path to the csv file
+    @param path: The path of the Parquet file
+    """
+    print(f"Converting '{file_path}' to '{path}'...")
+    df = pd.read_csv(file_path, low_memory=False)
+
+    # Coerce the coordinates once, here, instead of on every load
+    df = coerce_coordinates(df)
+
+    memory_before = memory_usage(df)
+    df = apply_schema(df)
+    print(f"Memory used: {memory_before:,.1f} MB with the inferred dtypes, {memory_usage(df):,.1f} MB with the schema")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    for stale in path.parent.glob(f"{Path(file_path).stem}.*.parquet"):
+        stale.unlink()
+
+    # Write to a temporary file first, so that an interrupted conversion never leaves a corrupted cache
+    tmp_path = path.with_suffix('.tmp')
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def read_data(file_path: str, columns: Optional[list[str]] = None, use_hash: bool = False,
+              cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read a yearly csv file through its columnar cache.
+    The first read parses the csv file and caches it as Parquet, and later reads only load the requested columns
+    from the cache, until the csv file changes.
+    @param file_path: The path to the csv file
+    @param columns: The columns to read. Default is all of them.
+    @param use_hash: If True, key the cache by the content of the file instead of its size and modification time
+    @param cache_dir: The cache directory. Default is a `.cache` directory next to the csv file.
+    @return: The DataFrame
+    """
+    if not HAS_PYARROW:
+        print("pyarrow is not installed, reading the csv file without the cache.")
+        df = pd.read_csv(file_path, usecols=columns, low_memory=False)
+        return apply_schema(coerce_coordinates(df))
+
+    path = cache_path(file_path, use_hash, cache_dir)
+    if not path.exists():
+        convert(file_path, path)
+
+    return pd.read_parquet(path, columns=columns)
+
+
+def read_years(file_paths: dict[int, str], columns: Optional[list[str]] = None, use_hash: bool = False,
+               cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read several yearly csv files through their columnar caches and combine them.
+    @param file_paths: The paths to the csv files, by year
+    @param columns: The columns to read. Default is all of them.
+    @param use_hash: If True, key the caches by the content of the files instead of their size and modification time
+    @param cache_dir: The cache directory. Default is a `.cache` directory next to each csv file.
+    @return: The combined DataFrame, with a `year` column
+    """
+    def read_year(year: int, file_path: str) -> pd.DataFrame:
+        return read_data(file_path, columns, use_hash, cache_dir).assign(year=np.int16(year))
+
+    # Read the years concurrently, reading and writing Parquet files releases the GIL
+    with ThreadPoolExecutor() as executor:
+        dfs = list(executor.map(read_year, file_paths.keys(), file_paths.values()))
+    df = pd.concat(dfs, ignore_index=True)
+
+    # Categoricals with different categories in each year are combined as objects, so convert them back
+    for col in dfs[0].columns[dfs[0].dtypes == 'category']:
+        if df[col].dtype != 'category':
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the yearly csv files to their columnar caches")
+    parser.add_argument("csv_files", type=str, nargs='+', help="The paths to the csv files")
+    parser.add_argument("--hash", action="store_true",
+                        help="Key the caches by the content of the files instead of their size and modification "
+                             "time. Default is False.")
+    parser.add_argument("--cache_dir", type=str, default=None,
+                        help="The cache directory. Default is a .cache directory next to each csv file.")
+    args = parser.parse_args()
+
+    for file_path in args.csv_files:
+        start = perf_counter()
+        pd.read_csv(file_path, low_memory=False)
+        csv_time = perf_counter() - start
+
+        read_data(file_path, use_hash=args.hash, cache_dir=args.cache_dir)
+
+        start = perf_counter()
+        df = read_data(file_path, use_hash=args.hash, cache_dir=args.cache_dir)
+        cache_time = perf_counter() - start
+
+        print(f"'{file_path}': {df.shape[0]:,} rows, read in {csv_time:.3f}s from the csv file and in "
+              f"{cache_time:.3f}s from the cache")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional
+from ingest import source_key
+
+
+class Manifest:
+    """
+    The source files processed so far, by key (e.g. the year), with the hash of their content when they were processed.
+    A key has to be processed again only if its file changed, e.g. when a preliminary year is replaced by the final
+    file, or if it is processed with other options. The size and modification time of the files are checked first, so
+    unchanged files are not hashed again.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        @param path: The path to the JSON file of the manifest. If None, the manifest is only kept in memory.
+        """
+        self.path: Optional[str] = path
+        self.entries: dict[str, dict] = {}
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def changed(self, key, file_path: str, options: Optional[dict] = None) -> bool:
+        """
+        Check if the file of a key has to be processed, i.e. if it is new, its content changed, or it was processed
+        with other options. If only its size or modification time changed, they are updated and the manifest is
+        saved, so that the file is not hashed again on the next run.
+        @param key: The key, e.g. the year
+        @param file_path: The path to the file
+        @param options: The options the file is processed with, e.g. {'counties': True}. Default is no options.
+        @return: True if the file has to be processed
+        """
+        entry = self.entries.get(str(key))
+        if entry is None or entry.get('options', {}) != (options or {}):
+            return True
+        if entry['stat'] == source_key(file_path):
+            return False
+
+        # The file was modified or replaced, but its content may be the same
+        if entry['hash'] == source_key(file_path, use_hash=True):
+            entry.update(file=file_path, stat=source_key(file_path))
+            self.save()
+            return False
+        return True
+
+    def record(self, key, file_path: str, options: Optional[dict] = None, **info) -> None:
+        """
+        Record that the file of a key was processed.
+        @param key: The key, e.g. the year
+        @param file_path: The path to the file
+        @param options: The options the file was processed with (see changed()). Default is no options.
+        @param info: Other information to keep with the entry, e.g. statistics
+        """
+        self.entries[str(key)] = {'file': file_path, 'stat': source_key(file_path),
+                                  'hash': source_key(file_path, use_hash=True), 'options': options or {}, **info}
+
+    def update(self, other: 'Manifest') -> None:
+        """
+        Add the entries of another manifest, replacing those with the same keys.
+        @param other: The other manifest
+        """
+        self.entries.update(other.entries)
+
+    def save(self) -> None:
+        """
+        Save the manifest, if it has a file. The file is replaced atomically, so a crash never leaves it half-written.
+        """
+        if self.path is None:
+            return
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=2)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,449 @@
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Optional, Union
+import pandas as pd
+from geometry import OUTPUT_LEVELS
+from ingest import CACHE_DIR_NAME, source_key, year_files
+from quality import Statistics, write_statistics
+
+SCRIPTS_DIR: Path = Path(__file__).resolve().parent  # The directory of the modules of the stages
+
+PIPELINE_DIR: str = f"./output/{CACHE_DIR_NAME}/pipeline"
+
+# Increase when a stage computes its artifacts differently through another module than its own (see code_key()), so
+# that they are computed again
+PIPELINE_VERSION: int = 2
+
+# The file extension of each kind of artifact
+KINDS: dict[str, str] = {'parquet': '.parquet', 'statistics': '.json', 'html': '.html', 'geojson': '.geojson'}
+
+
+class Stage:
+    """
+    A stage of the pipeline: a function of the artifacts of other stages, of source files and of parameters.
+    """
+
+    def __init__(self, name: str, func: str, outputs: dict[str, str],
+                 inputs: Optional[dict[str, Union[str, list[str]]]] = None, files: Optional[dict[str, str]] = None,
+                 params: Optional[dict] = None):
+        """
+        @param name: The name of the stage, e.g. 'clean/2017'
+        @param func: The function of the stage, as 'module.function' of a module of the scripts directory, e.g.
+                     'scatter.clean_points'. It is imported when the stage runs (see stage_function()), so the
+                     modules of the stages can use the pipeline themselves. It is called
+                     with the inputs, files and parameters as keyword arguments, and returns its outputs, as a tuple
+                     if there are several.
+        @param outputs: The kind of each output (see KINDS), by name, in the order they are returned
+        @param inputs: The outputs of other stages, as 'stage:output' or lists of them, by argument name
+        @param files: The paths to the source files, by argument name
+        @param params: The other arguments, which must be JSON-serializable
+        """
+        self.name: str = name
+        self.func: str = func
+        self.outputs: dict[str, str] = outputs
+        self.inputs: dict[str, Union[str, list[str]]] = inputs or {}
+        self.files: dict[str, str] = files or {}
+        self.params: dict = params or {}
+
+    @property
+    def dependencies(self) -> list[str]:
+        """
+        @return: The names of the stages whose outputs are inputs of this stage
+        """
+        refs = [ref for value in self.inputs.values() for ref in (value if isinstance(value, list) else [value])]
+        return list(dict.fromkeys(ref.split(':')[0] for ref in refs))
+
+
+def save_artifact(value, path: Path) -> None:
+    """
+    Save an output of a stage, in the format of its kind.
+    @param value: The output, a DataFrame, data statistics, HTML or GeoJSON
+    @param path: The path of the artifact
+    """
+    if isinstance(value, pd.DataFrame):
+        value.to_parquet(path)
+    elif isinstance(value, Statistics):
+        with open(path, 'w') as f:
+            json.dump(value.to_dict(), f, indent=2)
+    else:
+        path.write_text(value, encoding='utf-8')
+
+
+def load_artifact(path: Path):
+    """
+    Load an output of a stage, from the format of its kind.
+    @param path: The path of the artifact
+    @return: The output, a DataFrame, data statistics, HTML or GeoJSON
+    """
+    if path.suffix == KINDS['parquet']:
+        return pd.read_parquet(path)
+    elif path.suffix == KINDS['statistics']:
+        with open(path, 'r') as f:
+            return Statistics.from_dict(json.load(f))
+    return path.read_text(encoding='utf-8')
+
+
+def stage_function(func: str) -> Callable:
+    """
+    Import the function of a stage from its module in the scripts directory, even if a module of the same name comes
+    first on the path, e.g. `scatter.py` of the `scatter` directory.
+    @param func: The function, as 'module.function'
+    @return: The function
+    """
+    module_name, func_name = func.rsplit('.', 1)
+    path = SCRIPTS_DIR / f"{module_name}.py"
+
+    module = sys.modules.get(module_name)
+    if module is None or Path(module.__file__).resolve() != path:
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+    return getattr(module, func_name)
+
+
+def code_key(func: str) -> str:
+    """
+    Get the hash of the code of a stage: the source of the module of its function, so that changing the function or
+    a helper of its module computes its artifacts again.
+    @param func: The function, as 'module.function'
+    @return: The hash
+    """
+    module_name = func.rsplit('.', 1)[0]
+    return hashlib.sha256((SCRIPTS_DIR / f"{module_name}.py").read_bytes()).hexdigest()[:16]
+
+
+def run_stage(task: tuple[str, dict, dict, dict, dict[str, Path]]) -> None:
+    """
+    Run a stage and save its artifacts. They are written to a temporary directory first, so that an interrupted
+    stage never leaves incomplete artifacts, and the artifacts of the previous keys of the stage are removed.
+    @param task: The function, the paths of the inputs, the files and the parameters of the stage, and the paths of
+                 its artifacts
+    """
+    func, inputs, files, params, outputs = task
+    function = stage_function(func)
+
+    args = {arg: [load_artifact(p) for p in path] if isinstance(path, list) else load_artifact(path)
+            for arg, path in inputs.items()}
+    results = function(**args, **files, **params)
+    if len(outputs) == 1:
+        results = (results,)
+
+    key_dir = next(iter(outputs.values())).parent
+    tmp_dir = key_dir.with_suffix('.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for path, result in zip(outputs.values(), results):
+        save_artifact(result, tmp_dir / path.name)
+
+    for stale in key_dir.parent.iterdir():
+        if stale != tmp_dir:
+            shutil.rmtree(stale)
+    os.replace(tmp_dir, key_dir)
+
+
+class Pipeline:
+    """
+    The stages of the maps, from the csv files to the HTML files, as a DAG. The artifacts of each stage are cached
+    under a key, the hash of its function, parameters and source files and of the keys of its input stages, so a
+    stage only runs again if something upstream of it changed. The stages whose inputs are ready run in parallel.
+    """
+
+    def __init__(self, cache_dir: str = PIPELINE_DIR, use_hash: bool = False, processes: Optional[int] = None):
+        """
+        @param cache_dir: The cache directory of the artifacts
+        @param use_hash: If True, key the source files by their content instead of their size and modification time
+        @param processes: The number of processes. Default is the number of CPUs.
+        """
+        self.cache_dir: Path = Path(cache_dir)
+        self.use_hash: bool = use_hash
+        self.processes: Optional[int] = processes
+        self.stages: dict[str, Stage] = {}
+        self.keys: dict[str, str] = {}
+        self.sources: dict[str, str] = {}  # The keys of the source files, each file being keyed once
+
+    def add(self, stage: Stage) -> str:
+        """
+        Add a stage, replacing the stage with the same name.
+        @param stage: The stage
+        @return: The name of the stage
+        """
+        self.stages[stage.name] = stage
+        self.keys.clear()
+        return stage.name
+
+    def source_key(self, file_path: str) -> str:
+        """
+        Get the key of a source file (see `ingest.source_key()`).
+        @param file_path: The path to the file
+        @return: The key
+        """
+        if file_path not in self.sources:
+            self.sources[file_path] = source_key(file_path, self.use_hash)
+        return self.sources[file_path]
+
+    def key(self, name: str) -> str:
+        """
+        Get the key of a stage.
+        @param name: The name of the stage
+        @return: The key
+        """
+        if name not in self.keys:
+            stage = self.stages[name]
+
+            def ref_key(ref: str) -> str:
+                input_name, output = ref.split(':')
+                return f"{self.key(input_name)}:{output}"
+
+            content = {
+                'version': PIPELINE_VERSION,
+                'func': stage.func,
+                'code': code_key(stage.func),
+                'outputs': stage.outputs,
+                'inputs': {arg: [ref_key(ref) for ref in value] if isinstance(value, list) else ref_key(value)
+                           for arg, value in stage.inputs.items()},
+                'files': {arg: self.source_key(path) for arg, path in stage.files.items()},
+                'params': stage.params,
+            }
+            self.keys[name] = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()[:16]
+
+        return self.keys[name]
+
+    def path(self, name: str, output: str) -> Path:
+        """
+        Get the path of an artifact.
+        @param name: The name of the stage
+        @param output: The name of the output
+        @return: The path, `<cache_dir>/<stage>/<key>/<output>.<extension>`
+        """
+        return self.cache_dir / name / self.key(name) / f"{output}{KINDS[self.stages[name].outputs[output]]}"
+
+    def cached(self, name: str) -> bool:
+        """
+        @param name: The name of the stage
+        @return: True if the artifacts of the stage are cached under its current key
+        """
+        return all(self.path(name, output).exists() for output in self.stages[name].outputs)
+
+    def plan(self, targets: list[str]) -> list[str]:
+        """
+        Get the stages to run to get the artifacts of the targets. The stages upstream of a cached stage do not run.
+        @param targets: The names of the target stages
+        @return: The names of the stages to run, in an order where each stage comes after its inputs
+        """
+        order, seen = [], set()
+
+        def visit(name: str) -> None:
+            if name in seen:
+                return
+            seen.add(name)
+            if not self.cached(name):
+                for dependency in self.stages[name].dependencies:
+                    visit(dependency)
+                order.append(name)
+
+        for target in targets:
+            visit(target)
+        return order
+
+    def task(self, name: str) -> tuple[str, dict, dict, dict, dict[str, Path]]:
+        """
+        @param name: The name of the stage
+        @return: The task of the stage (see run_stage())
+        """
+        stage = self.stages[name]
+
+        def ref_path(ref: str) -> Path:
+            return self.path(*ref.split(':'))
+
+        inputs = {arg: [ref_path(ref) for ref in value] if isinstance(value, list) else ref_path(value)
+                  for arg, value in stage.inputs.items()}
+        outputs = {output: self.path(name, output) for output in stage.outputs}
+        return stage.func, inputs, stage.files, stage.params, outputs
+
+    def run(self, targets: list[str]) -> None:
+        """
+        Run the stages needed by the targets, in parallel as soon as their inputs are ready.
+        @param targets: The names of the target stages
+        """
+        plan = self.plan(targets)
+        print(f"Running {len(plan):,} stages, the other stages needed by {', '.join(targets)} are cached...")
+        if not plan:
+            return
+
+        pending, running = list(plan), {}
+        with ProcessPoolExecutor(min(self.processes or os.cpu_count(), len(plan))) as executor:
+            while pending or running:
+                for name in [name for name in pending if not any(
+                        dependency in pending or dependency in running.values()
+                        for dependency in self.stages[name].dependencies)]:
+                    pending.remove(name)
+                    running[executor.submit(run_stage, self.task(name))] = name
+                    print(f"Running the stage '{name}'...")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    future.result()  # Raises the error of the stage, if any
+                    print(f"Finished the stage '{name}'")
+
+    def load(self, name: str, output: str):
+        """
+        Load an artifact.
+        @param name: The name of the stage
+        @param output: The name of the output
+        @return: The output
+        """
+        return load_artifact(self.path(name, output))
+
+    def export(self, name: str, output: str, file_name: str) -> None:
+        """
+        Copy an artifact out of the cache, e.g. a map to the output directory.
+        @param name: The name of the stage
+        @param output: The name of the output
+        @param file_name: The path of the copy
+        """
+        Path(file_name).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(self.path(name, output), file_name)
+
+
+def add_state(pipeline: Pipeline, state_file: str) -> str:
+    """
+    Add the stage of the polygon of the state, loaded once and shared by the stages of all the years.
+    @param pipeline: The pipeline
+    @param state_file: The GeoJSON file of the state
+    @return: The name of the stage, with a `state` output
+    """
+    return pipeline.add(Stage("state", 'scatter.state_geojson', outputs={'state': 'geojson'},
+                              files={'file_name': state_file}))
+
+
+def add_borders(pipeline: Pipeline, counties_file: str, level: str) -> str:
+    """
+    Add the stage of the simplified county boundaries of a level, simplified once and shared by the maps of all the
+    years (see `geometry.py`).
+    @param pipeline: The pipeline
+    @param counties_file: The county boundaries GeoJSON file
+    @param level: The simplification level
+    @return: The name of the stage, with a `borders` output
+    """
+    return pipeline.add(Stage(f"borders/{level}", 'geometry.simplified_geojson', outputs={'borders': 'geojson'},
+                              files={'file_name': counties_file}, params={'level': level}))
+
+
+def add_points(pipeline: Pipeline, year: int, file_path: str, state_file: str) -> str:
+    """
+    Add the stages of the points of a year: cleaning (see `scatter.clean_points()`) and state filtering.
+    @param pipeline: The pipeline
+    @param year: The year
+    @param file_path: The path to the csv file
+    @param state_file: The GeoJSON file of the state
+    @return: The name of the stage of the points within the state, with `points` and `statistics` outputs
+    """
+    state = add_state(pipeline, state_file)
+    pipeline.add(Stage(f"clean/{year}", 'scatter.clean_points',
+                       outputs={'points': 'parquet', 'statistics': 'statistics'},
+                       files={'file_path': file_path}, params={'year': str(year)}))
+    return pipeline.add(Stage(f"points/{year}", 'scatter.state_points',
+                              outputs={'points': 'parquet', 'statistics': 'statistics'},
+                              inputs={'df': f"clean/{year}:points", 'stats': f"clean/{year}:statistics",
+                                      'state': f"{state}:state"}))
+
+
+def add_scatter(pipeline: Pipeline, year: int, file_path: str, state_file: str, counties_file: str,
+                fast: bool = False) -> str:
+    """
+    Add the stages of the scatter map of a year.
+    @param pipeline: The pipeline
+    @param year: The year
+    @param file_path: The path to the csv file
+    @param state_file: The GeoJSON file of the state
+    @param counties_file: The county boundaries GeoJSON file
+    @param fast: Whether to create the markers in the browser (see `scatter.py`)
+    @return: The name of the stage of the map, with a `map` output
+    """
+    points = add_points(pipeline, year, file_path, state_file)
+    borders = add_borders(pipeline, counties_file, OUTPUT_LEVELS['scatter'])
+    return pipeline.add(Stage(f"scatter/{year}", 'scatter.scatter_html', outputs={'map': 'html'},
+                              inputs={'df': f"{points}:points", 'borders': f"{borders}:borders"},
+                              params={'year': str(year), 'fast': fast}))
+
+
+def add_choropleth(pipeline: Pipeline, files: dict[int, str], counties_file: str,
+                   highlight: Optional[list[str]] = None) -> str:
+    """
+    Add the stages of the choropleth map of several years: the counts of each year, and the map.
+    @param pipeline: The pipeline
+    @param files: The paths to the csv files, by year
+    @param counties_file: The county boundaries GeoJSON file
+    @param highlight: The names of the counties to outline in red, if any
+    @return: The name of the stage of the map, with a `map` output
+    """
+    counts = [pipeline.add(Stage(f"counts/{year}", 'cube.year_counts', outputs={'counts': 'parquet'},
+                                 files={'file_path': file_path}, params={'year': year}))
+              for year, file_path in sorted(files.items())]
+
+    borders = add_borders(pipeline, counties_file, OUTPUT_LEVELS['choropleth'])
+
+    years = f"{min(files)}-{max(files)}" if len(files) > 1 else f"{min(files)}"
+    return pipeline.add(Stage(f"choropleth/{years}", 'choropleth.choropleth_html', outputs={'map': 'html'},
+                              inputs={'counts': [f"{name}:counts" for name in counts], 'borders': f"{borders}:borders"},
+                              params={'highlight': highlight}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the maps of several years through the cached pipeline")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files. The year is derived from each filename.")
+    parser.add_argument("--maps", type=str, nargs='+', choices=['scatter', 'choropleth'],
+                        default=['scatter', 'choropleth'], help="The maps to create. Default is scatter choropleth.")
+    parser.add_argument("--fast", action="store_true",
+                        help="Create the scatter markers in the browser (see scatter.py). Default is False.")
+    parser.add_argument("--print_stats", action="store_true",
+                        help="Print the statistics file of the scatter maps. Default is False.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="The number of processes. Default is the number of CPUs.")
+    parser.add_argument("--hash", action="store_true",
+                        help="Key the source files by their content instead of their size and modification time, so "
+                             "that touching a file does not run the stages downstream of it. Default is False.")
+    args = parser.parse_args()
+
+    state_file: str = "data/south carolina.geojson"
+    counties_file: str = "data/South Carolina County Boundaries.geojson"
+    for file_name in [state_file, counties_file, *args.csv_files]:
+        if not os.path.exists(file_name):
+            print(f"The '{file_name}' file was not found. Exiting...")
+            exit()
+
+    files = year_files(args.csv_files)  # A final file replaces a preliminary one
+
+    pipeline = Pipeline(use_hash=args.hash, processes=args.processes)
+    targets = {}
+    if 'scatter' in args.maps:
+        for year, file_path in sorted(files.items()):
+            name = add_scatter(pipeline, year, file_path, state_file, counties_file, args.fast)
+            targets[name] = f"./output/sc_incidents_{year}.html"
+    if 'choropleth' in args.maps:
+        name = add_choropleth(pipeline, files, counties_file)
+        targets[name] = f"./output/{name.replace('/', '_')}.html"
+
+    pipeline.run(list(targets))
+    for name, file_name in targets.items():
+        pipeline.export(name, 'map', file_name)
+        print(f"Map has been saved as '{file_name}'")
+
+    if args.print_stats and 'scatter' in args.maps:
+        file_name: str = "./output/data_statistics.md"
+        print(f"Saving data statistics to '{file_name}' and its .json file")
+        write_statistics([pipeline.load(f"points/{year}", 'statistics') for year in sorted(files)], file_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import os.path
+from pathlib import Path
+from time import perf_counter
+import fiona.errors
+import folium as fm
+import geopandas as gpd
+import pandas as pd
+from branca.element import MacroElement
+from folium.template import Template
+from cube import Cube
+from figures import base64_charts, render_charts
+from geometry import OUTPUT_LEVELS, simplified
+from ingest import year_files
+
+
+class ChartPopups(MacroElement):
+    """
+    The markers of the counties, whose popups draw the number of accidents of the county over the years as an SVG
+    line chart when they are opened. The county × year table is embedded once, as JSON, instead of an image per
+    county, so the map is much smaller and faster to create.
+    """
+
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function () {
+            var data = {{ this.data|tojson }};
+            var width = 300, height = 200, left = 50, right = 10, top = 25, bottom = 30;
+
+            // The line chart of the accidents of a county, as in the PNG charts
+            function chart(county) {
+                var values = county.accidents, n = values.length;
+                var min = Math.min.apply(null, values), max = Math.max.apply(null, values);
+                var ticks = [];  // Integer ticks, at most 5
+                for (var t = 0; t <= 4; t++) {
+                    var tick = Math.round(min + (max - min) * t / 4);
+                    if (ticks.indexOf(tick) < 0) { ticks.push(tick); }
+                }
+
+                // Keep the points off the axes, with margins of 5% as in matplotlib
+                var margin = min === max ? 1 : (max - min) * 0.05;
+                min -= margin; max += margin;
+
+                var x = function (i) {
+                    return Math.round(left + (n > 1 ? 0.05 + 0.9 * i / (n - 1) : 0.5) * (width - left - right));
+                };
+                var y = function (v) {
+                    return Math.round(height - bottom - (v - min) / (max - min) * (height - top - bottom));
+                };
+
+                var svg = '<svg width="' + width + '" height="' + height + '" font-family="sans-serif" font-size="10">';
+                svg += '<text x="' + (left + width - right) / 2 + '" y="14" text-anchor="middle" font-size="12">' +
+                    county.county + ' Accidents Over Time</text>';
+                svg += '<path d="M' + left + ',' + top + 'V' + (height - bottom) + 'H' + (width - right) +
+                    '" fill="none" stroke="black"/>';
+
+                ticks.forEach(function (tick) {
+                    svg += '<text x="' + (left - 4) + '" y="' + (y(tick) + 3) + '" text-anchor="end">' +
+                        tick.toLocaleString() + '</text>';
+                });
+                data.years.forEach(function (year, i) {
+                    svg += '<text x="' + x(i) + '" y="' + (height - bottom + 14) + '" text-anchor="middle">' + year +
+                        '</text>';
+                });
+
+                svg += '<polyline points="' + values.map(function (v, i) { return x(i) + ',' + y(v); }).join(' ') +
+                    '" fill="none" stroke="#1f77b4" stroke-width="1.5"/>';
+                values.forEach(function (v, i) {
+                    svg += '<circle cx="' + x(i) + '" cy="' + y(v) + '" r="3" fill="#1f77b4"><title>' +
+                        data.years[i] + ': ' + v.toLocaleString() + '</title></circle>';
+                });
+
+                return svg + '</svg>';
+            }
+
+            // The accidents, year-over-year change and cumulative score of each year
+            function table(county) {
+                var rows = data.years.map(function (year, i) {
+                    var change = county.yoy[i] === null ? '' : (county.yoy[i] > 0 ? '+' : '') + county.yoy[i];
+                    return '<tr><td>' + year + '</td><td>' + county.accidents[i].toLocaleString() + '</td><td>' +
+                        change + '</td><td>' + county.score[i] + '</td></tr>';
+                });
+                return '<table style="width: 100%; text-align: right"><tr><th>Year</th><th>Accidents</th>' +
+                    '<th>Change</th><th>Score</th></tr>' + rows.join('') + '</table>';
+            }
+
+            data.counties.forEach(function (county) {
+                var icon = L.AwesomeMarkers.icon({icon: 'info-sign', markerColor: 'blue', prefix: 'glyphicon'});
+                L.marker(county.location, {icon: icon}).bindPopup(function () {
+                    return '<h4>' + county.county + ' County</h4>' +
+                        '<p>Cumulative Score: ' + county.score[county.score.length - 1] + '</p>' +
+                        chart(county) + table(county);
+                }, {maxWidth: 350}).addTo({{ this._parent.get_name() }});
+            });
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, data: dict):
+        """
+        @param data: The years, and the name, location, accidents, year-over-year change and cumulative score of each
+                     county (see popup_data())
+        """
+        super().__init__()
+        self._name = 'ChartPopups'
+        self.data = data
+
+
+def popup_data(merged_data: gpd.GeoDataFrame, table: pd.DataFrame, yoy: pd.DataFrame,
+               score: pd.DataFrame) -> dict:
+    """
+    Gather the county × year tables of the popups, as JSON-serializable lists.
+    @param merged_data: The counties, with a `county` column of their names and their boundaries
+    @param table: The number of accidents, with the county names as rows and the years as columns
+    @param yoy: The year-over-year change, in the same shape
+    @param score: The cumulative score, in the same shape
+    @return: The years, and the name, location, accidents, year-over-year change and cumulative score of each county
+    """
+    counties = []
+    for county, geometry in zip(merged_data['county'], merged_data.geometry):
+        counties.append({
+            'county': county,
+            'location': [round(geometry.centroid.y, 5), round(geometry.centroid.x, 5)],
+            'accidents': [int(v) for v in table.loc[county]],
+            'yoy': [None if pd.isna(v) else int(v) for v in yoy.loc[county]],  # The first year has no change
+            'score': [int(v) for v in score.loc[county]],
+        })
+
+    return {'years': [int(year) for year in table.columns], 'counties': counties}
+
+
+def add_png_popups(m: fm.Map, merged_data: gpd.GeoDataFrame, table: pd.DataFrame) -> None:
+    """
+    Add the markers of the counties, with a PNG line chart embedded in each popup (see `figures.py`).
+    @param m: The map
+    @param merged_data: The counties, with `county` and `score` columns and their boundaries
+    @param table: The number of accidents, with the county names as rows and the years as columns
+    """
+    charts = {county: ('county', accidents, {'county': county}) for county, accidents in table.iterrows()}
+    county_charts = base64_charts(render_charts(charts))
+
+    for idx, row in merged_data.iterrows():
+        popup_content = f"""
+        <h4>{row['county']} County</h4>
+        <p>Cumulative Score: {row['score']}</p>
+        <img src="data:image/png;base64,{county_charts[row['county']]}" width="300" height="200">
+        """
+
+        fm.Marker(
+            location=[row.geometry.centroid.y, row.geometry.centroid.x],
+            popup=fm.Popup(popup_content, max_width=350),
+            icon=fm.Icon(color='blue', icon='info-sign')
+        ).add_to(m)
+
+
+def trends_map(cube: Cube, years: list[int], counties_gdf: gpd.GeoDataFrame, png: bool = False) -> fm.Map:
+    """
+    Create the map of the cumulative trend score of each county, with a popup of its accidents over the years, as in
+    `scatter/choropleth_trends_popups.ipynb`.
+    @param cube: The aggregation cube
+    @param years: The years
+    @param counties_gdf: The county boundaries
+    @param png: Whether to embed a PNG chart in each popup, instead of drawing the charts in the browser
+    @return: The map
+    """
+    table = cube.table('cty', names=True, year=years)
+    yoy = cube.yoy('cty', names=True, year=years)
+    score = cube.cumulative_score('cty', names=True, year=years)
+
+    final_df = pd.DataFrame({'county': score.index, 'score': score.iloc[:, -1].values})
+    merged_data = counties_gdf.merge(final_df, left_on='name', right_on='county')
+
+    m = fm.Map(location=[33.8361, -81.1637], zoom_start=7)
+    fm.Choropleth(
+        geo_data=merged_data,
+        name='choropleth',
+        data=merged_data,
+        columns=['county', 'score'],
+        key_on='feature.properties.county',
+        fill_color='YlOrRd',
+        fill_opacity=0.7,
+        line_opacity=0.2,
+        legend_name='Cumulative Score'
+    ).add_to(m)
+
+    if png:
+        add_png_popups(m, merged_data, table)
+    else:
+        ChartPopups(popup_data(merged_data, table, yoy, score)).add_to(m)
+
+    return m
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create the map of the accident trend of each county, with popups")
+    parser.add_argument("csv_files", type=str, nargs='+',
+                        help="The paths to the csv files. The year is derived from each filename.")
+    parser.add_argument("--png", action="store_true",
+                        help="Embed a PNG chart in each popup, instead of drawing the charts in the browser. "
+                             "Default is False.")
+    args = parser.parse_args()
+
+    file_name: str = "data/South Carolina County Boundaries.geojson"
+    try:
+        counties_gdf = simplified(file_name, OUTPUT_LEVELS['choropleth'])
+    except (fiona.errors.DriverError, FileNotFoundError):
+        print(f"The '{file_name}' file was not found. Exiting...")
+        exit()
+
+    files = year_files(args.csv_files)
+    cube = Cube()
+    cube.update(files)
+
+    start = perf_counter()
+    m = trends_map(cube, sorted(files), counties_gdf, args.png)
+
+    Path("./output").mkdir(parents=True, exist_ok=True)
+    f_name: str = f"./output/choropleth_with_popups{'_png' if args.png else ''}.html"
+    m.save(f_name)
+    print(f"Map has been saved as '{f_name}' ({os.path.getsize(f_name) / 1024:,.0f} KB) in "
+          f"{perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import json
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from shapely.geometry import Polygon
+from counties import COUNTIES_FILE, CountyIndex
+from quality import Statistics, write_statistics
+from schema import DTYPES
+from scatter import in_polygon
+
+CHUNK_SIZE: int = 500_000  # Number of rows read at once, which bounds the memory used
+
+# The columns kept by default, those used by the maps
+COLUMNS: list[str] = ['ano', 'lat', 'lon', 'cty', 'tway', 'day']
+
+
+def load_polygon(file_name: str) -> Polygon:
+    """
+    Load the polygon of the state from a GeoJSON file.
+    @param file_name: The path to the GeoJSON file
+    @return: The polygon
+    """
+    with open(file_name, 'r') as f:
+        sc_geojson = json.load(f)
+
+    return Polygon(sc_geojson['geometry']['coordinates'][0])
+
+
+def preprocess_chunk(chunk: pd.DataFrame, polygon: Polygon, stats: Statistics,
+                     counties: Optional[CountyIndex] = None) -> pd.DataFrame:
+    """
+    Pre-process a chunk the same way as the cleaning and filtering stages of the scatter maps (see `scatter.py`):
+    convert the coordinates to integers, remove the rows with lat = 0 or lon = 0, convert the coordinates to decimal
+    degrees, and keep only the points within the polygon.
+    @param chunk: The chunk
+    @param polygon: The polygon of the state
+    @param stats: The data statistics, accumulated over the chunks
+    @param counties: The county index. If given, the county containing each point is added as `cty_geo`.
+    @return: The pre-processed chunk
+    """
+    stats.initial(chunk)
+    chunk = stats.coordinates(chunk, 'lat', 'lon')
+
+    # Remove rows with lat = 0 or lon = 0, and convert lat and lon to correct decimal degrees
+    chunk = stats.zeros(chunk)
+    lat, lon = chunk['lat'] / 1_000_000, - (chunk['lon'] / 1000000)  # Note the negative sign for longitude
+
+    # Keep only points within the state
+    mask = in_polygon(polygon, lon, lat)
+    chunk = stats.within(chunk.assign(lat=lat, lon=lon), mask)
+
+    if counties is not None:
+        chunk['cty_geo'] = counties.assign(chunk['lon'], chunk['lat'])
+
+    # Use the same dtypes for every chunk, whatever was inferred from its rows
+    for col in chunk.columns:
+        if col in ('lat', 'lon', 'cty_geo'):
+            continue
+        elif col in DTYPES:
+            chunk[col] = pd.to_numeric(chunk[col]).astype(DTYPES[col].capitalize())  # Nullable integers
+        elif pd.api.types.is_numeric_dtype(chunk[col]):
+            chunk[col] = chunk[col].astype('float64')
+        else:
+            chunk[col] = chunk[col].astype('string')
+
+    return chunk
+
+
+def preprocess(csv_files: list[str], out_file: str, polygon: Polygon, columns: Optional[list[str]] = None,
+               chunk_size: int = CHUNK_SIZE, counties: Optional[CountyIndex] = None,
+               name: Optional[str] = None) -> Statistics:
+    """
+    Pre-process csv files of any size chunk by chunk, and write the points within the state to a Parquet file.
+    Only one chunk is held in memory at a time, so the memory used is bounded by the chunk size, not the input size.
+    @param csv_files: The paths to the csv files
+    @param out_file: The path to the Parquet file
+    @param polygon: The polygon of the state
+    @param columns: The columns to keep. Default is COLUMNS.
+    @param chunk_size: The number of rows read at once
+    @param counties: The county index. If given, the county containing each point is added as `cty_geo`.
+    @param name: The name of the data in the statistics. Default is the name of the Parquet file.
+    @return: The data statistics
+    """
+    columns = set(columns or COLUMNS) | {'lat', 'lon'}
+    stats = Statistics(name or Path(out_file).stem)
+
+    writer: Optional[pq.ParquetWriter] = None
+    try:
+        for file_path in csv_files:
+            print(f"Processing '{file_path}'...")
+            for chunk in pd.read_csv(file_path, usecols=lambda col: col in columns, chunksize=chunk_size,
+                                     low_memory=False):
+                chunk = preprocess_chunk(chunk, polygon, stats, counties)
+
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(out_file, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+
+                print(f"Rows processed: {stats.counters['rows']:,}, rows kept: {stats.counters['within']:,}")
+
+        # Without any chunk (no rows), the Parquet file is still written, empty, with the columns of the points
+        if writer is None:
+            chunk = preprocess_chunk(pd.DataFrame(columns=sorted(columns)), polygon, stats, counties)
+            pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), out_file)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-process csv files of any size in chunks")
+    parser.add_argument("csv_files", type=str, nargs='+', help="The paths to the csv files")
+    parser.add_argument("--out_file", type=str, required=True, help="The path to the Parquet output file")
+    parser.add_argument("--columns", type=str, nargs='+', default=COLUMNS,
+                        help=f"The columns to keep. Default is {' '.join(COLUMNS)}.")
+    parser.add_argument("--chunk_size", type=int, default=CHUNK_SIZE,
+                        help=f"The number of rows read at once. Default is {CHUNK_SIZE:,}.")
+    parser.add_argument("--counties", action="store_true",
+                        help="Add the county containing each point as cty_geo (see counties.py). Default is False.")
+    parser.add_argument("--print_stats", action="store_true",
+                        help="Print the statistics file. Default is False. To print, use this flag.")
+    args = parser.parse_args()
+
+    # Load the GeoJSON file in a try-except block
+    file_name: str = "data/south carolina.geojson"
+    try:
+        polygon = load_polygon(file_name)
+    except FileNotFoundError:
+        print(f"The '{file_name}' was not found. Exiting...")
+        exit()
+
+    counties = CountyIndex(COUNTIES_FILE) if args.counties else None
+    stats = preprocess(args.csv_files, args.out_file, polygon, args.columns, args.chunk_size, counties)
+    print(f"Pre-processed data saved to '{args.out_file}'")
+
+    # Save the data statistics to a file if args.print_stats is True
+    if args.print_stats:
+        Path("./output").mkdir(parents=True, exist_ok=True)
+        file_name = f"./output/data_statistics_{stats.name}.md"
+        print(f"Saving data statistics to '{file_name}' and its .json file")
+        write_statistics([stats], file_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+import json
+import numpy as np
+import pandas as pd
+from schema import COUNTY_NAMES
+
+# The counters of the data statistics, in the order of the pre-processing
+COUNTERS: list[str] = ['rows', 'non_numeric_lat', 'non_numeric_lon', 'lat_0', 'lon_0', 'both_0', 'either_0',
+                       'non_zero', 'within']
+
+# The stages at which the rows of each county are counted
+STAGES: list[str] = ['rows', 'non_zero', 'within']
+
+MAX_EXAMPLES: int = 10  # The number of non-numeric values kept as examples, per column
+
+COERCION_ATTR: str = 'coordinates'  # The key of the conversion of the coordinates in `DataFrame.attrs`
+
+
+def ratio(part: int, whole: int) -> float:
+    """
+    Divide, with 0 for an empty whole.
+    @param part: The part
+    @param whole: The whole
+    @return: The ratio
+    """
+    return part / whole if whole else 0.0
+
+
+class Statistics:
+    """
+    The data statistics of the pre-processing, collected stage by stage with one vectorized pass over the rows per
+    stage. The counters can be accumulated over several chunks, and are written both as the markdown report and as
+    JSON, so that the reports of different runs can be compared.
+    """
+
+    def __init__(self, name: str):
+        """
+        @param name: The name of the data, e.g. "the year 2017"
+        """
+        self.name: str = name
+        self.counters: dict[str, int] = dict.fromkeys(COUNTERS, 0)
+        self.notes: list[str] = []  # The dtypes of the coordinates, and their conversions
+        self.examples: dict[str, list[str]] = {}  # Some non-numeric values of each column
+        self.counties: dict[str, dict[int, int]] = {stage: {} for stage in STAGES}
+
+    def count_counties(self, stage: str, df: pd.DataFrame) -> None:
+        """
+        Count the rows of each county at a stage, if the data has a `cty` column.
+        @param stage: The stage (see STAGES)
+        @param df: The rows left at the stage
+        """
+        if 'cty' not in df.columns:
+            return
+
+        counts = self.counties[stage]
+        for code, count in df['cty'].value_counts().items():
+            counts[int(code)] = counts.get(int(code), 0) + int(count)
+
+    def initial(self, df: pd.DataFrame) -> None:
+        """
+        Count the initial rows.
+        @param df: The rows
+        """
+        self.counters['rows'] += df.shape[0]
+        self.count_counties('rows', df)
+
+    def note(self, text: str) -> None:
+        """
+        Add a note to the report, once.
+        @param text: The note
+        """
+        if text not in self.notes:
+            self.notes.append(text)
+
+    def to_int(self, df: pd.DataFrame, col_name: str) -> pd.DataFrame:
+        """
+        Convert an object column to int64, counting its non-numeric values. The hyphens are removed from every value
+        before the conversion, as the coordinates are unsigned (the longitude is negated later).
+        @param df: The DataFrame
+        @param col_name: The column name
+        @return: The DataFrame with the column converted to int64
+        """
+        non_numeric = pd.to_numeric(df[col_name], errors='coerce').isna().to_numpy()
+
+        self.counters[f'non_numeric_{col_name}'] += int(non_numeric.sum())
+        examples = self.examples.setdefault(col_name, [])
+        examples += df.loc[non_numeric, col_name].astype(str).head(MAX_EXAMPLES - len(examples)).tolist()
+
+        df[col_name] = df[col_name].str.replace('-', '').astype('int64')
+        return df
+
+    def coercion(self) -> dict:
+        """
+        @return: The notes, non-numeric counts and examples of the conversion of the coordinates, to keep with the
+                 converted data (see `ingest.coerce_coordinates()`)
+        """
+        return {
+            'notes': list(self.notes),
+            'counters': {counter: self.counters[counter] for counter in ('non_numeric_lat', 'non_numeric_lon')},
+            'examples': {col: list(examples) for col, examples in self.examples.items()},
+        }
+
+    def add_coercion(self, coercion: dict) -> None:
+        """
+        Add the statistics of a conversion of the coordinates done beforehand, e.g. when the data was cached.
+        @param coercion: The conversion, as coercion()
+        """
+        for note in coercion['notes']:
+            self.note(note)
+        for counter, count in coercion['counters'].items():
+            self.counters[counter] += count
+        for col, values in coercion['examples'].items():
+            examples = self.examples.setdefault(col, [])
+            examples += values[:MAX_EXAMPLES - len(examples)]
+
+    def coordinates(self, df: pd.DataFrame, col1: str = 'lat', col2: str = 'lon') -> pd.DataFrame:
+        """
+        Check the coordinate columns and convert them to int64 if they are of type object. If they were already
+        converted when the data was cached, the statistics of that conversion are added instead (see
+        `ingest.coerce_coordinates()`).
+        @param df: The DataFrame
+        @param col1: The first column
+        @param col2: The second column
+        @return: The DataFrame
+        """
+        if COERCION_ATTR in df.attrs:
+            self.add_coercion(df.attrs[COERCION_ATTR])
+            return df
+
+        if pd.api.types.is_integer_dtype(df[col1]) and pd.api.types.is_integer_dtype(df[col2]):
+            self.note(f"Both {col1} and {col2} columns are of integer types ({df[col1].dtype}, {df[col2].dtype}).")
+            return df
+
+        objects = [col for col in (col1, col2) if df[col].dtype == 'object']
+        if len(objects) == 2:
+            self.note(f"Both {col1} and {col2} columns are of type object. Converting them to int64.")
+        elif objects:
+            self.note(f"The {objects[0]} column is of type object. Converting it to int64.")
+        else:
+            self.note(f"The {col1} and {col2} columns are of types {df[col1].dtype} and {df[col2].dtype}.")
+
+        for col in objects:
+            df = self.to_int(df, col)
+
+        return df
+
+    def zeros(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Count and remove the rows with lat = 0 or lon = 0.
+        @param df: The DataFrame
+        @return: The DataFrame without these rows
+        """
+        lat_0, lon_0 = df['lat'].to_numpy() == 0, df['lon'].to_numpy() == 0
+        either_0 = lat_0 | lon_0
+
+        self.counters['lat_0'] += int(lat_0.sum())
+        self.counters['lon_0'] += int(lon_0.sum())
+        self.counters['both_0'] += int((lat_0 & lon_0).sum())
+        self.counters['either_0'] += int(either_0.sum())
+
+        df = df[~either_0]
+        self.counters['non_zero'] += df.shape[0]
+        self.count_counties('non_zero', df)
+
+        return df
+
+    def within(self, df: pd.DataFrame, mask: np.ndarray) -> pd.DataFrame:
+        """
+        Count and keep the points within the state.
+        @param df: The DataFrame
+        @param mask: True for the points within the state
+        @return: The points within the state
+        """
+        df = df[mask]
+        self.counters['within'] += df.shape[0]
+        self.count_counties('within', df)
+
+        return df
+
+    def county_removals(self) -> pd.DataFrame:
+        """
+        Get the number of rows of each county at each stage, and the percentage removed by each stage, like in
+        `scatter/discrepancy_exp.ipynb`.
+        @return: The counts and percentages, by county name
+        """
+        counts = pd.DataFrame(self.counties).fillna(0).astype(int).sort_index().rename(index=COUNTY_NAMES)
+        if counts.empty:
+            return counts
+
+        counts['removed_non_zero'] = (counts['rows'] - counts['non_zero']) / counts['rows'] * 100
+        counts['removed_within'] = (counts['rows'] - counts['within']) / counts['rows'] * 100
+        return counts
+
+    def markdown(self) -> str:
+        """
+        Format the data statistics as the markdown report.
+        @return: The data statistics
+        """
+        c = self.counters
+        len_0, len_1, len_2 = c['rows'], c['non_zero'], c['within']
+
+        print_string: str = f"Initial length of the data for {self.name} : {len_0:,}"
+
+        for note in self.notes:
+            print_string += f"\n\n<br>{note}"
+        for col, examples in self.examples.items():
+            print_string += f"\n\nNumber of rows with non-numeric {col} : {c[f'non_numeric_{col}']:,}"
+            print_string += f"\n<br>Non-numeric {col} values (first {MAX_EXAMPLES}) : {examples}"
+
+        print_string += f"\n\nNumber of rows with lat = 0               : {c['lat_0']:,}"
+        print_string += f"\n<br>Number of rows with lon = 0               : {c['lon_0']:,}"
+        print_string += f"\n<br>Number of rows with lat and lon = 0       : {c['both_0']:,}"
+        print_string += f"\n<br>Number of rows with either lat or lon = 0 : {c['either_0']:,}"
+
+        print_string += f"\n\nLength of data after removing rows with lat = 0 or lon = 0 : {len_1:,}"
+        print_string += (f"\n<br>Percentage of rows removed                                 : "
+                         f"{ratio(len_0 - len_1, len_0):.2%}")
+
+        print_string += f"\n\nPoints after pre-processing : {len_1:,}"
+        print_string += f"\n<br>Points within SC            : {len_2:,}"
+        print_string += f"\n<br>Excluded points             : {(len_1 - len_2):,}"
+        print_string += f"\n<br>Exclusion percentage        : {ratio(len_1 - len_2, len_1):.2%}"
+
+        print_string += (f"\n\n<br>Total reduction (after pre-processing & state filtering)            : "
+                         f"{(len_0 - len_2):,}")
+        print_string += (f"\n<br>Total reduction percentage (after pre-processing & state filtering) : "
+                         f"{ratio(len_0 - len_2, len_0):.2%}")
+
+        return print_string
+
+    def to_dict(self) -> dict:
+        """
+        @return: The data statistics, as a JSON-serializable dictionary
+        """
+        return {
+            'name': self.name,
+            'counters': self.counters,
+            'notes': self.notes,
+            'examples': self.examples,
+            'counties': {stage: {COUNTY_NAMES.get(code, str(code)): count for code, count in sorted(counts.items())}
+                         for stage, counts in self.counties.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Statistics':
+        """
+        Restore the data statistics from to_dict().
+        @param data: The dictionary
+        @return: The data statistics
+        """
+        codes = {name: code for code, name in COUNTY_NAMES.items()}
+
+        stats = cls(data['name'])
+        stats.counters.update(data['counters'])
+        stats.notes = list(data['notes'])
+        stats.examples = {col: list(examples) for col, examples in data['examples'].items()}
+        stats.counties = {stage: {codes.get(name, None) or int(name): count for name, count in counts.items()}
+                          for stage, counts in data['counties'].items()}
+        return stats
+
+
+def write_statistics(statistics: list[Statistics], file_name: str) -> None:
+    """
+    Write the data statistics to a markdown report, and to a JSON file next to it.
+    @param statistics: The data statistics, one section each, e.g. one per year
+    @param file_name: The path to the markdown file. The JSON file has the same name, with a .json extension.
+    """
+    with open(file_name, 'w') as f:
+        f.write("# Data Statistics\n")
+        for stats in statistics:
+            f.write(f"\n\n## Data Statistics for {stats.name}\n")
+            f.write(stats.markdown() + "\n---")
+
+    json_name = f"{file_name.rsplit('.', 1)[0]}.json"
+    with open(json_name, 'w') as f:
+        json.dump([stats.to_dict() for stats in statistics], f, indent=2)
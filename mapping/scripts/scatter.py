@@ -1,170 +1,214 @@
-from pathlib import Path
 import pandas as pd
 import folium as fm
-from folium.plugins import MarkerCluster
+from folium.plugins import FastMarkerCluster, MarkerCluster
 from random import sample
 import json
-from shapely.geometry import Point, Polygon
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
 import os.path
 import argparse
+from typing import Optional
+from geometry import OUTPUT_LEVELS, simplified_geojson
+from ingest import file_year, read_data
+from pipeline import Pipeline, add_scatter
+from quality import Statistics, write_statistics
+from schema import DAY_NAMES, TWAY_NAMES
 
+STATE_FILE: str = "data/south carolina.geojson"
+COUNTIES_FILE: str = "data/South Carolina County Boundaries.geojson"
 
-def object_to_int(df: pd.DataFrame, col_name: str, print_string: str) -> pd.DataFrame:
+COLUMNS: list[str] = ['ano', 'lat', 'lon', 'cty', 'tway', 'day']  # The columns used by the maps
+
+# 5 of the possible colors for Folium
+POSSIBLE_COLORS: list[str] = ['blue', 'darkgreen', 'purple', 'orange', 'red']
+
+
+def in_polygon(polygon: Polygon, lon: np.ndarray, lat: np.ndarray) -> np.ndarray:
     """
-    Convert an object column to int64
-    @param df: The DataFrame
-    @param col_name: The column name
-    @param print_string: The string that will contain the data statistics
-    @return: The DataFrame with the column converted to int64
+    Check which points are within the polygon, for all points at once.
+    Points outside the bounding box of the polygon are excluded with NumPy first, and the remaining points are
+    tested in a single batch against the prepared polygon.
+    @param polygon: The polygon
+    @param lon: The longitudes of the points
+    @param lat: The latitudes of the points
+    @return: A boolean array, True for the points within the polygon
     """
-    # Since the lat column is of type object, we need to check if it contains any non-numeric values
-    print_string += (f"\n\nNumber of rows with non-numeric lat : "
-                     f"{pd.to_numeric(df[col_name], errors='coerce').isnull().sum():,}")
+    lon, lat = np.asarray(lon, dtype=float), np.asarray(lat, dtype=float)
 
-    # Get the rows with non-numeric lat
-    print_string += (f"\nRows with non-numeric lat : "
-                     f"{df[pd.to_numeric(df[col_name], errors='coerce').isnull()][col_name].to_dict()}")
+    # Bounding box prefilter
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    mask = (lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat)
 
-    # Convert the lat column to numeric
-    # Remove hyphens from the column
-    df[col_name] = df[col_name].str.replace('-', '')
+    # Batch containment test of the remaining points
+    shapely.prepare(polygon)
+    mask[mask] = shapely.contains_xy(polygon, lon[mask], lat[mask])
 
-    # Step 3: Convert the column to integer type
-    df[col_name] = df[col_name].astype(int)
+    return mask
 
-    return df
 
-
-def check_cols(col1: str, col2: str, df: pd.DataFrame, print_string: str) -> tuple[str, pd.DataFrame]:
+def filter_points(df: pd.DataFrame, stats: Statistics, sc_polygon: Optional[Polygon] = None,
+                  file_name: str = STATE_FILE) -> pd.DataFrame:
     """
-    Check the columns and convert them to int64 if necessary.
-    @param col1: The first column
-    @param col2: The second column
+    Filter points, keeping only those within South Carolina.
     @param df: The DataFrame
-    @param print_string: The string that will contain the data statistics
-    @return: The print string and the DataFrame
+    @param stats: The data statistics, where the points within South Carolina are counted
+    @param sc_polygon: The polygon of South Carolina, if already loaded
+    @param file_name: The GeoJSON file of South Carolina, if the polygon is not loaded yet
+    @return: The DataFrame
     """
 
-    # Perform checks for both columns
-    if df[col1].dtype == 'int64' and df[col2].dtype == 'int64':
-        print_string += f"\n\n<br>Both {col1} and {col2} columns are of type int64."
-
-    elif df[col1].dtype == 'object':
-        print_string += f"\n\n<br>The {col1} column is of type object. Converting it to int64."
-        df = object_to_int(df, col1, print_string)  # Convert the `col1` column to int64
-
-    elif df[col2].dtype == 'object':
-        print_string += f"\n\n<br>The {col2} column is of type object. Converting it to int64."
-        df = object_to_int(df, col2, print_string)  # Convert the `col2` column to int64
-
-    elif df[col1].dtype == 'object' and df[col2].dtype == 'object':
-        print_string += f"\n\n<br>Both {col1} and {col2} columns are of type object. Converting them to int64."
-        df = object_to_int(object_to_int(df, col1, print_string), col2, print_string)
+    if sc_polygon is None:
+        # Load the GeoJSON file in a try-except block
+        try:
+            with open(file_name, 'r') as f:
+                sc_geojson = json.load(f)
+        except FileNotFoundError:
+            print(f"The '{file_name}' was not found. Exiting...")
+            exit()
 
-    else:
-        print_string += f"\n\n<br>The {col1} and {col2} columns are of type object"
-        print_string += f"\n<br>Type of {col1} column : {df[col1].dtype}"
-        print_string += f"\n<brType of {col2} column : {df[col2].dtype}"
+        # Extract coordinates and create a Shapely polygon
+        sc_coords = sc_geojson['geometry']['coordinates'][0]
+        sc_polygon = Polygon(sc_coords)
 
-    return print_string, df
+    # Keep only points within South Carolina
+    return stats.within(df, in_polygon(sc_polygon, df['lon'], df['lat']))
 
 
-def filter_points(df: pd.DataFrame, len_0: int, print_string: str, year: str, print_stats: bool) -> tuple[str, pd.DataFrame]:
+def clean_points(file_path: str, year: str, columns: list[str] = COLUMNS) -> tuple[pd.DataFrame, Statistics]:
     """
-    Filter points and calculate exclusion percentage.
-    @param df: The DataFrame
-    @param len_0: The initial length of the data
-    @param print_string: The string that will contain the data statistics
+    Load the data of a year and clean it: convert the coordinates to integers, remove the rows with lat = 0 or
+    lon = 0, and convert the coordinates to decimal degrees.
+    @param file_path: The path to the csv file
     @param year: The year of the data
-    @param print_stats: Whether to print the statistics file or not
-    @return: The print string and the DataFrame
+    @param columns: The columns to load
+    @return: The cleaned DataFrame, and its data statistics so far
     """
+    # Load the data
+    df = read_data(file_path, columns=columns)
 
-    # Load the GeoJSON file in a try-except block
-    file_name: str = "data/south carolina.geojson"
-    try:
-        with open(file_name, 'r') as f:
-            sc_geojson = json.load(f)
-    except FileNotFoundError:
-        print(f"The '{file_name}' was not found. Exiting...")
-        # Remove the data_statistics file if args.print_stats is True
-        if print_stats:
-            os.remove(f"./output/data_statistics_{year}.md")
-        exit()
+    # Collect the data statistics, stage by stage
+    stats = Statistics(f"the year {year}")
+    stats.initial(df)
+    df = stats.coordinates(df, 'lat', 'lon')
 
-    # Extract coordinates and create a Shapely polygon
-    sc_coords = sc_geojson['geometry']['coordinates'][0]
-    sc_polygon = Polygon(sc_coords)
+    # Remove rows with lat = 0 or lon = 0
+    df = stats.zeros(df)
 
-    # Filter points and calculate exclusion percentage
-    len_1 = df.shape[0]  # New length
+    # Convert lat and lon to correct decimal degrees
+    df = df.assign(lat=df['lat'] / 1_000_000, lon=- (df['lon'] / 1000000))  # Note the negative sign for longitude
 
-    df['in_sc'] = df.apply(lambda row: sc_polygon.contains(Point(row['lon'], row['lat'])), axis=1)
-    df = df[df['in_sc']]  # Keep only points within South Carolina
+    return df, stats
 
-    print_string += f"\n\nPoints after pre-processing : {len_1:,}"
-    print_string += f"\n<br>Points within SC            : {df.shape[0]:,}"
-    print_string += f"\n<br>Excluded points             : {(len_1 - df.shape[0]):,}"
-    print_string += f"\n<br>Exclusion percentage        : {(len_1 - df.shape[0]) / len_1:.2%}"
 
-    print_string += (f"\n\n<br>Total reduction (after pre-processing & state filtering)            : "
-                     f"{(len_0 - df.shape[0]):,}")
-    print_string += (f"\n<br>Total reduction percentage (after pre-processing & state filtering) : "
-                     f"{(len_0 - df.shape[0]) / len_0:.2%}")
+def state_geojson(file_name: str = STATE_FILE) -> str:
+    """
+    Load the polygon of South Carolina, once for all the years, as a stage of the pipeline (see `pipeline.py`).
+    @param file_name: The GeoJSON file of South Carolina
+    @return: The polygon, as GeoJSON
+    """
+    with open(file_name, 'r') as f:
+        sc_geojson = json.load(f)
+
+    return shapely.to_geojson(Polygon(sc_geojson['geometry']['coordinates'][0]))
+
 
-    return print_string, df
+def state_points(df: pd.DataFrame, stats: Statistics, state: str) -> tuple[pd.DataFrame, Statistics]:
+    """
+    Keep the points within South Carolina, as a stage of the pipeline (see `pipeline.py`).
+    @param df: The cleaned DataFrame
+    @param stats: The data statistics so far
+    @param state: The polygon of South Carolina, as GeoJSON (see state_geojson())
+    @return: The points within South Carolina, and the data statistics
+    """
+    return filter_points(df, stats, sc_polygon=shapely.from_geojson(state)), stats
 
 
-def create_map(df: pd.DataFrame, year: str, color_map: dict[int, str]) -> None:
+def tway_colors(df: pd.DataFrame) -> dict[int, str]:
+    """
+    Pick a random color for each trafficway of the points.
+    @param df: The DataFrame
+    @return: The color mapping for the `tway` column
+    """
+    tways = df['tway'].unique()
+    return {num: col for num, col in zip(tways, sample(POSSIBLE_COLORS, len(tways)))}
+
+
+def add_fast_markers(m: fm.Map, df: pd.DataFrame, color_map: dict[int, str]) -> None:
+    """
+    Add the points to the map as a single array, with the markers and their popups created in the browser.
+    Each point is sent as [lat, lon, tway, day, ano], and the popups are built from the code tables only when opened,
+    so the map is much faster to build and much smaller than with one Folium marker per point.
+    @param m: The map
+    @param df: The DataFrame
+    @param color_map: The color mapping for the `tway` column
+    """
+    data = [[round(lat, 6), round(lon, 6), int(tway), int(day), int(ano)]
+            for lat, lon, tway, day, ano in zip(df['lat'], df['lon'], df['tway'], df['day'], df['ano'])]
+
+    # The code tables, as JavaScript objects keyed by the codes
+    tables = {'color': color_map, 'tway': TWAY_NAMES, 'day': DAY_NAMES}
+    tables = {name: {str(code): value for code, value in table.items()} for name, table in tables.items()}
+
+    # The tables are created once, and the popup of a marker is only built when it is opened
+    callback = f"""(function () {{
+        var tables = {json.dumps(tables)};
+        return function (row) {{
+            var marker = L.marker(new L.LatLng(row[0], row[1]));
+            marker.setIcon(L.AwesomeMarkers.icon({{markerColor: tables.color[row[2]] || 'gray'}}));
+            marker.bindPopup(function () {{
+                return '<b>Accident Number:</b> ' + row[4] + '<br>' +
+                    '<b>Trafficway:</b> ' + (tables.tway[row[2]] || 'Other') + '<br>' +
+                    '<b>Day:</b> ' + (tables.day[row[3]] || 'Unknown') + '<br>';
+            }});
+            return marker;
+        }};
+    }})()"""
+
+    FastMarkerCluster(data, callback=callback, options={'maxClusterRadius': 50}).add_to(m)
+
+
+def create_map(df: pd.DataFrame, year: str, color_map: dict[int, str], borders: Optional[str] = None,
+               fast: bool = False) -> fm.Map:
     """
     Create a map using Folium.
     @param df: The DataFrame
     @param year: The year of the data
     @param color_map: The color mapping for the `tway` column
+    @param borders: The content of the (simplified) county boundaries GeoJSON file, if already loaded
+    @param fast: Whether to create the markers in the browser (see add_fast_markers()) or one Folium marker per point
+    @return: The map
     """
     # Create a map centered on South Carolina
     sc_center_lat, sc_center_lon = 33.8361, -81.1637  # Approximate center of SC
     m = fm.Map(location=[sc_center_lat, sc_center_lon], zoom_start=7)
 
-    # # Create a MarkerCluster
-    # marker_cluster = MarkerCluster().add_to(m)
-
-    # Create a MarkerCluster with custom options
-    marker_cluster = MarkerCluster(
-        options={
-            'maxClusterRadius': 50,  # Maximum radius of a cluster in pixels
-            # 'spiderfyOnMaxZoom': False,  # Disable spiderifying (spreading out markers) on max zoom
-        }
-    ).add_to(m)
-
-    # Create mapping for the `tway` column:
-    tway_map = {1: 'Two-way, not divided',
-                2: 'Two-way, divided, unprotected median',
-                3: 'Two-way, divided, barrier',
-                4: 'One way',
-                8: 'Other'}
-
-    # Create mapping for the `day` column:
-    day_map = {1: 'Sunday',
-               2: 'Monday',
-               3: 'Tuesday',
-               4: 'Wednesday',
-               5: 'Thursday',
-               6: 'Friday',
-               7: 'Saturday'}
-
-    # Add markers to the cluster
-    for idx, row in df.iterrows():
-        fm.Marker(
-            popup=fm.Popup(f"""
-            <b>Accident Number:</b> {row['ano']}<br>
-            <b>Trafficway:</b> {tway_map.get(row['tway'], 'Other')}<br>
-            <b>Day:</b> {day_map.get(row['day'], 'Unknown')}<br>
-            """, max_width="100%"),
-            location=[row['lat'], row['lon']],
-            icon=fm.Icon(color=color_map.get(row['tway'], 'gray')),
-            lazy=True
-        ).add_to(marker_cluster)
+    if fast:
+        add_fast_markers(m, df, color_map)
+    else:
+        # # Create a MarkerCluster
+        # marker_cluster = MarkerCluster().add_to(m)
+
+        # Create a MarkerCluster with custom options
+        marker_cluster = MarkerCluster(
+            options={
+                'maxClusterRadius': 50,  # Maximum radius of a cluster in pixels
+                # 'spiderfyOnMaxZoom': False,  # Disable spiderifying (spreading out markers) on max zoom
+            }
+        ).add_to(m)
+
+        # Add markers to the cluster
+        for idx, row in df.iterrows():
+            fm.Marker(
+                popup=fm.Popup(f"""
+                <b>Accident Number:</b> {row['ano']}<br>
+                <b>Trafficway:</b> {TWAY_NAMES.get(row['tway'], 'Other')}<br>
+                <b>Day:</b> {DAY_NAMES.get(row['day'], 'Unknown')}<br>
+                """, max_width="100%"),
+                location=[row['lat'], row['lon']],
+                icon=fm.Icon(color=color_map.get(row['tway'], 'gray')),
+                lazy=True
+            ).add_to(marker_cluster)
 
     # Create a list to hold each line of the legend
     legend_lines = []
@@ -173,7 +217,7 @@ def create_map(df: pd.DataFrame, year: str, color_map: dict[int, str]) -> None:
     for tway, color in color_map.items():
         # Create a line for the legend
         line = (f'&nbsp; <i class="fa fa-map-marker fa-2x" style="color:{color}"></i>&nbsp; '
-                f'{tway_map.get(tway, "Other")} <br>')
+                f'{TWAY_NAMES.get(tway, "Other")} <br>')
         # Add the line to the list
         legend_lines.append(line)
 
@@ -200,81 +244,29 @@ def create_map(df: pd.DataFrame, year: str, color_map: dict[int, str]) -> None:
         'fillOpacity': 0.1
     }
 
-    # Try adding the county boundaries from the GeoJSON file
-    file_name: str = "data/South Carolina County Boundaries.geojson"
+    # Try adding the county boundaries from the GeoJSON file, simplified for the scatter maps
     try:
         fm.GeoJson(
-            data=(open(file_name, 'r').read()),
+            data=(borders if borders is not None else simplified_geojson(COUNTIES_FILE, OUTPUT_LEVELS['scatter'])),
             name="South Carolina",
             style_function=lambda x: bordersStyle).add_to(m)
     except FileNotFoundError:
-        print(f"The '{file_name}' file was not found. Exiting...")
+        print(f"The '{COUNTIES_FILE}' file was not found. Exiting...")
         exit()
 
-    # Save the map
-    f_name: str = f"./output/sc_incidents_{year}.html"
-    m.save(f_name)
-    print(f"Map has been saved as '{f_name}'")
+    return m
 
 
-def mapping(file_path: str, year: str, print_stats: bool) -> None:
+def scatter_html(df: pd.DataFrame, year: str, borders: str, fast: bool = False) -> str:
     """
-    Process the data and create the map.
-    :param file_path: The path to the csv file
-    :param year: The year of the data
-    :param print_stats: Whether to print the statistics file or not
+    Create the map of the points within South Carolina, as a stage of the pipeline (see `pipeline.py`).
+    @param df: The points within South Carolina
+    @param year: The year of the data
+    @param borders: The simplified county boundaries, as GeoJSON (see `geometry.simplified_geojson()`)
+    @param fast: Whether to create the markers in the browser, for a faster and smaller map
+    @return: The HTML of the map
     """
-    print(f"Processing data for the year {year}...")
-
-    # Load the data
-    df = pd.read_csv(file_path, low_memory=False)
-    len_0: int = df.shape[0]
-
-    # Define string that will contain the data statistics
-    print_string: str = ""
-    print_string += f"Initial length of the data for the year {year} : {len_0:,}"
-
-    print_string, df = check_cols('lat', 'lon', df, print_string)
-
-    # Check for rows with lat = 0 or lon = 0
-    print_string += f"\n\nNumber of rows with lat = 0               : {(df['lat'] == 0).sum():,}"
-    print_string += f"\n<br>Number of rows with lon = 0               : {(df['lon'] == 0).sum():,}"
-    print_string += f"\n<br>Number of rows with lat and lon = 0       : {((df['lat'] == 0) & (df['lon'] == 0)).sum():,}"
-    print_string += f"\n<br>Number of rows with either lat or lon = 0 : {((df['lat'] == 0) | (df['lon'] == 0)).sum():,}"
-
-    # Remove rows with lat = 0 or lon = 0
-    df = df[(df['lat'] != 0) & (df['lon'] != 0)]
-    print_string += f"\n\nLength of data after removing rows with lat = 0 or lon = 0 : {df.shape[0]:,}"
-    print_string += (f"\n<br>Percentage of rows removed                                 :"
-                     f" {((len_0 - df.shape[0]) / len_0):.2%}")
-
-    # Convert lat and lon to correct decimal degrees
-    df['lat'] = df['lat'] / 1_000_000
-    df['lon'] = - (df['lon'] / 1000000)  # Note the negative sign for longitude
-
-    # Filter data
-    print("Filtering data...")
-    print_string, df = filter_points(df, len_0, print_string, year, print_stats)
-    print_string += "\n---"
-
-    # Save the data statistics to a file if args.print_stats is True
-    if print_stats:
-        file_name: str = f"./output/data_statistics_{year}.md"
-        print(f"Saving data statistics to '{file_name}'")
-
-        with open(file_name, 'a') as f:
-            f.write(f"\n\n## Data Statistics for the year {year}\n")
-            f.write(print_string)
-
-    # 5 of the possible colors for Folium
-    possible_colors = ['blue', 'darkgreen', 'purple', 'orange', 'red']
-
-    # Define color mapping for 'tway'
-    color_map = {num: col for num, col in zip(df['tway'].unique(), sample(possible_colors, len(df['tway'].unique())))}
-
-    # Create the map
-    print("Creating the map...")
-    create_map(df, year, color_map)
+    return create_map(df, year, tway_colors(df), borders, fast).get_root().render()
 
 
 def main():
@@ -286,20 +278,34 @@ def main():
     parser.add_argument("csv_file", type=str, help="The path to the csv file")
     parser.add_argument("--print_stats", action="store_true",
                         help="Print the statistics file. Default is False. To print, use this flag.")
+    parser.add_argument("--fast", action="store_true",
+                        help="Create the markers in the browser from a single array, for a much faster and smaller "
+                             "map. Default is False. To use it, use this flag.")
     args = parser.parse_args()
 
-    year: str = os.path.basename(args.csv_file).split('.')[-2][-4:]
-    Path("./output").mkdir(parents=True, exist_ok=True)
+    year: str = str(file_year(args.csv_file))
+    for file_name in [STATE_FILE, COUNTIES_FILE, args.csv_file]:
+        if not os.path.exists(file_name):
+            print(f"The '{file_name}' file was not found. Exiting...")
+            exit()
 
-    # If printing stats, the reinitialize the data_stats file
-    if args.print_stats:
-        print("Since the print_stats flag is True, the data statistics file will be initialized.")
-        with open(f"./output/data_statistics_{year}.md", 'w') as f:
-            f.write("# Data Statistics\n")
-    else:
+    if not args.print_stats:
         print("Printing data statistics is turned off.")
 
-    mapping(args.csv_file, year, print_stats=args.print_stats)
+    # Only the stages whose file, parameters or inputs changed run again (see pipeline.py)
+    pipeline = Pipeline()
+    name = add_scatter(pipeline, int(year), args.csv_file, STATE_FILE, COUNTIES_FILE, args.fast)
+    pipeline.run([name])
+
+    # Save the data statistics to a file if args.print_stats is True
+    if args.print_stats:
+        file_name: str = f"./output/data_statistics_{year}.md"
+        print(f"Saving data statistics to '{file_name}' and its .json file")
+        write_statistics([pipeline.load(f"points/{year}", 'statistics')], file_name)
+
+    f_name: str = f"./output/sc_incidents_{year}.html"
+    pipeline.export(name, 'map', f_name)
+    print(f"Map has been saved as '{f_name}'")
 
 
 if __name__ == "__main__":
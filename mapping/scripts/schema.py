@@ -0,0 +1,151 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+SCHEMA_VERSION: int = 2  # Bump when the dtypes below or the conversion change, so the cached files are converted again
+
+# The declared dtypes of the sc_loc / sc_unt columns
+# The coordinates stay in microdegrees as int32, which is exact, and are only scaled to degrees after loading
+DTYPES: dict[str, str] = {
+    'ano': 'int32',  # Accident number
+    'lat': 'int32',  # Latitude, in microdegrees
+    'lon': 'int32',  # Longitude, in microdegrees west
+    'cty': 'int8',  # County, see COUNTY_NAMES
+    'tway': 'int8',  # Trafficway, see TWAY_NAMES
+    'day': 'int8',  # Day of the week, see DAY_NAMES
+    'month': 'int8',
+    'year': 'int16',
+}
+
+# Text columns with fewer distinct values than this fraction of the rows are stored as categoricals
+CATEGORY_RATIO: float = 0.5
+
+# The bounding box of South Carolina, in degrees, in the (x, y) order of Shapely and GeoJSON:
+# (min lon, min lat, max lon, max lat)
+SC_BOUNDS: tuple[float, float, float, float] = (-83.36, 32.03, -78.54, 35.22)
+
+# The coded values of the `cty` column
+COUNTY_NAMES: dict[int, str] = {
+    1: 'Abbeville', 2: 'Aiken', 3: 'Allendale', 4: 'Anderson', 5: 'Bamberg',
+    6: 'Barnwell', 7: 'Beaufort', 8: 'Berkeley', 9: 'Calhoun', 10: 'Charleston',
+    11: 'Cherokee', 12: 'Chester', 13: 'Chesterfield', 14: 'Clarendon', 15: 'Colleton',
+    16: 'Darlington', 17: 'Dillon', 18: 'Dorchester', 19: 'Edgefield', 20: 'Fairfield',
+    21: 'Florence', 22: 'Georgetown', 23: 'Greenville', 24: 'Greenwood', 25: 'Hampton',
+    26: 'Horry', 27: 'Jasper', 28: 'Kershaw', 29: 'Lancaster', 30: 'Laurens',
+    31: 'Lee', 32: 'Lexington', 33: 'McCormick', 34: 'Marion', 35: 'Marlboro',
+    36: 'Newberry', 37: 'Oconee', 38: 'Orangeburg', 39: 'Pickens', 40: 'Richland',
+    41: 'Saluda', 42: 'Spartanburg', 43: 'Sumter', 44: 'Union', 45: 'Williamsburg',
+    46: 'York'
+}
+
+# The coded values of the `tway` column
+TWAY_NAMES: dict[int, str] = {
+    1: 'Two-way, not divided',
+    2: 'Two-way, divided, unprotected median',
+    3: 'Two-way, divided, barrier',
+    4: 'One way',
+    8: 'Other'
+}
+
+# The coded values of the `day` column
+DAY_NAMES: dict[int, str] = {
+    1: 'Sunday',
+    2: 'Monday',
+    3: 'Tuesday',
+    4: 'Wednesday',
+    5: 'Thursday',
+    6: 'Friday',
+    7: 'Saturday'
+}
+
+
+def fits(series: pd.Series, dtype: str) -> bool:
+    """
+    Check if a column can be converted to an integer dtype without losing values.
+    @param series: The column
+    @param dtype: The integer dtype
+    @return: True if the column is numeric, has no missing values, and all its values are within the dtype range
+    """
+    if not pd.api.types.is_numeric_dtype(series) or series.isnull().any():
+        return False
+    if series.empty:
+        return True
+    if not pd.api.types.is_integer_dtype(series) and not (series == series.round()).all():
+        return False
+    info = np.iinfo(dtype)
+    return info.min <= series.min() and series.max() <= info.max
+
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the columns to compact dtypes.
+    The declared columns (see DTYPES) are converted when their values fit, the other integer columns are downcast to
+    the smallest integer dtype that fits, and the text columns are stored as categoricals or strings.
+    Floating point columns are left alone, so that the statistics computed on them do not change.
+    @param df: The DataFrame
+    @return: The DataFrame with compact dtypes
+    """
+    for col in df.columns:
+        dtype = DTYPES.get(col)
+
+        if dtype is not None and fits(df[col], dtype):
+            df[col] = df[col].astype(dtype)
+
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+
+        elif df[col].dtype == 'object':
+            if df[col].nunique() < CATEGORY_RATIO * df.shape[0]:
+                df[col] = df[col].astype('string').astype('category')
+            else:
+                df[col] = df[col].astype('string')
+
+    return df
+
+
+def memory_usage(df: pd.DataFrame) -> float:
+    """
+    Get the memory used by a DataFrame, including the contents of its text columns.
+    @param df: The DataFrame
+    @return: The memory used, in MB
+    """
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> str:
+    """
+    Compare the dtypes and the memory used by each column of a DataFrame before and after applying the schema.
+    @param before: The DataFrame with the inferred dtypes
+    @param after: The DataFrame with the schema applied
+    @return: The report, as a markdown table
+    """
+    usage_before = before.memory_usage(deep=True, index=False) / 2 ** 20
+    usage_after = after.memory_usage(deep=True, index=False) / 2 ** 20
+
+    report = f"| {'Column':<12} | {'Before':<10} | {'After':<10} | {'Before (MB)':>11} | {'After (MB)':>10} |"
+    report += f"\n|{'-' * 14}|{'-' * 12}|{'-' * 12}|{'-' * 13}|{'-' * 12}|"
+    for col in before.columns:
+        if col in after.columns:
+            report += (f"\n| {col:<12} | {str(before[col].dtype):<10} | {str(after[col].dtype):<10} "
+                       f"| {usage_before[col]:>11.2f} | {usage_after[col]:>10.2f} |")
+    report += (f"\n| {'Total':<12} | {'':<10} | {'':<10} | {memory_usage(before):>11.2f} "
+               f"| {memory_usage(after):>10.2f} |")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the memory saved by the schema on the yearly csv files")
+    parser.add_argument("csv_files", type=str, nargs='+', help="The paths to the csv files")
+    args = parser.parse_args()
+
+    for file_path in args.csv_files:
+        before = pd.read_csv(file_path, low_memory=False)
+        after = apply_schema(before.copy())
+
+        print(f"\n## {file_path}\n")
+        print(memory_report(before, after))
+
+
+if __name__ == "__main__":
+    main()
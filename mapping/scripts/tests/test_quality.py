@@ -0,0 +1,51 @@
+import sys
+from pathlib import Path
+import pandas as pd
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # The modules of the scripts
+from pipeline import Pipeline, add_scatter
+from quality import Statistics
+
+DATA_DIR: Path = Path(__file__).resolve().parents[1] / "data"
+
+
+def write_csv(file_path: Path) -> None:
+    """
+    Write a csv file of 100 points within South Carolina, six of them with a non-numeric lat.
+    @param file_path: The path to the csv file
+    """
+    df = pd.DataFrame({
+        'ano': range(100),
+        'lat': ['34000000'] * 94 + ['34-000000'] * 6,
+        'lon': [81000000] * 100,
+        'cty': [40] * 100,
+        'tway': [1] * 100,
+        'day': [2] * 100,
+    })
+    df.to_csv(file_path, index=False)
+
+
+def test_to_int_removes_every_hyphen():
+    stats = Statistics("the test")
+    df = stats.to_int(pd.DataFrame({'lon': ['81000000', '-81000000', '81-000000']}), 'lon')
+
+    assert df['lon'].tolist() == [81000000] * 3  # The longitude stays in the western hemisphere once negated
+    assert stats.counters['non_numeric_lon'] == 1
+
+
+def test_pipeline_reports_non_numeric_coordinates(tmp_path):
+    file_path = tmp_path / "sc_loc2020.csv"
+    write_csv(file_path)
+
+    # The first pipeline converts the csv file to its cache, the second one reads the cache
+    for cache_dir in ('first', 'second'):
+        pipeline = Pipeline(str(tmp_path / cache_dir), processes=1)
+        name = add_scatter(pipeline, 2020, str(file_path), str(DATA_DIR / "south carolina.geojson"),
+                           str(DATA_DIR / "South Carolina County Boundaries.geojson"), fast=True)
+        pipeline.run([name])
+
+        stats = pipeline.load("points/2020", 'statistics')
+        assert stats.counters['non_numeric_lat'] == 6
+        assert stats.examples['lat'] == ['34-000000'] * 6
+        assert "The lat column is of type object. Converting it to int64." in stats.notes
+        assert "Number of rows with non-numeric lat : 6" in stats.markdown()
+        assert stats.counters['within'] == 100
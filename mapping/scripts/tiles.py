@@ -0,0 +1,149 @@
+import argparse
+import multiprocessing as mp
+import os.path
+from pathlib import Path
+from typing import Optional
+import folium as fm
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from schema import SC_BOUNDS
+
+TILES_DIR: str = "./output/tiles"
+ZOOMS: tuple[int, int] = (6, 16)
+TILE_SIZE: int = 256  # Pixels
+
+RADIUS: int = 1  # Each point is drawn as a square of (2 * RADIUS + 1) pixels per side, so that it can be seen
+COLORMAP: str = 'YlOrRd'
+
+
+def pixel_coords(lon: np.ndarray, lat: np.ndarray, zoom: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Project points to the global pixel coordinates of a zoom level (Web Mercator, as used by the z/x/y tiles).
+    @param lon: The longitudes of the points
+    @param lat: The latitudes of the points
+    @param zoom: The zoom level
+    @return: The x and y pixel coordinates of the points, from the top left corner of the world
+    """
+    size = TILE_SIZE * 2 ** zoom
+    lat_rad = np.radians(np.asarray(lat, dtype=float))
+
+    x = (np.asarray(lon, dtype=float) + 180) / 360 * size
+    y = (1 - np.log(np.tan(lat_rad) + 1 / np.cos(lat_rad)) / np.pi) / 2 * size
+
+    return x.astype(np.int64), y.astype(np.int64)
+
+
+def render_zoom(task: tuple[str, int, np.ndarray, np.ndarray]) -> tuple[str, int, int]:
+    """
+    Render the PNG density tiles of a zoom level. Only the tiles containing points are written, to
+    `<out_dir>/<z>/<x>/<y>.png`.
+    @param task: The output directory of the layer, the zoom level, and the longitudes and latitudes of the points
+    @return: The output directory, the zoom level and the number of tiles written
+    """
+    out_dir, zoom, lon, lat = task
+    x, y = pixel_coords(lon, lat, zoom)
+
+    # Spread each point over the pixels around it, across tile edges too
+    offsets = np.arange(-RADIUS, RADIUS + 1)
+    x = (x[:, None, None] + offsets[None, :, None]).repeat(len(offsets), axis=2).ravel()
+    y = (y[:, None, None] + offsets[None, None, :]).repeat(len(offsets), axis=1).ravel()
+
+    # Group the pixels by tile
+    tile_x, tile_y = x // TILE_SIZE, y // TILE_SIZE
+    pixel = (y % TILE_SIZE) * TILE_SIZE + (x % TILE_SIZE)
+    tile = tile_x * 2 ** zoom + tile_y
+    order = np.argsort(tile, kind='stable')
+    tile, pixel = tile[order], pixel[order]
+    tiles, starts = np.unique(tile, return_index=True)
+
+    # The color scale is shared by all the tiles of the zoom level, so that they match
+    counts = [np.bincount(pixels, minlength=TILE_SIZE * TILE_SIZE) for pixels in np.split(pixel, starts[1:])]
+    max_count = max(c.max() for c in counts)
+
+    # The colors of the densities, skipping the palest ones, which are hard to see on the base map
+    colors = (matplotlib.colormaps[COLORMAP](np.linspace(0.25, 1, 256)) * 255).astype(np.uint8)
+    colors[:, 3] = 217  # 85% opaque
+
+    for key, count in zip(tiles, counts):
+        rgba = np.zeros((TILE_SIZE * TILE_SIZE, 4), dtype=np.uint8)  # Transparent where there are no points
+        drawn = count > 0
+        rgba[drawn] = colors[(np.log1p(count[drawn]) / np.log1p(max_count) * 255).astype(np.int64)]
+
+        tile_dir = os.path.join(out_dir, str(zoom), str(key // 2 ** zoom))
+        Path(tile_dir).mkdir(parents=True, exist_ok=True)
+        plt.imsave(os.path.join(tile_dir, f"{key % 2 ** zoom}.png"), rgba.reshape(TILE_SIZE, TILE_SIZE, 4))
+
+    return out_dir, zoom, len(tiles)
+
+
+def export_tiles(layers: dict[str, pd.DataFrame], out_dir: str = TILES_DIR, zooms: tuple[int, int] = ZOOMS,
+                 processes: Optional[int] = None) -> None:
+    """
+    Export the points of each layer (e.g. each year) to a z/x/y pyramid of PNG density tiles, and write a viewer.
+    The zoom levels are rendered in parallel, one zoom level of one layer per task.
+    @param layers: The points of each layer, with `lat` and `lon` columns in decimal degrees, by layer name
+    @param out_dir: The output directory. Each layer is written to a subdirectory named after it.
+    @param zooms: The first and last zoom levels
+    @param processes: The number of processes. Default is the number of CPUs.
+    """
+    tasks = [(os.path.join(out_dir, name), zoom, df['lon'].to_numpy(), df['lat'].to_numpy())
+             for name, df in layers.items() for zoom in range(zooms[0], zooms[1] + 1)]
+
+    print(f"Rendering {len(tasks)} zoom levels of {len(layers)} layers...")
+    with mp.Pool(processes or mp.cpu_count()) as pool:
+        for layer_dir, zoom, num_tiles in pool.imap_unordered(render_zoom, tasks):
+            print(f"Rendered zoom level {zoom} of '{layer_dir}': {num_tiles:,} tiles")
+
+    create_viewer(list(layers), out_dir, zooms)
+
+
+def create_viewer(names: list[str], out_dir: str = TILES_DIR, zooms: tuple[int, int] = ZOOMS) -> None:
+    """
+    Write a map that loads the tiles of each layer from the output directory as they are needed. The map does not
+    contain any point, so it opens instantly whatever the number of points.
+    @param names: The names of the layers
+    @param out_dir: The output directory, where the map is saved as `index.html`
+    @param zooms: The first and last zoom levels of the tiles
+    """
+    min_lon, min_lat, max_lon, max_lat = SC_BOUNDS
+    m = fm.Map(location=[(min_lat + max_lat) / 2, (min_lon + max_lon) / 2], zoom_start=7, min_zoom=zooms[0])
+
+    for i, name in enumerate(names):
+        fm.TileLayer(
+            tiles=f"{name}/{{z}}/{{x}}/{{y}}.png",  # Relative to the map, so the directory can be moved
+            attr="ALIVE@25",
+            name=name,
+            overlay=True,
+            show=(i == len(names) - 1),  # Only show the last layer at first
+            min_zoom=zooms[0],
+            max_zoom=zooms[1] + 2,
+            max_native_zoom=zooms[1],
+            bounds=[[min_lat, min_lon], [max_lat, max_lon]]  # No requests for tiles outside SC
+        ).add_to(m)
+    fm.LayerControl(collapsed=False).add_to(m)
+
+    f_name: str = os.path.join(out_dir, "index.html")
+    m.save(f_name)
+    print(f"Viewer has been saved as '{f_name}'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the pre-processed points to a pyramid of map tiles")
+    parser.add_argument("files", type=str, nargs='+',
+                        help="The Parquet files written by preprocess.py or incremental.py, one layer per file")
+    parser.add_argument("--out_dir", type=str, default=TILES_DIR,
+                        help=f"The output directory. Default is {TILES_DIR}.")
+    parser.add_argument("--zooms", type=int, nargs=2, default=ZOOMS, metavar=('FIRST', 'LAST'),
+                        help=f"The first and last zoom levels. Default is {ZOOMS[0]} {ZOOMS[1]}.")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="The number of processes. Default is the number of CPUs.")
+    args = parser.parse_args()
+
+    layers = {Path(file).stem: pd.read_parquet(file, columns=['lat', 'lon']) for file in args.files}
+    export_tiles(layers, args.out_dir, tuple(args.zooms), args.processes)
+
+
+if __name__ == "__main__":
+    main()